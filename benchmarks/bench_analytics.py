@@ -0,0 +1,86 @@
+"""
+对比 逐行Pydantic序列化 与 NumPy列式计算 的耗时
+
+运行: python -m benchmarks.bench_analytics [行数]
+"""
+
+import json
+import sys
+import time
+from collections import deque
+from datetime import date, timedelta
+
+from sl.api import analytics, schemas
+
+
+def make_rows(n: int):
+    start = date(2020, 1, 1)
+    return [(start + timedelta(days=i), i * 3, i, i * 2) for i in range(n)]
+
+
+def pydantic_rows(rows):
+    # 现有方式: 每行构建一个模型再序列化，客户端拿到后自己计算
+    items = [
+        schemas.CreateData(date=d, confirmed=c, deaths=de, recovered=r).model_dump(mode='json')
+        for d, c, de, r in rows
+    ]
+    return json.dumps(items)
+
+
+def python_derived(rows, population: int = 1_400_000_000, window: int = 7):
+    # 行式数据拿到后逐行计算同样的派生序列 (原本需要客户端完成的工作)
+    result = []
+    previous = None
+    recent = deque(maxlen=window)
+    for d, c, de, r in rows:
+        item = schemas.CreateData(date=d, confirmed=c, deaths=de, recovered=r).model_dump(mode='json')
+        recent.append(c)
+        item['confirmed_delta'] = c - previous if previous is not None else None
+        item['confirmed_growth'] = (c - previous) / previous if previous else None
+        item['confirmed_rolling_mean'] = sum(recent) / window if len(recent) == window else None
+        item['confirmed_per_100k'] = c * 100_000 / population
+        previous = c
+        result.append(item)
+    return json.dumps(result)
+
+
+def numpy_values(rows):
+    # 同样的原始数据，按列返回
+    columns = analytics.to_columns(rows)
+    result = {'date': [value.isoformat() for value in columns['date']]}
+    result.update({metric: analytics.to_list(columns[metric]) for metric in analytics.METRICS})
+    return json.dumps(result)
+
+
+def numpy_columns(rows):
+    # 一次转换为列数组，向量化计算后按列序列化
+    columns = analytics.to_columns(rows)
+    return json.dumps(analytics.compute(columns, population=1_400_000_000, window=7))
+
+
+def timeit(func, rows, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rows = make_rows(n)
+    baseline = timeit(pydantic_rows, rows)
+    values = timeit(numpy_values, rows)
+    columnar = timeit(numpy_columns, rows)
+    derived = timeit(python_derived, rows)
+    print(f'rows: {n}')
+    print(f'pydantic row-by-row, raw values:            {baseline:.3f}s')
+    print(f'numpy columnar, raw values:                 {values:.3f}s ({baseline / values:.1f}x)')
+    # 派生序列: 行式需要逐行计算，这里只计算 confirmed 一个指标，列式计算全部三个指标
+    print(f'python row-by-row, 4 derived (1 metric):    {derived:.3f}s')
+    print(f'numpy columnar, 4 derived (3 metrics):      {columnar:.3f}s ({derived / columnar:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
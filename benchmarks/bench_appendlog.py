@@ -0,0 +1,57 @@
+"""
+并发追加写文件的吞吐量: 每条记录 open/append/close vs AppendLog 批量写入(不同的 fsync 策略)
+多个线程同时写入，模拟并发触发的后台任务，计时到所有记录都写入文件为止
+
+运行: python -m benchmarks.bench_appendlog [线程数] [每个线程的记录数]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sl.core.appendlog import AppendLog
+
+
+def open_append_close(path: str, record: str):
+    # 原来 bg_task 的写法
+    with open(path, mode='a') as f:
+        f.write(record)
+
+
+def run_threads(threads: int, records: int, write) -> float:
+    start = time.perf_counter()
+    workers = [
+        threading.Thread(target=lambda: [write(f'## {i} 框架精讲\n') for i in range(records)])
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    records = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    total = threads * records
+    print(f'threads: {threads}, records: {total}')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'open_append_close.log')
+        elapsed = run_threads(threads, records, lambda record: open_append_close(path, record))
+        print(f'open/append/close per record: {total / elapsed:10.0f} records/s')
+
+        for fsync in ('never', 'interval', 'batch'):
+            log = AppendLog(os.path.join(directory, f'{fsync}.log'), fsync=fsync)
+            start = time.perf_counter()
+            run_threads(threads, records, log.write)
+            log.close()
+            elapsed = time.perf_counter() - start
+            print(f'AppendLog fsync={fsync:8}:      {total / elapsed:10.0f} records/s '
+                  f'({log.batches} batches, {total / log.batches:.0f} records/batch)')
+
+
+if __name__ == '__main__':
+    main()
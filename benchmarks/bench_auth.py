@@ -0,0 +1,36 @@
+"""
+每次请求的认证开销: 每次都校验JWT签名并构建用户模型 vs 命中token缓存
+
+运行: python -m benchmarks.bench_auth [次数]
+"""
+
+import asyncio
+import sys
+import time
+from datetime import timedelta
+
+from sl.api.endpoints import demo4
+
+
+async def measure(token: str, n: int, cached: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        if not cached:
+            demo4.clear_token_cache()
+        await demo4.jwt_get_current_user(token)
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    token = demo4.create_access_token(data={'sub': 'shilin'}, expires_delta=timedelta(minutes=30))
+    uncached = asyncio.run(measure(token, n, cached=False))
+    demo4.clear_token_cache()
+    cached = asyncio.run(measure(token, n, cached=True))
+    print(f'requests: {n}')
+    print(f'jwt.decode + UserInDB per request: {uncached * 1e6:8.1f}us')
+    print(f'token cache hit:                   {cached * 1e6:8.1f}us ({uncached / cached:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+测量 import sl 的耗时，并检查导入时没有连接数据库
+
+运行: python -m benchmarks.bench_import [次数]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_import(env) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import sl'], env=env, check=True)
+    return time.perf_counter() - start
+
+
+def slowest_modules(env, prefix: str = 'sl', top: int = 10) -> list:
+    """-X importtime 的输出中，按累计耗时排序的项目模块"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import sl'], env=env, check=True, capture_output=True, text=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        # import time:  自身耗时 |  累计耗时 | 模块名(缩进表示层级)
+        self_us, cumulative_us, name = [part.strip() for part in line.split(':', 1)[1].split('|')]
+        if name == prefix or name.startswith(prefix + '.'):
+            modules.append((int(cumulative_us), name))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'bench.db')
+        env = {**os.environ, 'SL_DATABASE_URL': f'sqlite:///{db_path}'}
+        # 第一次导入会生成 .pyc，不计入
+        run_import(env)
+        timings = [run_import(env) for _ in range(n)]
+        print(f'import sl x{n}: median {statistics.median(timings) * 1000:.1f}ms, '
+              f'min {min(timings) * 1000:.1f}ms (including interpreter startup)')
+        print('database file created on import:', os.path.exists(db_path))
+        print('slowest project modules (cumulative):')
+        for cumulative_us, name in slowest_modules(env):
+            print(f'  {cumulative_us / 1000:8.1f}ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+列表接口 get_data 的一页数据: 查询ORM对象 + response_model 校验 vs 只查询需要的列 + TypeAdapter 直接序列化
+1. 原来的方式: select(Data) 构建ORM对象，FastAPI 按 response_model 逐行构建 ReadData 校验，再转换为JSON
+2. 快速路径: select(DATA_COLUMNS) 返回行元组，schemas.dump_data 直接输出JSON字节
+分别统计查询(包括构建ORM对象/行元组)和序列化的耗时，两种方式输出的JSON相同
+
+运行: python -m benchmarks.bench_list_serialization [每页行数] [次数]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from sl.api import curd, schemas
+from sl.api.models import city
+from sl.db.base import Base
+
+# response_model=List[ReadData] 对应的校验和序列化
+READ_DATA_LIST = TypeAdapter(List[schemas.ReadData])
+
+
+def populate(path: str, n: int):
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    with engine.begin() as conn:
+        conn.execute(insert(city.City), [{
+            'id': 1, 'province': 'p', 'country': 'c', 'country_code': 'cc', 'country_population': 1,
+            'created_at': now, 'updated_at': now,
+        }])
+        conn.execute(insert(city.Data), [
+            {'city_id': 1, 'date': date(2000, 1, 1) + timedelta(days=i), 'confirmed': i * 3, 'deaths': i % 7,
+             'recovered': i * 2, 'created_at': now, 'updated_at': now}
+            for i in range(n)
+        ])
+    engine.dispose()
+
+
+async def orm_page(engine, n: int):
+    async with AsyncSession(engine) as db:
+        start = time.perf_counter()
+        data = (await db.execute(curd.select_data(limit=n))).scalars().all()
+        queried = time.perf_counter()
+        # FastAPI 对 response_model 的处理: 校验(从ORM对象构建模型)，转换为JSON类型，再交给响应类
+        items = READ_DATA_LIST.validate_python(data)
+        body = ORJSONResponse(READ_DATA_LIST.dump_python(items, mode='json')).body
+        return queried - start, time.perf_counter() - queried, body
+
+
+async def row_page(engine, n: int):
+    async with AsyncSession(engine) as db:
+        start = time.perf_counter()
+        data = (await db.execute(curd.select_data(limit=n, columns=curd.DATA_COLUMNS))).all()
+        queried = time.perf_counter()
+        body = schemas.dump_data(data)
+        return queried - start, time.perf_counter() - queried, body
+
+
+async def run(path: str, n: int, repeat: int):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+    results = {}
+    for name, page in (('orm + response_model', orm_page), ('columns + TypeAdapter', row_page)):
+        await page(engine, n)
+        query = serialize = 0.0
+        for _ in range(repeat):
+            q, s, body = await page(engine, n)
+            query += q
+            serialize += s
+        results[name] = (query / repeat, serialize / repeat, body)
+    await engine.dispose()
+    return results
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f'rows per page: {n}, repeat: {repeat}')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        populate(path, n)
+        results = asyncio.run(run(path, n, repeat))
+
+    bodies = {body for _, _, body in results.values()}
+    assert len(bodies) == 1, 'responses differ'
+    baseline = sum(results['orm + response_model'][:2])
+    for name, (query, serialize, _) in results.items():
+        total = query + serialize
+        print(f'{name:22}: query {query * 1000:7.2f}ms  serialize {serialize * 1000:7.2f}ms  '
+              f'total {total * 1000:7.2f}ms  ({baseline / total:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+指标中间件的开销: 没有中间件 vs 纯ASGI的 MetricsMiddleware vs 原来两个 @app.middleware('http')
+直接调用ASGI应用，不经过网络，结果只包含框架本身和中间件的耗时
+
+运行: python -m benchmarks.bench_metrics [次数]
+"""
+
+import asyncio
+import sys
+import time
+
+from fastapi import FastAPI
+
+from sl.core.metrics import Metrics, MetricsMiddleware
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    async def read_item(item_id: int):
+        return {'item_id': item_id}
+
+    if stack == 'metrics':
+        app.add_middleware(MetricsMiddleware, metrics=Metrics())
+    elif stack == 'base_http':
+        @app.middleware('http')
+        async def pass_through(request, call_next):
+            return await call_next(request)
+
+        @app.middleware('http')
+        async def add_process_time_header(request, call_next):
+            start = time.time()
+            response = await call_next(request)
+            response.headers['X-Process-Time'] = str(time.time() - start)
+            return response
+    return app
+
+
+async def measure(app, n: int, path: str = '/items/1') -> float:
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': query.encode(), 'headers': [],
+        'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 8000),
+    }
+
+    async def send(message):
+        pass
+
+    async def request():
+        received = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            # 第一次返回请求体，之后等待客户端断开(响应结束后由框架取消)
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        await app(dict(scope), receive, send)
+
+    # 预热: 构建中间件栈
+    for _ in range(100):
+        await request()
+    start = time.perf_counter()
+    for _ in range(n):
+        await request()
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    baseline = asyncio.run(measure(build_app('none'), n))
+    print(f'requests: {n}')
+    print(f'no middleware:              {baseline * 1e6:7.1f}us/request')
+    for name, label in (('metrics', 'MetricsMiddleware (ASGI):  '), ('base_http', "2x @app.middleware('http'):")):
+        elapsed = asyncio.run(measure(build_app(name), n))
+        print(f'{label} {elapsed * 1e6:7.1f}us/request (+{(elapsed - baseline) * 1e6:.1f}us)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+每秒请求数: 原来的 @app.middleware('http') 中间件 vs 纯ASGI中间件(请求id + 计时 + 异常转换)
+两种方式返回相同的响应头，直接调用ASGI应用，不经过网络
+
+运行: python -m benchmarks.bench_middleware [次数]
+"""
+
+import asyncio
+import sys
+import time
+import uuid
+
+from fastapi import FastAPI
+
+from benchmarks.bench_metrics import measure
+from sl.core.middleware import ErrorMappingMiddleware, RequestIdMiddleware, TimingMiddleware
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    async def read_item(item_id: int):
+        return {'item_id': item_id}
+
+    if stack == 'base_http':
+        @app.middleware('http')
+        async def map_errors(request, call_next):
+            try:
+                return await call_next(request)
+            except Exception:
+                from starlette.responses import PlainTextResponse
+                return PlainTextResponse('Internal Server Error', status_code=500)
+
+        @app.middleware('http')
+        async def add_process_time_header(request, call_next):
+            start = time.time()
+            response = await call_next(request)
+            response.headers['X-Process-Time'] = str(time.time() - start)
+            return response
+
+        @app.middleware('http')
+        async def add_request_id(request, call_next):
+            response = await call_next(request)
+            response.headers['X-Request-ID'] = uuid.uuid4().hex
+            return response
+    elif stack == 'asgi':
+        app.add_middleware(ErrorMappingMiddleware)
+        app.add_middleware(TimingMiddleware)
+        app.add_middleware(RequestIdMiddleware)
+    return app
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f'requests: {n}')
+    baseline = None
+    for stack, label in (
+        ('none', 'no middleware:             '),
+        ('base_http', "3x @app.middleware('http'):"),
+        ('asgi', '3x pure ASGI middleware:   '),
+    ):
+        elapsed = asyncio.run(measure(build_app(stack), n))
+        baseline = baseline or elapsed
+        print(f'{label} {1 / elapsed:8.0f} req/s  {elapsed * 1e6:7.1f}us/request '
+              f'(+{(elapsed - baseline) * 1e6:.1f}us)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+服务端响应缓存: 每次都执行接口(查询数据库 + 序列化) vs 命中缓存直接返回响应字节
+直接调用 sl.run:app (包括全部中间件)，数据库使用临时的 SQLite 文件
+1. 顺序请求 get_cities / get_data 的平均耗时
+2. 缓存未命中时同时到达的并发请求，统计实际执行接口的次数
+
+运行: python -m benchmarks.bench_response_cache [每页行数] [次数]
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+directory = tempfile.mkdtemp()
+os.environ.update({
+    'SL_DATABASE_URL': f'sqlite:///{os.path.join(directory, "bench.db")}',
+    'SL_JOB_DB_PATH': os.path.join(directory, 'jobs.db'),
+    'SL_RATE_LIMIT_ENABLED': 'false',
+})
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from benchmarks.bench_metrics import measure  # noqa: E402
+from sl.api.models import city  # noqa: E402
+from sl.core.response_cache import response_cache  # noqa: E402
+from sl.db.base import dispose_engines, get_engine  # noqa: E402
+from sl.db.migrate import init_db  # noqa: E402
+from sl.run import app  # noqa: E402
+
+
+def populate(n: int):
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    with get_engine().begin() as conn:
+        conn.execute(insert(city.City), [
+            {'id': i, 'province': f'p{i}', 'country': 'c', 'country_code': 'cc', 'country_population': i,
+             'created_at': now, 'updated_at': now}
+            for i in range(1, n + 1)
+        ])
+        conn.execute(insert(city.Data), [
+            {'city_id': 1, 'date': date(2000, 1, 1) + timedelta(days=i), 'confirmed': i * 3, 'deaths': i % 7,
+             'recovered': i * 2, 'created_at': now, 'updated_at': now}
+            for i in range(n)
+        ])
+
+
+async def stampede(path: str, concurrency: int) -> int:
+    response_cache.clear()
+    misses = response_cache.misses
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        responses = await asyncio.gather(*[client.get(path) for _ in range(concurrency)])
+    assert all(response.status_code == 200 for response in responses)
+    return response_cache.misses - misses
+
+
+async def run(n: int, repeat: int):
+    await init_db()
+    populate(n)
+    for path in (f'/application/get_cities?limit={n}', f'/application/get_data?limit={n}'):
+        # ttl=0: 写入的记录立即过期，每个请求都执行接口
+        response_cache.ttl = 0
+        uncached = await measure(app, repeat, path=path)
+        response_cache.ttl = None
+        cached = await measure(app, repeat, path=path)
+        print(f'{path:40}: uncached {uncached * 1000:7.3f}ms  cached {cached * 1000:7.3f}ms  '
+              f'({uncached / cached:.0f}x)')
+    print(f'100 concurrent requests on a cold key: endpoint ran {await stampede(path, 100)} time(s)')
+    await dispose_engines()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    print(f'rows per page: {n}, repeat: {repeat}')
+    try:
+        asyncio.run(run(n, repeat))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+列表接口的序列化: JSONResponse(json.dumps) vs ORJSONResponse(orjson)
+1. 只比较 render(): 一页 ReadData 转换成 JSON 字节
+2. 完整的请求: response_model=List[ReadData] 的接口，只有默认响应类不同
+
+运行: python -m benchmarks.bench_responses [每页行数] [次数]
+"""
+
+import asyncio
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from benchmarks.bench_metrics import measure
+from sl.api import schemas
+
+
+def make_rows(n: int) -> list:
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    return [
+        {
+            'id': i, 'city_id': i % 50, 'date': date(2024, 1, 1) + timedelta(days=i % 365),
+            'confirmed': i * 3, 'deaths': i % 7, 'recovered': i * 2, 'created_at': now, 'updated_at': now,
+        }
+        for i in range(n)
+    ]
+
+
+def build_app(response_class, rows: list) -> FastAPI:
+    app = FastAPI(default_response_class=response_class)
+
+    @app.get('/get_data', response_model=List[schemas.ReadData])
+    async def get_data():
+        return rows
+
+    return app
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rows = make_rows(n)
+    # response_model 校验之后交给响应类的内容: 只包含 JSON 基本类型
+    content = [schemas.ReadData(**row).model_dump(mode='json') for row in rows]
+    print(f'rows per page: {n}, repeat: {repeat}')
+
+    timings = {}
+    for response_class in (JSONResponse, ORJSONResponse):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            response_class(content)
+        timings[response_class] = (time.perf_counter() - start) / repeat
+    print(f'render  JSONResponse:   {timings[JSONResponse] * 1000:7.2f}ms')
+    print(f'render  ORJSONResponse: {timings[ORJSONResponse] * 1000:7.2f}ms '
+          f'({timings[JSONResponse] / timings[ORJSONResponse]:.1f}x)')
+
+    for response_class in (JSONResponse, ORJSONResponse):
+        timings[response_class] = asyncio.run(measure(build_app(response_class, rows), repeat, path='/get_data'))
+    print(f'request JSONResponse:   {timings[JSONResponse] * 1000:7.2f}ms')
+    print(f'request ORJSONResponse: {timings[ORJSONResponse] * 1000:7.2f}ms '
+          f'({timings[JSONResponse] / timings[ORJSONResponse]:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
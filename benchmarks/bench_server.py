@@ -0,0 +1,114 @@
+"""
+多进程的扩展性: 用 python -m sl.server 分别启动 1、2、4...个工作进程，压测同一个接口，比较每秒请求数
+压测客户端也使用多个进程，每个进程保持多个 keep-alive 连接，直接收发HTTP报文，避免客户端成为瓶颈
+工作进程数超过CPU核数后不会再提升；客户端和服务端在同一台机器上时会互相抢占CPU
+
+运行: python -m benchmarks.bench_server [最大进程数] [每轮秒数] [路径]
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from sl.server import cpu_count
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+
+async def client(path: str, deadline: float) -> int:
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    request = f'GET {path} HTTP/1.1\r\nHost: {HOST}\r\n\r\n'.encode()
+    count = 0
+    try:
+        while time.monotonic() < deadline:
+            writer.write(request)
+            headers = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in headers.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            await reader.readexactly(length)
+            if not headers.startswith(b'HTTP/1.1 200'):
+                raise RuntimeError(headers.split(b'\r\n', 1)[0].decode())
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+
+def client_process(path: str, connections: int, seconds: float, results):
+    async def run():
+        deadline = time.monotonic() + seconds
+        return sum(await asyncio.gather(*[client(path, deadline) for _ in range(connections)]))
+
+    results.put(asyncio.run(run()))
+
+
+def wait_until_ready(timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, PORT), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def load_test(path: str, seconds: float, clients: int, connections: int) -> float:
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=client_process, args=(path, connections, seconds, results))
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    total = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return total / seconds
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else cpu_count()
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    path = sys.argv[3] if len(sys.argv) > 3 else '/app1/path_num/5'
+    worker_counts = sorted({1, *[2 ** i for i in range(1, 8) if 2 ** i <= max_workers], max_workers})
+    clients = max(2, cpu_count())
+    print(f'cpus: {cpu_count()}, client processes: {clients} x 16 connections, {seconds}s per run, GET {path}')
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            'SL_DATABASE_URL': f'sqlite:///{os.path.join(directory, "bench.db")}',
+            'SL_JOB_DB_PATH': os.path.join(directory, 'jobs.db'),
+            'SL_RATE_LIMIT_ENABLED': 'false',
+        }
+        for workers in worker_counts:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'sl.server', '--host', HOST, '--port', str(PORT), '--workers', str(workers)],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                wait_until_ready()
+                # 预热
+                load_test(path, 1.0, clients, 16)
+                rps = load_test(path, seconds, clients, 16)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(60)
+            baseline = baseline or rps
+            print(f'workers={workers:3}: {rps:10.0f} req/s  speedup {rps / baseline:5.2f}x  '
+                  f'efficiency {rps / baseline / workers:6.1%}')
+
+
+if __name__ == '__main__':
+    main()
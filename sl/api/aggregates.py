@@ -0,0 +1,179 @@
+# 汇总表的增量维护和查询
+# 每次写入 Data 时，在同一个事务中把新数据累加到 country_daily 和 city_rolling，
+# 汇总查询的代价只和返回的行数有关，与历史数据的多少无关
+
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from sl.api.models import city
+
+logger = logging.getLogger('sl.aggregates')
+
+# 滚动合计的天数
+ROLLING_WINDOW = 7
+
+METRICS = ('confirmed', 'deaths', 'recovered')
+
+# 支持 INSERT ... ON CONFLICT DO UPDATE 的数据库；MySQL 使用 INSERT ... ON DUPLICATE KEY UPDATE
+UPSERT_DIALECTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+    'mysql': mysql.insert,
+}
+
+# 重建汇总表时每次读取的行数
+REBUILD_CHUNK_ROWS = 5000
+
+
+def _sum_rows(rows, keys_of):
+    """
+    按 keys_of(row) 返回的键分组累加指标
+    :param rows: 新写入的 Data 数据 (dict)
+    :param keys_of: 返回一行数据影响到的所有汇总键
+    """
+    totals = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for row in rows:
+        for key in keys_of(row):
+            total = totals[key]
+            for metric in METRICS:
+                total[metric] += row.get(metric) or 0
+    return totals
+
+
+def country_deltas(rows, countries: dict) -> list:
+    """每行数据只影响所属国家当天的合计"""
+    totals = _sum_rows(rows, lambda row: [(countries[row['city_id']], row['date'])])
+    return [{'country': country, 'date': date_, **total} for (country, date_), total in totals.items()]
+
+
+def rolling_deltas(rows) -> list:
+    """
+    某天的数据会计入当天及之后 ROLLING_WINDOW - 1 天的滚动合计
+    最后一天数据之后的几天也会写入，查询时由 select_city_rolling 过滤掉
+    """
+    totals = _sum_rows(
+        rows,
+        lambda row: [(row['city_id'], row['date'] + timedelta(days=day)) for day in range(ROLLING_WINDOW)],
+    )
+    return [{'city_id': city_id, 'date': date_, **total} for (city_id, date_), total in totals.items()]
+
+
+def upsert(dialect_name: str, model):
+    """
+    构建累加的 upsert 语句: 主键不存在则插入，已存在则在原值上累加
+    """
+    stmt = UPSERT_DIALECTS[dialect_name](model)
+    if dialect_name == 'mysql':
+        return stmt.on_duplicate_key_update(
+            {metric: getattr(model, metric) + getattr(stmt.inserted, metric) for metric in METRICS}
+        )
+    return stmt.on_conflict_do_update(
+        index_elements=[column.name for column in model.__table__.primary_key],
+        set_={metric: getattr(model, metric) + getattr(stmt.excluded, metric) for metric in METRICS},
+    )
+
+
+def select_countries(city_ids):
+    return select(city.City.id, city.City.country).where(city.City.id.in_(city_ids))
+
+
+def _statements(dialect_name: str, rows: list, countries: dict):
+    """返回需要执行的 (语句, 参数列表)，不支持的数据库不维护汇总表，写入 Data 不受影响"""
+    if dialect_name not in UPSERT_DIALECTS:
+        logger.warning('aggregates are not maintained on %s, run "python -m sl.db.migrate rebuild-aggregates" '
+                       'on a supported database', dialect_name)
+        return []
+    return [
+        (upsert(dialect_name, city.CountryDaily), country_deltas(rows, countries)),
+        (upsert(dialect_name, city.CityRolling), rolling_deltas(rows)),
+    ]
+
+
+# 同步版本 --- 在调用方的事务中执行，不提交
+def apply(db: Session, rows: list):
+    """
+    :param db: 数据库会话
+    :param rows: 新写入的 Data 数据，包含 city_id date confirmed deaths recovered
+    """
+    if not rows:
+        return
+    countries = dict(db.execute(select_countries({row['city_id'] for row in rows})).all())
+    for stmt, params in _statements(db.get_bind().dialect.name, rows, countries):
+        db.execute(stmt, params)
+
+
+# 异步版本
+async def apply_async(db: AsyncSession, rows: list):
+    if not rows:
+        return
+    result = await db.execute(select_countries({row['city_id'] for row in rows}))
+    countries = dict(result.all())
+    for stmt, params in _statements(db.bind.dialect.name, rows, countries):
+        await db.execute(stmt, params)
+
+
+def rebuild(db: Session):
+    """
+    根据 Data 表全量重建汇总表，用于已有的历史数据或修复汇总数据
+    按批读取后复用增量累加的逻辑，不会一次把整张表读入内存
+    """
+    db.execute(delete(city.CountryDaily))
+    db.execute(delete(city.CityRolling))
+    stmt = select(city.Data.city_id, city.Data.date, *[getattr(city.Data, metric) for metric in METRICS])
+    result = db.execute(stmt.execution_options(yield_per=REBUILD_CHUNK_ROWS))
+    for rows in result.partitions(REBUILD_CHUNK_ROWS):
+        apply(db, [dict(row._mapping) for row in rows])
+    db.commit()
+
+
+def backfill(db: Session) -> bool:
+    """
+    汇总表为空而 Data 表已经有数据时(升级前写入的历史数据)重建汇总表，由 python -m sl.db.migrate upgrade 和应用启动时调用
+    :return: 是否执行了重建
+    """
+    has_data = db.execute(select(city.Data.id).limit(1)).first() is not None
+    has_rollups = (
+        db.execute(select(city.CountryDaily.date).limit(1)).first() is not None
+        or db.execute(select(city.CityRolling.date).limit(1)).first() is not None
+    )
+    if not has_data or has_rollups:
+        return False
+    logger.info('aggregates are empty, rebuilding them from existing data')
+    rebuild(db)
+    return True
+
+
+# 查询汇总数据
+def select_country_daily(country: str = None, date_from: date = None, date_to: date = None, limit: int = 1000):
+    stmt = select(city.CountryDaily)
+    if country:
+        stmt = stmt.where(city.CountryDaily.country == country)
+    if date_from:
+        stmt = stmt.where(city.CountryDaily.date >= date_from)
+    if date_to:
+        stmt = stmt.where(city.CountryDaily.date <= date_to)
+    return stmt.order_by(city.CountryDaily.country, city.CountryDaily.date).limit(limit)
+
+
+def select_city_rolling(city_name: str = None, date_from: date = None, date_to: date = None, limit: int = 1000):
+    # 只返回不晚于该城市最后一天数据的日期: 每行一次 data(city_id, date) 索引上的 max 查找，不扫描 Data 表
+    last_date = (
+        select(func.max(city.Data.date))
+        .where(city.Data.city_id == city.CityRolling.city_id)
+        .correlate(city.CityRolling)
+        .scalar_subquery()
+    )
+    stmt = select(city.CityRolling).where(city.CityRolling.date <= last_date)
+    if city_name:
+        stmt = stmt.join(city.City, city.CityRolling.city_id == city.City.id).where(city.City.province == city_name)
+    if date_from:
+        stmt = stmt.where(city.CityRolling.date >= date_from)
+    if date_to:
+        stmt = stmt.where(city.CityRolling.date <= date_to)
+    return stmt.order_by(city.CityRolling.city_id, city.CityRolling.date).limit(limit)
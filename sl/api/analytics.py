@@ -0,0 +1,153 @@
+# 时间序列分析 --- 一次查询取出某个城市的数据，转换为 NumPy 列数组后向量化计算
+# 返回列式数组 {指标: [值...]}，不再逐行构建 Pydantic 模型
+# 按日历天计算: 同一天的多条数据先求和，缺失的日期补齐为连续的日期，
+# 日增量和滑动平均的窗口都是天数而不是行数，与 aggregates 的 7 天滚动合计一致
+
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sl.api import curd
+from sl.api.models import city
+
+METRICS = ('confirmed', 'deaths', 'recovered')
+
+# 每十万人
+PER_CAPITA = 100_000
+
+# 可以返回的序列，默认全部返回
+SERIES = ('value', 'delta', 'growth', 'rolling_mean', 'per_100k')
+
+
+def select_series(city_name: str, date_from: date = None, date_to: date = None):
+    # 只查询计算需要的列，同一天的多条数据求和，每天一行，按日期排序
+    stmt = select(city.Data.date, *[func.sum(getattr(city.Data, metric)).label(metric) for metric in METRICS])
+    stmt = curd.filter_data(stmt, city_name=city_name, date_from=date_from, date_to=date_to)
+    return stmt.group_by(city.Data.date).order_by(city.Data.date)
+
+
+def to_columns(rows) -> dict:
+    """
+    将查询结果的行转换为按天连续的列数组，同一天的多行求和，缺失的日期补0并在 observed 中标记
+    :param rows: (date, confirmed, deaths, recovered) 组成的行
+    :return: {'date': [...], 'observed': bool ndarray, 'confirmed': ndarray, ...}
+    """
+    if not rows:
+        return {
+            'date': [], 'observed': np.zeros(0, dtype=bool),
+            **{metric: np.zeros(0, dtype=np.int64) for metric in METRICS},
+        }
+    dates, *values = zip(*rows)
+    ordinals = np.fromiter((value.toordinal() for value in dates), dtype=np.int64, count=len(dates))
+    first = int(ordinals.min())
+    offsets = ordinals - first
+    days = int(offsets.max()) + 1
+    start = date.fromordinal(first)
+    observed = np.zeros(days, dtype=bool)
+    observed[offsets] = True
+    columns = {'date': [start + timedelta(days=day) for day in range(days)], 'observed': observed}
+    for metric, column in zip(METRICS, values):
+        array = np.zeros(days, dtype=np.int64)
+        np.add.at(array, offsets, np.fromiter(column, dtype=np.int64, count=len(column)))
+        columns[metric] = array
+    return columns
+
+
+def with_missing(values: np.ndarray, missing) -> np.ndarray:
+    """缺失的日期设为 NaN，日增量、增长率和每十万人的比例在这些日期没有值"""
+    values = values.astype(np.float64)
+    if missing is not None:
+        values[missing] = np.nan
+    return values
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    滑动平均，前 window - 1 天数据不足，结果为 NaN；缺失的日期按0计入窗口
+    使用累加和相减，计算量与窗口大小无关
+    """
+    result = np.full(len(values), np.nan)
+    if window <= len(values):
+        cumsum = np.cumsum(values, dtype=np.float64)
+        result[window - 1:] = cumsum[window - 1:]
+        result[window:] -= cumsum[:-window]
+        result[window - 1:] /= window
+    return result
+
+
+def day_over_day(values: np.ndarray):
+    """
+    :return: (日增量, 日增长率)，第一天以及当天或前一天缺失(NaN)时结果为 NaN
+    """
+    values = values.astype(np.float64)
+    delta = np.full(len(values), np.nan)
+    growth = np.full(len(values), np.nan)
+    if len(values) > 1:
+        previous = values[:-1]
+        delta[1:] = values[1:] - previous
+        # 前一天为0时增长率没有意义，保留为 NaN
+        with np.errstate(divide='ignore', invalid='ignore'):
+            growth[1:] = np.where(previous != 0, delta[1:] / previous, np.nan)
+    return delta, growth
+
+
+def per_capita(values: np.ndarray, population: int) -> np.ndarray:
+    if not population:
+        return np.full(len(values), np.nan)
+    return values * (PER_CAPITA / population)
+
+
+def to_list(values: np.ndarray, decimals: int = 4, missing=None) -> list:
+    """
+    转换为可以序列化为JSON的列表，NaN 转换为 None
+    :param missing: 缺失日期的布尔数组，这些位置同样转换为 None
+    """
+    if values.dtype.kind != 'f':
+        result = values.tolist()
+        if missing is not None:
+            for index in np.flatnonzero(missing).tolist():
+                result[index] = None
+        return result
+    result = np.round(values, decimals).tolist()
+    for index in np.flatnonzero(np.isnan(values)).tolist():
+        result[index] = None
+    return result
+
+
+def compute(columns: dict, population: int, window: int = 7, series=SERIES) -> dict:
+    """
+    计算每个指标的原始值、日增量、日增长率、滑动平均、每十万人的比例
+    :param columns: to_columns 的返回值
+    :param population: 国家人口
+    :param window: 滑动平均的天数
+    :param series: 需要返回的序列，只计算需要的部分
+    """
+    result = {'date': [value.isoformat() for value in columns['date']]}
+    observed = columns.get('observed')
+    missing = None if observed is None or observed.all() else ~observed
+    for metric in METRICS:
+        values = columns[metric]
+        computed = {}
+        if 'value' in series:
+            computed['value'] = to_list(values, missing=missing)
+        if 'delta' in series or 'growth' in series:
+            delta, growth = day_over_day(with_missing(values, missing))
+            if 'delta' in series:
+                computed['delta'] = to_list(delta)
+            if 'growth' in series:
+                computed['growth'] = to_list(growth)
+        if 'rolling_mean' in series:
+            computed['rolling_mean'] = to_list(rolling_mean(values, window))
+        if 'per_100k' in series:
+            computed['per_100k'] = to_list(per_capita(with_missing(values, missing), population))
+        result[metric] = computed
+    return result
+
+
+async def city_analytics(db: AsyncSession, city_name: str, population: int, window: int = 7,
+                         date_from: date = None, date_to: date = None, series=SERIES) -> dict:
+    result = await db.execute(select_series(city_name, date_from=date_from, date_to=date_to))
+    columns = to_columns(result.all())
+    return compute(columns, population=population, window=window, series=series)
@@ -0,0 +1,117 @@
+# curd 的异步版本 --- 基于 AsyncSession，等待数据库期间让出事件循环
+# 查询语句与同步版本共用，定义在 curd.py 中
+
+from datetime import date
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sl.api import schemas, curd, aggregates
+from sl.api.models import city
+from sl.core.cache import MISSING
+
+
+# 查询城市的数据
+async def get_city(db: AsyncSession, city_id: int):
+    result = await db.execute(curd.select_city(city_id))
+    return result.scalars().first()
+
+
+# 通过省份查询城市数据
+async def get_city_by_name(db: AsyncSession, city_name: str):
+    result = await db.execute(curd.select_city_by_name(city_name))
+    return result.scalars().first()
+
+
+# 通过省份查询城市数据 -- 先查缓存，未命中再查询数据库，缓存与同步版本共用
+async def get_city_by_name_cached(db: AsyncSession, city_name: str):
+    cached = curd.city_cache.get(city_name)
+    if cached is not MISSING:
+        return cached
+    db_city = await get_city_by_name(db=db, city_name=city_name)
+    if db_city is None:
+        return None
+    payload = schemas.ReadCity.model_validate(db_city)
+    curd.city_cache.set(city_name, payload)
+    return payload
+
+
+# 获取到指定范围内的城市数据  -- 分页操作
+# 只查询 CITY_COLUMNS，返回行元组(可以按属性访问)，由 schemas.dump_city_page 直接序列化
+async def get_cities(db: AsyncSession, skip: int = 0, limit: int = 10, after_id: int = None):
+    result = await db.execute(curd.select_cities(skip=skip, limit=limit, after_id=after_id, columns=curd.CITY_COLUMNS))
+    return result.all()
+
+
+# 一页城市数据的版本 (行数, 最小id, 最大id, 最大更新时间)，只读取 id 和 updated_at
+async def get_cities_version(db: AsyncSession, skip: int = 0, limit: int = 10, after_id: int = None):
+    result = await db.execute(curd.select_cities_version(skip=skip, limit=limit, after_id=after_id))
+    return result.one()
+
+
+# 创建城市数据
+async def create_city(db: AsyncSession, citys: schemas.CreateCity):
+    db_city = city.City(**citys.model_dump())
+    db.add(db_city)
+    await db.commit()
+    # 刷新数据 -- 取回数据库生成的 id 和创建时间
+    await db.refresh(db_city)
+    curd.city_cache.delete(db_city.province)
+    return db_city
+
+
+# 获取到指定城市的指定范围内的数据 -- 只查询 DATA_COLUMNS，返回行元组
+async def get_data(db: AsyncSession, city_name: str = None, skip: int = 0, limit: int = 10, after: tuple = None,
+                   date_from: date = None, date_to: date = None):
+    stmt = curd.select_data(city_name=city_name, skip=skip, limit=limit, after=after, date_from=date_from,
+                            date_to=date_to, columns=curd.DATA_COLUMNS)
+    result = await db.execute(stmt)
+    return result.all()
+
+
+async def get_data_version(db: AsyncSession, city_name: str = None, skip: int = 0, limit: int = 10,
+                           after: tuple = None, date_from: date = None, date_to: date = None):
+    stmt = curd.select_data_version(city_name=city_name, skip=skip, limit=limit, after=after, date_from=date_from,
+                                    date_to=date_to)
+    result = await db.execute(stmt)
+    return result.one()
+
+
+# 创建城市详细数据
+async def create_city_data(db: AsyncSession, data: schemas.CreateData, city_id: int):
+    db_data = city.Data(**data.model_dump(), city_id=city_id)
+    db.add(db_data)
+    # 在同一个事务中更新汇总表
+    await aggregates.apply_async(db, [{**data.model_dump(), 'city_id': city_id}])
+    await db.commit()
+    await db.refresh(db_data)
+    return db_data
+
+
+# 查询多个省份对应的城市id
+async def get_city_ids(db: AsyncSession, provinces) -> dict:
+    result = await db.execute(curd.select_city_ids(provinces))
+    return dict(result.all())
+
+
+# 批量创建城市详细数据 -- executemany 一次写入一批，不提交事务，由调用方统一提交
+async def create_city_data_batch(db: AsyncSession, rows: list) -> int:
+    if rows:
+        await db.execute(insert(city.Data), rows)
+        await aggregates.apply_async(db, rows)
+    return len(rows)
+
+
+# 查询汇总数据
+async def get_country_daily(db: AsyncSession, country: str = None, date_from: date = None, date_to: date = None,
+                            limit: int = 1000):
+    stmt = aggregates.select_country_daily(country=country, date_from=date_from, date_to=date_to, limit=limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+async def get_city_rolling(db: AsyncSession, city_name: str = None, date_from: date = None, date_to: date = None,
+                           limit: int = 1000):
+    stmt = aggregates.select_city_rolling(city_name=city_name, date_from=date_from, date_to=date_to, limit=limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
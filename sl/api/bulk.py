@@ -0,0 +1,72 @@
+# 批量导入请求体的解析
+# 支持两种格式:
+# 1. application/json: BulkData 组成的列表
+# 2. application/x-ndjson: 每行一个 BulkData 的JSON对象，边接收边解析，不需要把整个请求体读入内存
+
+from typing import List
+
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+
+from sl.api import schemas
+
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+
+# 预先构建好校验器，避免每次请求重复构建
+bulk_list_adapter = TypeAdapter(List[schemas.BulkData])
+
+
+def is_ndjson(request: Request) -> bool:
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    return content_type in NDJSON_MEDIA_TYPES
+
+
+async def read_json_records(request: Request) -> List[schemas.BulkData]:
+    """读取JSON列表格式的请求体并校验"""
+    body = await request.body()
+    try:
+        return bulk_list_adapter.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+
+async def iter_list_batches(records: list, batch_size: int):
+    """将已经读取好的列表按批次切分"""
+    for start in range(0, len(records), batch_size):
+        yield records[start:start + batch_size]
+
+
+async def iter_ndjson_batches(request: Request, batch_size: int):
+    """
+    边接收请求体边按行解析，每凑够 batch_size 条数据返回一批
+    :param request: 请求对象
+    :param batch_size: 每批的数据条数
+    """
+    batch = []
+    buffer = b''
+    line_no = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                batch.append(_parse_line(line, line_no))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    # 最后一行可能没有换行符
+    if buffer.strip():
+        batch.append(_parse_line(buffer, line_no + 1))
+    if batch:
+        yield batch
+
+
+def _parse_line(line: bytes, line_no: int) -> schemas.BulkData:
+    try:
+        return schemas.BulkData.model_validate_json(line)
+    except ValidationError as e:
+        # 错误位置中带上行号，方便定位出错的数据
+        errors = [{**error, 'loc': (line_no, *error['loc'])} for error in e.errors()]
+        raise RequestValidationError(errors)
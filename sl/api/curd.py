@@ -1,23 +1,175 @@
+from datetime import date
+
+from sqlalchemy import select, tuple_, insert, func
 from sqlalchemy.orm import Session
 
-from sl.api import schemas
+from sl.api import schemas, aggregates
 from sl.api.models import city, user
+from sl.core.cache import CacheBackend, MemoryCache, MISSING
+from sl.core.config import get_settings
+
+# 省份 --> ReadCity 的缓存；城市表几乎不变，创建城市时失效对应的省份
+# 多进程部署时调用 set_city_cache() 替换为共享的缓存后端
+city_cache: CacheBackend = MemoryCache(maxsize=get_settings().city_cache_size, ttl=get_settings().city_cache_ttl)
+
+
+def set_city_cache(backend: CacheBackend):
+    global city_cache
+    city_cache = backend
+
+
+# 构造查询语句 --- 同步的 curd 函数和 async_curd 中的异步函数共用同一份查询语句
+
+def select_city(city_id: int):
+    # 查询模型表中的City模型， 过滤出City.id == 输入的城市id的数据
+    return select(city.City).where(city.City.id == city_id)
+
+
+def select_city_by_name(city_name: str):
+    return select(city.City).where(city.City.province == city_name)
+
+
+# 列表接口只查询这些列，返回行元组而不是ORM对象，顺序与 schemas.CityRow/DataRow 一致
+CITY_COLUMNS = (
+    city.City.province, city.City.country, city.City.country_code, city.City.country_population,
+    city.City.id, city.City.updated_at, city.City.created_at,
+)
+DATA_COLUMNS = (
+    city.Data.date, city.Data.confirmed, city.Data.deaths, city.Data.recovered,
+    city.Data.id, city.Data.city_id, city.Data.updated_at, city.Data.created_at,
+)
+
+
+def select_cities(skip: int = 0, limit: int = 10, after_id: int = None, columns: tuple = None):
+    """
+    :param skip: 旧版的 offset 分页，传入游标时忽略
+    :param limit: 每页数量
+    :param after_id: 游标分页 -- 上一页最后一个城市的id
+    :param columns: 只查询这些列，例如 CITY_COLUMNS；默认查询 City 对象
+    """
+    stmt = select(*columns) if columns else select(city.City)
+    stmt = stmt.order_by(city.City.id).limit(limit)
+    # 游标分页: 从主键索引上直接定位到 after_id 之后
+    if after_id is not None:
+        return stmt.where(city.City.id > after_id)
+    return stmt.offset(skip)
+
+
+def filter_data(stmt, city_name: str = None, date_from: date = None, date_to: date = None):
+    # 是否根据城市进行数据查询
+    if city_name:
+        stmt = stmt.join(city.City, city.Data.city_id == city.City.id).where(city.City.province == city_name)
+    # 日期范围过滤 -- 配合 data(city_id, date) 联合索引为范围查找
+    if date_from:
+        stmt = stmt.where(city.Data.date >= date_from)
+    if date_to:
+        stmt = stmt.where(city.Data.date <= date_to)
+    return stmt
+
+
+def select_data(city_name: str = None, skip: int = 0, limit: int = 10, after: tuple = None,
+                date_from: date = None, date_to: date = None, columns: tuple = None):
+    """
+    :param after: 游标分页 -- 上一页最后一条数据的 (city_id, date, id)
+    :param date_from: 起始日期(包含)
+    :param date_to: 截止日期(包含)
+    :param columns: 只查询这些列，例如 DATA_COLUMNS；默认查询 Data 对象
+    """
+    stmt = select(*columns) if columns else select(city.Data)
+    stmt = filter_data(stmt, city_name=city_name, date_from=date_from, date_to=date_to)
+    # 无论是否按城市查询，都按 (city_id, date, id) 排序后分页，避免一次取出整个城市的历史数据
+    stmt = stmt.order_by(city.Data.city_id, city.Data.date, city.Data.id).limit(limit)
+    if after is not None:
+        return stmt.where(tuple_(city.Data.city_id, city.Data.date, city.Data.id) > tuple_(*after))
+    return stmt.offset(skip)
+
+
+def select_page_version(page):
+    """
+    一页数据的版本: 行数、最小/最大id、最大更新时间，用于生成 ETag/Last-Modified
+    :param page: 只查询 id 和 updated_at 两列的分页语句，与取整页数据使用相同的过滤、排序和分页
+    """
+    sub = page.subquery()
+    return select(func.count(), func.min(sub.c.id), func.max(sub.c.id), func.max(sub.c.updated_at))
+
+
+def select_cities_version(skip: int = 0, limit: int = 10, after_id: int = None):
+    columns = (city.City.id, city.City.updated_at)
+    return select_page_version(select_cities(skip=skip, limit=limit, after_id=after_id, columns=columns))
+
+
+def select_data_version(city_name: str = None, skip: int = 0, limit: int = 10, after: tuple = None,
+                        date_from: date = None, date_to: date = None):
+    columns = (city.Data.id, city.Data.updated_at)
+    return select_page_version(select_data(city_name=city_name, skip=skip, limit=limit, after=after,
+                                           date_from=date_from, date_to=date_to, columns=columns))
+
+
+# 导出的字段 -- 只查询需要的列，不构建ORM对象
+EXPORT_COLUMNS = (
+    city.Data.id, city.Data.city_id, city.Data.date, city.Data.confirmed, city.Data.deaths,
+    city.Data.recovered, city.Data.created_at, city.Data.updated_at,
+)
+
+
+def select_data_export(city_name: str = None, date_from: date = None, date_to: date = None):
+    stmt = filter_data(select(*EXPORT_COLUMNS), city_name=city_name, date_from=date_from, date_to=date_to)
+    return stmt.order_by(city.Data.city_id, city.Data.date, city.Data.id)
+
+
+def select_city_ids(provinces):
+    # 一次查询取出多个省份对应的城市id
+    return select(city.City.province, city.City.id).where(city.City.province.in_(provinces))
+
+
+def build_data_rows(records, city_ids: dict):
+    """
+    将批量导入的数据转换为插入语句的参数列表
+    :param records: BulkData 列表
+    :param city_ids: 省份 --> 城市id
+    :return:
+    """
+    return [
+        {
+            'city_id': city_ids[record.province],
+            'date': record.date,
+            'confirmed': record.confirmed,
+            'deaths': record.deaths,
+            'recovered': record.recovered,
+        }
+        for record in records
+    ]
 
 
 # 查询城市的数据
 def get_city(db: Session, city_id: int):
-    # 通过数据库对象 查询模型表中的City模型， 过滤出City.id == 输入的城市id的数据取出来
-    return db.query(city.City).filter(city.City.id == city_id).first()
+    # 通过数据库对象执行查询语句，取出第一条数据
+    return db.execute(select_city(city_id)).scalars().first()
 
 
 # 通过省份查询城市数据
 def get_city_by_name(db: Session, city_name: str):
-    return db.query(city.City).filter(city.City.province == city_name).first()
+    return db.execute(select_city_by_name(city_name)).scalars().first()
+
+
+# 通过省份查询城市数据 -- 先查缓存，未命中再查询数据库
+# 返回 ReadCity 而不是ORM对象，缓存的数据与数据库会话无关
+def get_city_by_name_cached(db: Session, city_name: str):
+    cached = city_cache.get(city_name)
+    if cached is not MISSING:
+        return cached
+    db_city = get_city_by_name(db=db, city_name=city_name)
+    if db_city is None:
+        # 不存在的城市不缓存，避免其他进程创建城市后这里仍然返回None
+        return None
+    payload = schemas.ReadCity.model_validate(db_city)
+    city_cache.set(city_name, payload)
+    return payload
 
 
 # 获取到指定范围内的城市数据  -- 分页操作
-def get_cities(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(city.City).offset(skip).limit(limit).all()
+def get_cities(db: Session, skip: int = 0, limit: int = 10, after_id: int = None):
+    return db.execute(select_cities(skip=skip, limit=limit, after_id=after_id)).scalars().all()
 
 
 # 创建城市数据
@@ -30,17 +182,17 @@ def create_city(db: Session, citys: schemas.CreateCity):
     db.commit()
     # 刷新数据
     db.refresh(db_city)
+    # 失效缓存
+    city_cache.delete(db_city.province)
     # 将创建好的城市对象返回
     return db_city
 
 
 # 获取到指定城市的指定范围内的数据
-def get_data(db: Session, city_name: str = None, skip: int = 0, limit: int = 10):
-    # 是否根据城市进行数据查询
-    if city_name:
-        return db.query(city.Data).join(city.City, city.Data.city_id == city.City.id).filter(city.City.province == city_name).all()
-    # 不按城市查询则根据模型类中的数据格式进行数据查询切片并返回
-    return db.query(city.Data).offset(skip).limit(limit).all()
+def get_data(db: Session, city_name: str = None, skip: int = 0, limit: int = 10, after: tuple = None,
+             date_from: date = None, date_to: date = None):
+    stmt = select_data(city_name=city_name, skip=skip, limit=limit, after=after, date_from=date_from, date_to=date_to)
+    return db.execute(stmt).scalars().all()
 
 
 # 创建城市详细数据
@@ -48,11 +200,21 @@ def create_city_data(db: Session, data: schemas.CreateData, city_id: int):
     # 初始化城市详细数据对象
     db_data = city.Data(**data.model_dump(), city_id=city_id)
     db.add(db_data)
+    # 在同一个事务中更新汇总表
+    aggregates.apply(db, [{**data.model_dump(), 'city_id': city_id}])
     db.commit()
     db.refresh(db_data)
     return db_data
 
 
+# 查询多个省份对应的城市id
+def get_city_ids(db: Session, provinces) -> dict:
+    return dict(db.execute(select_city_ids(provinces)).all())
 
 
-
+# 批量创建城市详细数据 -- executemany 一次写入一批，不提交事务，由调用方统一提交
+def create_city_data_batch(db: Session, rows: list) -> int:
+    if rows:
+        db.execute(insert(city.Data), rows)
+        aggregates.apply(db, rows)
+    return len(rows)
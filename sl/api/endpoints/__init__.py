@@ -4,3 +4,4 @@ from .demo3 import app3
 from .demo4 import app4
 from .demo5 import app5
 from .demo6 import app6
+from .admin import admin
@@ -0,0 +1,79 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from sl.api import curd
+from sl.core.config import get_settings
+from sl.core.jobs import job_queue
+from sl.core.response_cache import response_cache
+from sl.db.instrumentation import query_stats
+
+"""运行状态查询"""
+
+admin_bearer = HTTPBearer(auto_error=False)
+
+
+async def require_admin(credentials: Optional[HTTPAuthorizationCredentials] = Depends(admin_bearer)):
+    """
+    校验管理员token: 没有配置 admin_token 时整个 /admin 不可用，返回 404；token 不正确返回 401
+    统计和任务参数(例如邮箱)不能公开给所有人
+    """
+    admin_token = get_settings().admin_token
+    if not admin_token:
+        raise HTTPException(status_code=404, detail='Not Found')
+    # 使用常量时间的比较，避免通过响应时间猜出token
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), admin_token.encode()):
+        raise HTTPException(status_code=401, detail='Invalid admin token', headers={'WWW-Authenticate': 'Bearer'})
+
+
+admin = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@admin.get('/db/queries')
+async def db_queries(limit: int = 50):
+    """
+    按总耗时从高到低返回每类SQL语句的统计
+    :param limit: 返回的语句数量
+    :return: 执行次数、耗时、影响的行数(驱动没有报告时为 null)和耗时分布
+    """
+    return {
+        'slow_ms': query_stats.slow_ms,
+        'sample_rate': query_stats.sample_rate,
+        'queries': query_stats.snapshot()[:limit],
+    }
+
+
+@admin.delete('/db/queries')
+async def reset_db_queries():
+    """清空统计"""
+    query_stats.reset()
+    return {'message': 'ok'}
+
+
+@admin.get('/cache')
+async def cache_stats():
+    """缓存的命中情况"""
+    return {'city': curd.city_cache.stats(), 'response': response_cache.stats()}
+
+
+# 后台任务的查询读取队列文件，使用 def 由线程池执行，不阻塞事件循环
+@admin.get('/jobs')
+def jobs(status: str = None, limit: int = 50):
+    """
+    后台任务队列的状态
+    :param status: 只返回这个状态的任务 queued/running/done/failed
+    :param limit: 返回的任务数量
+    :return: 各个状态的任务数和最近的任务
+    """
+    return {'counts': job_queue.counts(), 'jobs': job_queue.recent(status=status, limit=limit)}
+
+
+@admin.get('/jobs/{job_id}')
+def job(job_id: int):
+    """单个任务的状态、执行次数和最后一次的错误"""
+    result = job_queue.get(job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return result
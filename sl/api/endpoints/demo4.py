@@ -1,3 +1,4 @@
+import time
 from datetime import timedelta, datetime
 from typing import Optional, Union, List
 
@@ -6,7 +7,10 @@ from fastapi import APIRouter, Form, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from starlette import status
-from passlib.context import CryptContext
+
+from sl.core.cache import CacheBackend, ExpiringSet, MemoryCache, MISSING
+from sl.core.config import get_settings
+from sl.core.security import pwd_context, password_hasher, PasswordHasherBusy
 
 app4 = APIRouter()
 
@@ -278,8 +282,7 @@ class Token(BaseModel):
     token_type: str
 
 
-# 加密密码的方法
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# 加密密码的方法 -- 定义在 sl/core/security.py 中
 
 # 签发token的方法
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/app4/jwt/token")
@@ -291,6 +294,11 @@ def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# 校验密码 -- 在线程池中执行，不阻塞事件循环
+async def verify_password_async(plain_password: str, hashed_password: str):
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
 # 获取签发认证后的用户
 def jwt_get_user(db, username: str):
     # 判断用户是否存在数据库中
@@ -302,14 +310,14 @@ def jwt_get_user(db, username: str):
 
 
 # JWT认证用户
-def jwt_authenticate_user(db, username: str, password: str):
+async def jwt_authenticate_user(db, username: str, password: str):
     # 首先获取到签发认证的用户
     user = jwt_get_user(db=db, username=username)
     if not user:
         # 签发不成功，返回失败
         return False
     # 签发成功则校验密码
-    if not verify_password(plain_password=password, hashed_password=user.hashed_password):
+    if not await verify_password_async(plain_password=password, hashed_password=user.hashed_password):
         return False
     # 密码正确返回用户对象
     return user
@@ -340,7 +348,15 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 @app4.post('/jwt/token', response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     # 认证用户
-    user = jwt_authenticate_user(db=fake_users_db, username=form_data.username, password=form_data.password)
+    try:
+        user = await jwt_authenticate_user(db=fake_users_db, username=form_data.username, password=form_data.password)
+    except PasswordHasherBusy:
+        # 同时登录的请求太多，等待超时
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many login attempts, please retry later',
+            headers={'Retry-After': '1'}
+        )
     if not user:
         # 认证不通过抛出异常
         raise HTTPException(
@@ -359,14 +375,56 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {'access_token': access_token, 'token_type': 'bearer'}
 
 
-# 创建依赖 --- 获取当前登录的用户
-async def jwt_get_current_user(token: str = Depends(oauth2_scheme)):
+# token校验结果的缓存: token --> (解码后的claims, 用户对象)
+# 同一个客户端重复请求时跳过签名校验和用户模型的构建；缓存时间不超过token的过期时间
+token_cache: CacheBackend = MemoryCache(
+    maxsize=get_settings().auth_token_cache_size, ttl=get_settings().auth_token_cache_ttl
+)
+# 已注销的token，保留到token过期为止，不会因为容量被提前淘汰；满了之后拒绝新的注销请求
+# token_cache 和 revoked_tokens 都只在当前进程的内存中: 多进程部署时注销只对处理这次注销请求的进程生效，
+# 其他进程在token过期之前仍然接受它；需要跨进程注销时把两者换成共享存储(例如基于Redis实现 CacheBackend)
+revoked_tokens = ExpiringSet(maxsize=get_settings().auth_revoked_tokens_max)
+
+
+def revoke_token(token: str, expire: Optional[float] = None):
+    """
+    注销token: 在token过期之前拒绝该token，并从缓存中删除
+    :param token: 需要注销的token
+    :param expire: token的过期时间戳，为空时表示token不会过期，一直保留
+    """
+    ttl = expire - time.time() if expire else None
+    if ttl is not None and ttl <= 0:
+        return
+    if not revoked_tokens.add(token, ttl=ttl):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Too many revoked tokens, try again later'
+        )
+    token_cache.delete(token)
+
+
+def clear_token_cache():
+    """用户信息变更(禁用、修改权限等)后清空缓存，后续请求重新校验"""
+    token_cache.clear()
+
+
+def verify_token(token: str):
+    """
+    校验token并查找用户，结果缓存到token过期为止(不超过缓存的最长时间)
+    :return: (解码后的claims, 用户对象)
+    """
     # 定义一个异常对象， 方便下面多次调用
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate credentials',
         headers={'WWW-Authenticate': 'Bearer'}
     )
+    # 缓存命中则直接返回
+    cached = token_cache.get(token)
+    if cached is not MISSING:
+        return cached
+    # 已注销的token
+    if token in revoked_tokens:
+        raise credentials_exception
     try:
         # 对token进行解码
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -383,6 +441,16 @@ async def jwt_get_current_user(token: str = Depends(oauth2_scheme)):
     user = jwt_get_user(db=fake_users_db, username=username)
     if not user:
         raise credentials_exception
+    # 缓存到token过期为止(不超过缓存的最长时间)
+    ttl = min(payload['exp'] - time.time(), get_settings().auth_token_cache_ttl) if payload.get('exp') else None
+    if ttl is None or ttl > 0:
+        token_cache.set(token, (payload, user), ttl=ttl)
+    return payload, user
+
+
+# 创建依赖 --- 获取当前登录的用户
+async def jwt_get_current_user(token: str = Depends(oauth2_scheme)):
+    _, user = verify_token(token)
     return user
 
 
@@ -397,3 +465,12 @@ async def jwt_get_current_active_user(current_user: User = Depends(jwt_get_curre
 @app4.post('/jwt/users/me')
 async def jwt_read_users_me(current_user: User = Depends(jwt_get_current_active_user)):
     return current_user
+
+
+# 注销当前token
+@app4.post('/jwt/logout')
+async def jwt_logout(token: str = Depends(oauth2_scheme)):
+    # 校验过的claims，通常直接来自缓存
+    claims, _ = verify_token(token)
+    revoke_token(token, expire=claims.get('exp'))
+    return {'message': 'Logged out'}
@@ -1,56 +1,140 @@
 import time
-from typing import List, Optional
+from typing import Optional
 
-from fastapi import APIRouter, File, UploadFile, BackgroundTasks, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel, Field
 
-app5 = APIRouter()
+from sl.api.resumable import UploadStore
+from sl.api.uploads import multipart_body, receive_files
+from sl.core.appendlog import readme_log
+from sl.core.config import get_settings
+from sl.core.jobs import job_queue
 
-"""Request Files 单文件多文件上次及参数详解"""
+settings = get_settings()
 
+app5 = APIRouter()
 
-@app5.post('/file')
-async def file_(file: bytes = File(...)):  # 如果要上传多个文件 files: List[bytes] = File(...)
-    """使用File类 文件内容会以bytes的形式读入内存，适合于上次小文件"""
-    return {"file_size": len(file)}
+"""Request Files 单文件多文件上次及参数详解"""
 
 
-@app5.post('/upload_files')
-async def upload_files(files: List[UploadFile] = File(...)):  # 如果要上传单个文件 files: UploadFile = file(...)
+@app5.post('/file', openapi_extra=multipart_body('file', multiple=False))
+async def file_(request: Request):  # 原来的写法 file: bytes = File(...) 会把文件内容全部读入内存
+    """
+    使用File类 文件内容会以bytes的形式读入内存，只适合于上传小文件；
+    这里改为流式接收，只允许一个文件
+    """
+    result = await receive_files(
+        request,
+        settings.upload_dir,
+        max_file_size=settings.upload_max_file_size,
+        max_request_size=settings.upload_max_request_size,
+        max_files=1,
+        chunk_size=settings.upload_chunk_size,
+    )
+    if not result['files']:
+        raise HTTPException(status_code=400, detail='No file uploaded')
+    return {"file_size": result['files'][0]['size'], **result['files'][0]}
+
+
+@app5.post('/upload_files', openapi_extra=multipart_body('files'))
+async def upload_files(request: Request):  # 原来的写法 files: List[UploadFile] = File(...)
+    """
+    多文件上传，不使用 UploadFile: UploadFile 要等整个请求体接收完(写入临时文件)才调用视图函数，
+    这里边接收边写入 upload_dir，按块计算大小和校验和(sha256、md5)，超过单个文件或整个请求的限制时立即返回 413
+    :return: 每个文件保存的文件名(相对于 upload_dir)、大小、校验和，以及接收的吞吐量
     """
-    使用UploadFile类的优势:
-    1.文件存储在内存中，使用的内存达到阈值后，将被保存在磁盘中
-    2.适合于图片、视频大文件
-    3.可以获取上传的文件的元数据，如文件名，创建时间等
-    4.有文件对象的异步接口
-    5.上次的文件是Python文件对象，可以使用write(), read(), seek(), close()操作
+    result = await receive_files(
+        request,
+        settings.upload_dir,
+        max_file_size=settings.upload_max_file_size,
+        max_request_size=settings.upload_max_request_size,
+        max_files=settings.upload_max_files,
+        chunk_size=settings.upload_chunk_size,
+    )
+    if not result['files']:
+        raise HTTPException(status_code=400, detail='No file uploaded')
+    result['filename'] = result['files'][0]['filename']
+    result['content_type'] = result['files'][0]['content_type']
+    return result
+
+
+"""可续传的分块上传: 大文件分成多块并行上传，断线后只补传缺少的部分"""
+
+upload_store = UploadStore(
+    settings.upload_dir,
+    max_file_size=settings.upload_max_file_size,
+    max_chunk_size=settings.upload_max_chunk_size,
+    buffer_size=settings.upload_chunk_size,
+    session_ttl=settings.upload_session_ttl,
+)
+
+
+class CreateUpload(BaseModel):
+    filename: str
+    size: int = Field(..., ge=0, description='文件的总字节数')
+
+
+@app5.post('/uploads')
+async def create_upload(upload: CreateUpload):
+    """创建上传会话，返回 upload_id 和每一块的最大字节数"""
+    return upload_store.create(upload.filename, upload.size)
+
+
+@app5.put('/uploads/{upload_id}', openapi_extra={'requestBody': {
+    'required': True, 'content': {'application/octet-stream': {'schema': {'type': 'string', 'format': 'binary'}}},
+}})
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
     """
-    for file in files:
-        contents = await file.read()
-        print(contents)
-    return {"filename": files[0].filename, "content_type": files[0].content_type}
+    上传从 offset 开始的一块，请求体就是这一块的内容
+    同一个 offset 重传会替换原来的块，和其他块重叠返回 409
+    """
+    return await upload_store.put_chunk(upload_id, offset, request)
+
+
+@app5.get('/uploads/{upload_id}')
+async def get_upload(upload_id: str):
+    """已经收到的区间、缺少的区间和是否可以完成"""
+    return upload_store.get(upload_id).status()
+
+
+@app5.post('/uploads/{upload_id}/complete')
+async def complete_upload(upload_id: str):
+    """按 offset 顺序拼接所有的块，生成最终文件"""
+    return await upload_store.complete(upload_id)
+
+
+@app5.delete('/uploads/{upload_id}')
+async def abort_upload(upload_id: str):
+    """放弃上传，删除已经收到的块"""
+    upload_store.abort(upload_id)
+    return {'message': 'ok'}
 
 
+@job_queue.task('bg_task')
 def bg_task(framework: str):
-    with open("README.md", mode="a") as f:
-        f.write(f"## {framework} 框架精讲")
+    # 放入写队列，由写线程批量追加到 README.md
+    readme_log.write(f"## {framework} 框架精讲")
+    # 等待写入磁盘后任务才算完成: 进程在写入之前崩溃时任务不会被标记为完成，租约到期后重新执行
+    # (重新执行时可能重复追加同一行，任务队列保证的是至少执行一次)
+    if not readme_log.flush(timeout=settings.job_lease / 2, durable=True):
+        raise TimeoutError('README.md append was not flushed in time')
 
 
 @app5.post("/background_tasks")
-async def run_bg_task(framework: str, background_tasks: BackgroundTasks):
+async def run_bg_task(framework: str):
     """
     :param framework: 被调用的后台任务函数的参数
-    :param background_tasks: FastAPI.BackgroundTasks
-    :return:
+    :return: 任务id，可以通过 /jobs/{job_id} 查询状态
     """
-    # 模拟执行耗时任务
-    background_tasks.add_task(bg_task, framework)
-    return {"message": "任务已在后台运行"}
+    # 模拟执行耗时任务: 写入后台任务队列，由工作线程执行，不占用处理请求的资源
+    job_id = await job_queue.enqueue_async('bg_task', framework)
+    return {"message": "任务已在后台运行", "job_id": job_id}
 
 
-def continue_write_readme(background_tasks: BackgroundTasks, q: Optional[str] = None):
+def continue_write_readme(q: Optional[str] = None):
     if q:
-        background_tasks.add_task(bg_task,
-                                  "\n> 整体的介绍 FastAPI，快速上手开发，结合 API 交互文档逐个讲解核心模块的使用\n")
+        # 同步的依赖在线程池中执行，可以直接写入队列
+        job_queue.enqueue('bg_task', "\n> 整体的介绍 FastAPI，快速上手开发，结合 API 交互文档逐个讲解核心模块的使用\n")
     return q
 
 
@@ -0,0 +1,52 @@
+# 数据导出 --- 服务端游标逐批读取，边查询边输出，内存占用与表的大小无关
+
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sl.api import curd
+from sl.db.base import get_async_sessionmaker
+
+# 每次从数据库游标中取出的行数，也是每次写入响应的行数
+EXPORT_CHUNK_ROWS = 1000
+
+EXPORT_FIELDS = [column.key for column in curd.EXPORT_COLUMNS]
+
+EXPORT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def encode_ndjson(rows) -> str:
+    return ''.join(json.dumps(dict(row._mapping), default=_json_default, ensure_ascii=False) + '\n' for row in rows)
+
+
+def encode_csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+async def stream_data(fmt: str, city_name: str = None, date_from: date = None, date_to: date = None):
+    """
+    逐批导出数据
+    会话在生成器内部创建，保证整个响应发送期间数据库连接可用
+    :param fmt: 导出格式 ndjson / csv
+    """
+    stmt = curd.select_data_export(city_name=city_name, date_from=date_from, date_to=date_to)
+    encode = encode_csv if fmt == 'csv' else encode_ndjson
+    if fmt == 'csv':
+        yield encode_csv([EXPORT_FIELDS])
+    async with get_async_sessionmaker()() as db:
+        # stream() 使用服务端游标(stream_results)，yield_per 控制每次从游标中取出的行数
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        async for rows in result.partitions(EXPORT_CHUNK_ROWS):
+            yield encode(rows)
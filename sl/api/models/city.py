@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, func, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, func, ForeignKey, Date, Index
 from sqlalchemy.orm import relationship
 
 from sl.db.base import Base
@@ -48,6 +48,38 @@ class Data(Base):
     created_at = Column(DateTime, server_default=func.now(), comment='创建时间')
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), comment='更新时间')
 
+    # 联合索引: 按城市查询某个日期范围的数据时走索引范围查找，而不是全表扫描
+    __table_args__ = (
+        Index('ix_data_city_id_date', 'city_id', 'date'),
+    )
+
     # 显示类对象的信息
     def __repr__(self):
         return f'{repr(self.date)}：确诊{self.confirmed}例'
+
+
+# 汇总表 --- 写入 Data 时增量维护，汇总查询只读汇总表，不再扫描全部历史数据
+class CountryDaily(Base):
+    # 每个国家每天的合计
+    __tablename__ = 'country_daily'
+    country = Column(String(100), primary_key=True, comment='国家')
+    date = Column(Date, primary_key=True, comment='数据日期')
+    confirmed = Column(BigInteger, default=0, nullable=False, comment='确诊数量')
+    deaths = Column(BigInteger, default=0, nullable=False, comment='死亡数量')
+    recovered = Column(BigInteger, default=0, nullable=False, comment='痊愈数量')
+
+    def __repr__(self):
+        return f'{self.country}_{repr(self.date)}：确诊{self.confirmed}例'
+
+
+class CityRolling(Base):
+    # 每个城市截止到当天(包含)的最近7天合计
+    __tablename__ = 'city_rolling'
+    city_id = Column(Integer, ForeignKey('city.id'), primary_key=True, comment='所属省/直辖市')
+    date = Column(Date, primary_key=True, comment='数据日期')
+    confirmed = Column(BigInteger, default=0, nullable=False, comment='7天确诊数量')
+    deaths = Column(BigInteger, default=0, nullable=False, comment='7天死亡数量')
+    recovered = Column(BigInteger, default=0, nullable=False, comment='7天痊愈数量')
+
+    def __repr__(self):
+        return f'{self.city_id}_{repr(self.date)}：7天确诊{self.confirmed}例'
@@ -0,0 +1,70 @@
+# 游标分页 (keyset pagination)
+# offset 分页需要先扫描并丢弃 skip 行，越往后翻页越慢；游标分页记住上一页最后一行的排序键，
+# 下一页直接从该键之后开始查询，可以走索引，任意深度的翻页代价都相同
+# 响应体仍然是列表(与原来的 skip 分页相同)，下一页的游标放在响应头 X-Next-Cursor 中，
+# 原样传回 cursor 参数获取下一页；最后一页没有这个响应头
+
+import base64
+import json
+from datetime import date
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(values: list) -> str:
+    """
+    将排序键编码为不透明的游标字符串
+    :param values: 上一页最后一行的排序键
+    :return: url安全的base64字符串
+    """
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    解码游标字符串，格式不正确时抛出 ValueError
+    :param cursor: 前端传回的游标(上一页响应头 X-Next-Cursor 的值)
+    :return: 排序键列表
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+# 城市按 (id) 排序
+def city_cursor(cities: list, limit: int):
+    """本页已取满则返回下一页的游标，否则说明已经是最后一页，返回None"""
+    if not cities or len(cities) < limit:
+        return None
+    return encode_cursor([cities[-1].id])
+
+
+def decode_city_cursor(cursor: str) -> int:
+    values = decode_cursor(cursor)
+    if len(values) != 1 or not isinstance(values[0], int):
+        raise ValueError('Invalid cursor')
+    return values[0]
+
+
+# 数据按 (city_id, date, id) 排序
+def data_cursor(data: list, limit: int):
+    if not data or len(data) < limit:
+        return None
+    last = data[-1]
+    return encode_cursor([last.city_id, last.date.isoformat(), last.id])
+
+
+def decode_data_cursor(cursor: str) -> tuple:
+    values = decode_cursor(cursor)
+    if len(values) != 3:
+        raise ValueError('Invalid cursor')
+    city_id, date_, id_ = values
+    if not isinstance(city_id, int) or not isinstance(id_, int) or not isinstance(date_, str):
+        raise ValueError('Invalid cursor')
+    return city_id, date.fromisoformat(date_), id_
@@ -0,0 +1,361 @@
+# 可续传的分块上传
+# 1. POST   /uploads                     创建上传会话，返回 upload_id
+# 2. PUT    /uploads/{upload_id}?offset=  上传从 offset 开始的一块，多块可以并行上传
+# 3. GET    /uploads/{upload_id}          查询已经收到的区间和缺少的区间，断线后只需要补传缺少的部分
+# 4. POST   /uploads/{upload_id}/complete 所有区间都收到后拼接成最终文件
+# 每一块单独保存为 chunks/<offset> 文件，目录中的文件就是收到的区间；
+# 每次处理请求都从 chunks/ 重建区间索引，登记块和完成上传时对会话目录加文件锁，
+# 多个工作进程可以同时处理同一个会话的请求
+# 超过 session_ttl 秒没有新的块的会话视为放弃，创建新会话时顺便清理
+
+import asyncio
+import bisect
+import contextlib
+import errno
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from fastapi import HTTPException, Request
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from sl.api.uploads import safe_filename
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def zero_copy(source, destination, count: int):
+    """
+    把 source 当前位置开始的 count 字节追加到 destination
+    优先使用 copy_file_range / sendfile 在内核中复制，不经过用户态内存；都不支持时退回到普通的读写
+    """
+    # 先把缓冲区写入文件，再直接操作文件描述符
+    destination.flush()
+    src, dst = source.fileno(), destination.fileno()
+    remaining = count
+    for copy in (_copy_file_range, _sendfile):
+        try:
+            while remaining > 0:
+                copied = copy(src, dst, remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            if remaining == 0:
+                return
+        except (AttributeError, OSError) as e:
+            # 不支持的平台或文件系统，换下一种方式
+            if isinstance(e, OSError) and e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                                                          errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+    while remaining > 0:
+        data = source.read(min(remaining, 1024 * 1024))
+        if not data:
+            raise EOFError('Chunk is shorter than expected')
+        destination.write(data)
+        remaining -= len(data)
+
+
+def lock_file(f):
+    """对打开的文件加排他锁，阻塞到其他进程释放为止；文件关闭时自动释放"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:  # pragma: no cover
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _copy_file_range(src: int, dst: int, count: int) -> int:
+    return os.copy_file_range(src, dst, count)
+
+
+def _sendfile(src: int, dst: int, count: int) -> int:
+    return os.sendfile(dst, src, None, count)
+
+
+class UploadSession:
+    """
+    一个上传会话，区间索引由 chunks/ 目录中的文件重建，不依赖进程内存
+    :param directory: 会话目录，保存 meta.json、chunks/，以及完成时创建的 completing 标记
+    :param meta: 文件名、总大小等
+    """
+
+    def __init__(self, directory: str, meta: dict):
+        self.directory = directory
+        self.meta = meta
+        self.chunks_dir = os.path.join(directory, 'chunks')
+        # 已收到的块: 按 offset 排序的 offset 列表，以及 offset --> 长度
+        self.offsets = []
+        self.lengths = {}
+
+    @property
+    def size(self) -> int:
+        return self.meta['size']
+
+    @property
+    def completing(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, 'completing'))
+
+    @classmethod
+    def load(cls, directory: str):
+        """从磁盘读取会话，目录已经被删除(完成或放弃)时返回 404"""
+        try:
+            with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+                session = cls(directory, json.load(f))
+            session.refresh()
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail='Upload not found')
+        return session
+
+    def refresh(self):
+        """根据 chunks/ 中的文件重建索引，包括其他进程写入的块"""
+        self.offsets, self.lengths = [], {}
+        for name in os.listdir(self.chunks_dir):
+            if name.isdigit():
+                self._add(int(name), os.path.getsize(os.path.join(self.chunks_dir, name)))
+
+    def last_activity(self) -> float:
+        """最后一次收到块的时间，块文件改名到 chunks/ 时会更新目录的修改时间"""
+        return max(os.path.getmtime(self.chunks_dir), self.meta['created_at'])
+
+    @contextlib.contextmanager
+    def locked(self):
+        """对会话加文件锁，拿到锁之后重新读取索引"""
+        try:
+            f = open(os.path.join(self.directory, 'lock'), 'a')
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail='Upload not found')
+        with f:
+            lock_file(f)
+            # 等待锁的期间会话可能已经被完成或放弃
+            if not os.path.exists(os.path.join(self.directory, 'meta.json')):
+                raise HTTPException(status_code=404, detail='Upload not found')
+            self.refresh()
+            yield
+
+    def chunk_path(self, offset: int) -> str:
+        return os.path.join(self.chunks_dir, f'{offset:020d}')
+
+    def overlaps(self, offset: int, length: int) -> bool:
+        """是否和其他 offset 的块重叠，相同 offset 的块视为重传，会被替换"""
+        i = bisect.bisect_left(self.offsets, offset)
+        if i > 0:
+            previous = self.offsets[i - 1]
+            if previous + self.lengths[previous] > offset:
+                return True
+        if i < len(self.offsets) and self.offsets[i] == offset:
+            i += 1
+        return i < len(self.offsets) and self.offsets[i] < offset + length
+
+    def _add(self, offset: int, length: int):
+        if offset not in self.lengths:
+            bisect.insort(self.offsets, offset)
+        self.lengths[offset] = length
+
+    def commit(self, temp_path: str, offset: int, length: int):
+        """把写完的临时文件登记为一块，检查重叠和改名在文件锁内完成，不会和其他进程的请求交错"""
+        with self.locked():
+            if self.completing:
+                raise HTTPException(status_code=409, detail='Upload is being completed')
+            if self.overlaps(offset, length):
+                raise HTTPException(status_code=409, detail=f'Chunk at {offset} overlaps a received chunk')
+            os.replace(temp_path, self.chunk_path(offset))
+            self._add(offset, length)
+
+    def begin_complete(self) -> dict:
+        """检查所有区间都已收到并创建 completing 标记，之后不再接受新的块"""
+        with self.locked():
+            status = self.status()
+            if not status['complete']:
+                raise HTTPException(status_code=409,
+                                    detail=f'Upload is incomplete, missing ranges: {status["missing"]}')
+            if self.completing:
+                raise HTTPException(status_code=409, detail='Upload is being completed')
+            open(os.path.join(self.directory, 'completing'), 'w').close()
+        return status
+
+    def cancel_complete(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.directory, 'completing'))
+
+    def ranges(self) -> list:
+        """合并相邻的块，返回已经收到的区间 [start, end)"""
+        merged = []
+        for offset in self.offsets:
+            end = offset + self.lengths[offset]
+            if merged and merged[-1][1] == offset:
+                merged[-1][1] = end
+            else:
+                merged.append([offset, end])
+        return merged
+
+    def missing(self) -> list:
+        gaps, position = [], 0
+        for start, end in self.ranges():
+            if start > position:
+                gaps.append([position, start])
+            position = end
+        if position < self.size:
+            gaps.append([position, self.size])
+        return gaps
+
+    def status(self) -> dict:
+        received = sum(self.lengths.values())
+        return {
+            'upload_id': self.meta['upload_id'],
+            'filename': self.meta['filename'],
+            'size': self.size,
+            'received': received,
+            'chunks': len(self.offsets),
+            'ranges': self.ranges(),
+            'missing': self.missing(),
+            'complete': received == self.size and not self.missing(),
+        }
+
+
+class UploadStore:
+    """
+    保存在本地目录中的上传会话，会话的状态全部在磁盘上，多个进程可以共用同一个目录
+    :param directory: 根目录，会话保存在 directory/.sessions/ 下，完成的文件保存在 directory 下
+    :param max_file_size: 最终文件的最大字节数
+    :param max_chunk_size: 每一块的最大字节数
+    :param buffer_size: 写入块文件时的缓冲大小
+    :param session_ttl: 超过这么多秒没有收到新的块的会话会被删除
+    """
+
+    def __init__(self, directory: str, max_file_size: int, max_chunk_size: int, buffer_size: int = 1024 * 1024,
+                 session_ttl: float = 24 * 3600):
+        self.directory = directory
+        self.sessions_dir = os.path.join(directory, '.sessions')
+        self.max_file_size = max_file_size
+        self.max_chunk_size = max_chunk_size
+        self.buffer_size = buffer_size
+        self.session_ttl = session_ttl
+        self._last_cleanup = 0.0
+
+    def create(self, filename: str, size: int) -> dict:
+        if size < 0 or size > self.max_file_size:
+            raise HTTPException(status_code=413, detail=f'File size must be between 0 and {self.max_file_size}')
+        self.cleanup_expired()
+        upload_id = uuid.uuid4().hex
+        directory = os.path.join(self.sessions_dir, upload_id)
+        os.makedirs(os.path.join(directory, 'chunks'))
+        meta = {'upload_id': upload_id, 'filename': filename, 'size': size, 'created_at': time.time()}
+        # 先写临时文件再改名，其他进程不会读到写了一半的 meta.json
+        with open(os.path.join(directory, 'meta.json.part'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(os.path.join(directory, 'meta.json.part'), os.path.join(directory, 'meta.json'))
+        session = UploadSession(directory, meta)
+        return {**session.status(), 'max_chunk_size': self.max_chunk_size}
+
+    def expired(self, session: UploadSession, now: float = None) -> bool:
+        return (now or time.time()) - session.last_activity() > self.session_ttl
+
+    def get(self, upload_id: str) -> UploadSession:
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise HTTPException(status_code=404, detail='Upload not found')
+        session = UploadSession.load(os.path.join(self.sessions_dir, upload_id))
+        if self.expired(session) and not session.completing:
+            shutil.rmtree(session.directory, ignore_errors=True)
+            raise HTTPException(status_code=404, detail='Upload not found')
+        return session
+
+    def cleanup_expired(self, force: bool = False) -> int:
+        """删除过期的会话，不强制时最多每 session_ttl / 10 秒扫描一次目录"""
+        now = time.time()
+        if not force and now - self._last_cleanup < self.session_ttl / 10:
+            return 0
+        self._last_cleanup = now
+        removed = 0
+        if not os.path.isdir(self.sessions_dir):
+            return removed
+        for name in os.listdir(self.sessions_dir):
+            directory = os.path.join(self.sessions_dir, name)
+            try:
+                session = UploadSession.load(directory)
+            except HTTPException:
+                # 没有 meta.json: 创建到一半或者已经删除了一部分，按目录的修改时间判断
+                if now - os.path.getmtime(directory) <= self.session_ttl:
+                    continue
+            else:
+                if session.completing or not self.expired(session, now):
+                    continue
+            shutil.rmtree(directory, ignore_errors=True)
+            removed += 1
+        return removed
+
+    async def put_chunk(self, upload_id: str, offset: int, request: Request) -> dict:
+        """流式接收一块，写入临时文件后再登记，同一个会话的多块可以同时上传(包括由不同的进程接收)"""
+        session = self.get(upload_id)
+        if offset < 0 or offset >= max(session.size, 1):
+            raise HTTPException(status_code=416, detail=f'Offset must be within [0, {session.size})')
+        temp_path = os.path.join(session.chunks_dir, f'{offset}.{uuid.uuid4().hex}.part')
+        f = await asyncio.to_thread(open, temp_path, 'wb')
+        length = 0
+        buffer = bytearray()
+        try:
+            try:
+                async for data in request.stream():
+                    length += len(data)
+                    if length > self.max_chunk_size:
+                        raise HTTPException(status_code=413, detail=f'Chunk exceeds {self.max_chunk_size} bytes')
+                    if offset + length > session.size:
+                        raise HTTPException(status_code=416, detail='Chunk goes past the end of the file')
+                    buffer += data
+                    if len(buffer) >= self.buffer_size:
+                        data, buffer = bytes(buffer), bytearray()
+                        await asyncio.to_thread(f.write, data)
+                if buffer:
+                    await asyncio.to_thread(f.write, bytes(buffer))
+            finally:
+                await asyncio.to_thread(f.close)
+            if length == 0 and session.size > 0:
+                raise HTTPException(status_code=400, detail='Empty chunk')
+            # 等待文件锁会阻塞，放到线程中执行
+            await asyncio.to_thread(session.commit, temp_path, offset, length)
+        except BaseException:
+            # 连接中断或者校验失败: 这一块作废，客户端从 offset 重传
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return {'offset': offset, 'length': length, **session.status()}
+
+    def _assemble(self, session: UploadSession, path: str):
+        with open(path + '.part', 'wb') as destination:
+            for offset in session.offsets:
+                with open(session.chunk_path(offset), 'rb') as source:
+                    zero_copy(source, destination, session.lengths[offset])
+        os.replace(path + '.part', path)
+        shutil.rmtree(session.directory)
+
+    async def complete(self, upload_id: str) -> dict:
+        """所有区间都收到后拼接成最终文件，删除会话"""
+        session = self.get(upload_id)
+        await asyncio.to_thread(session.begin_complete)
+        path = os.path.join(self.directory, f'{upload_id}-{safe_filename(session.meta["filename"])}')
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._assemble, session, path)
+        except BaseException:
+            session.cancel_complete()
+            raise
+        elapsed = time.perf_counter() - started
+        return {
+            'upload_id': upload_id,
+            'filename': session.meta['filename'],
+            'path': os.path.basename(path),
+            'size': session.size,
+            'chunks': len(session.offsets),
+            'assemble_seconds': round(elapsed, 6),
+        }
+
+    def abort(self, upload_id: str):
+        session = self.get(upload_id)
+        shutil.rmtree(session.directory, ignore_errors=True)
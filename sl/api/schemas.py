@@ -2,9 +2,10 @@
 
 from datetime import datetime
 from datetime import date as date_
+from typing import List
 
-
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import TypedDict
 
 
 # 定义创建数据的格式
@@ -19,6 +20,11 @@ class CreateData(BaseModel):
     recovered: int = 0
 
 
+# 定义批量导入数据的格式 --- 通过省份关联城市
+class BulkData(CreateData):
+    province: str
+
+
 # 定义创建城市数据的格式
 class CreateCity(BaseModel):
     # 省份
@@ -55,3 +61,79 @@ class ReadCity(CreateCity):
     class Config:
         from_attributes = True
 
+
+# 定义汇总数据的格式
+class ReadCountryDaily(BaseModel):
+    country: str
+    date: date_
+    confirmed: int
+    deaths: int
+    recovered: int
+
+    class Config:
+        from_attributes = True
+
+
+class ReadCityRolling(BaseModel):
+    city_id: int
+    # 滚动合计截止的日期(包含)
+    date: date_
+    confirmed: int
+    deaths: int
+    recovered: int
+
+    class Config:
+        from_attributes = True
+
+
+# 定义批量导入的响应格式: 只返回每批写入的行数，不再逐行刷新ORM对象
+class BulkResult(BaseModel):
+    inserted: int
+    batches: List[int]
+
+
+# 列表接口的快速路径: 只查询需要的列，行数据直接按下面的结构序列化为JSON，
+# 不再为每一行构建ORM对象和Pydantic模型；字段和顺序与 ReadCity/ReadData 一致
+class CityRow(TypedDict):
+    province: str
+    country: str
+    country_code: str
+    country_population: int
+    id: int
+    updated_at: datetime
+    created_at: datetime
+
+
+class DataRow(TypedDict):
+    date: date_
+    confirmed: int
+    deaths: int
+    recovered: int
+    id: int
+    city_id: int
+    updated_at: datetime
+    created_at: datetime
+
+
+# 预先构建好序列化器，dump_json 直接输出JSON字节，不做校验
+city_rows_adapter = TypeAdapter(List[CityRow])
+data_rows_adapter = TypeAdapter(List[DataRow])
+
+
+def _row_dicts(rows: list) -> list:
+    # 所有行的列名相同，用 zip 构建字典比逐行调用 row._asdict() 快得多
+    keys = rows[0]._fields if rows else ()
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def dump_cities(rows: list) -> bytes:
+    """
+    :param rows: 按 CITY_COLUMNS 查询出的行
+    :return: 与 List[ReadCity] 相同结构的JSON字节
+    """
+    return city_rows_adapter.dump_json(_row_dicts(rows))
+
+
+def dump_data(rows: list) -> bytes:
+    """与 List[ReadData] 相同结构的JSON字节，rows 按 DATA_COLUMNS 查询"""
+    return data_rows_adapter.dump_json(_row_dicts(rows))
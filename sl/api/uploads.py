@@ -0,0 +1,197 @@
+# 流式接收上传的文件
+# File(...)/UploadFile 会先把整个请求体解析完(bytes 全部读入内存，UploadFile 写入临时文件)才调用视图函数；
+# 这里直接解析 request.stream()，边接收边计算大小和校验和，按块写入目标目录，内存占用只有一个块，
+# 单个文件或整个请求超过限制时立即返回 413，不再继续接收
+
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+# multipart 解析器回调产生的事件
+PART_BEGIN, HEADER_FIELD, HEADER_VALUE, HEADER_END, HEADERS_FINISHED, PART_DATA, PART_END = range(7)
+
+
+def multipart_body(field: str, multiple: bool = True) -> dict:
+    """不使用 File(...) 时，在 openapi_extra 中描述请求体，API 交互文档中仍然可以选择文件上传"""
+    schema = {'type': 'string', 'format': 'binary'}
+    if multiple:
+        schema = {'type': 'array', 'items': schema}
+    return {'requestBody': {'required': True, 'content': {'multipart/form-data': {'schema': {
+        'type': 'object', 'required': [field], 'properties': {field: schema},
+    }}}}}
+
+
+def safe_filename(filename: str) -> str:
+    """只保留文件名，去掉客户端传入的路径"""
+    name = os.path.basename(filename.replace('\\', '/')).strip().lstrip('.')
+    return name or 'upload'
+
+
+class StoredFile:
+    """
+    一个正在写入的文件: 先写入 .part 临时文件，接收完整后再改名
+    :param directory: 目标目录
+    :param field: 表单字段名
+    :param filename: 客户端传入的文件名
+    :param content_type: 文件类型
+    """
+
+    def __init__(self, directory: str, field: str, filename: str, content_type: str):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.path = os.path.join(directory, f'{uuid.uuid4().hex}-{safe_filename(filename)}')
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5()
+        self.buffer = bytearray()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.file = None
+
+    def _write(self, data: bytes):
+        # 在线程中执行: 计算校验和和写文件时 hashlib 和文件IO都会释放GIL
+        if self.file is None:
+            self.file = open(self.path + '.part', 'wb')
+        self.sha256.update(data)
+        self.md5.update(data)
+        self.file.write(data)
+
+    async def flush(self):
+        if self.buffer:
+            data, self.buffer = bytes(self.buffer), bytearray()
+            await asyncio.to_thread(self._write, data)
+
+    def _close(self):
+        if self.file is None:
+            # 空文件
+            self.file = open(self.path + '.part', 'wb')
+        self.file.close()
+        os.replace(self.path + '.part', self.path)
+
+    async def close(self):
+        await self.flush()
+        await asyncio.to_thread(self._close)
+        self.elapsed = time.perf_counter() - self.started
+
+    def discard(self):
+        """出错时删除已经写入的内容"""
+        if self.file is not None:
+            self.file.close()
+        for path in (self.path + '.part', self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def to_dict(self) -> dict:
+        return {
+            'field': self.field,
+            'filename': self.filename,
+            'content_type': self.content_type,
+            # 只返回保存的文件名(相对于上传目录)，不暴露服务器上的路径
+            'path': os.path.basename(self.path),
+            'size': self.size,
+            'sha256': self.sha256.hexdigest(),
+            'md5': self.md5.hexdigest(),
+            'seconds': round(self.elapsed, 6),
+            'mb_per_s': round(self.size / 1e6 / self.elapsed, 2) if self.elapsed else None,
+        }
+
+
+async def receive_files(request: Request, directory: str, max_file_size: int, max_request_size: int = None,
+                        max_files: int = None, chunk_size: int = 1024 * 1024) -> dict:
+    """
+    流式接收 multipart/form-data 请求中的所有文件，非文件字段忽略
+    :param request: 请求对象
+    :param directory: 保存文件的目录
+    :param max_file_size: 单个文件的最大字节数
+    :param max_request_size: 整个请求体的最大字节数
+    :param max_files: 最多的文件数
+    :param chunk_size: 每次写入文件的块大小，也是每个文件占用的内存上限
+    :return: 每个文件的大小、校验和、耗时，以及整个请求的吞吐量
+    """
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    boundary = options.get(b'boundary')
+    if content_type != b'multipart/form-data' or not boundary:
+        raise HTTPException(status_code=400, detail='Expected multipart/form-data with a boundary')
+    os.makedirs(directory, exist_ok=True)
+
+    events = []
+    parser = MultipartParser(boundary, {
+        'on_part_begin': lambda: events.append((PART_BEGIN, b'')),
+        'on_header_field': lambda data, start, end: events.append((HEADER_FIELD, data[start:end])),
+        'on_header_value': lambda data, start, end: events.append((HEADER_VALUE, data[start:end])),
+        'on_header_end': lambda: events.append((HEADER_END, b'')),
+        'on_headers_finished': lambda: events.append((HEADERS_FINISHED, b'')),
+        'on_part_data': lambda data, start, end: events.append((PART_DATA, data[start:end])),
+        'on_part_end': lambda: events.append((PART_END, b'')),
+    })
+
+    started = time.perf_counter()
+    received = 0
+    files = []
+    current = None
+    headers, header_field, header_value = {}, b'', b''
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if max_request_size is not None and received > max_request_size:
+                raise HTTPException(status_code=413, detail=f'Request body exceeds {max_request_size} bytes')
+            parser.write(chunk)
+            for event, data in events:
+                if event == PART_BEGIN:
+                    headers, header_field, header_value = {}, b'', b''
+                elif event == HEADER_FIELD:
+                    header_field += data
+                elif event == HEADER_VALUE:
+                    header_value += data
+                elif event == HEADER_END:
+                    headers[header_field.lower()] = header_value
+                    header_field, header_value = b'', b''
+                elif event == HEADERS_FINISHED:
+                    _, disposition = parse_options_header(headers.get(b'content-disposition', b''))
+                    if b'filename' not in disposition:
+                        current = None
+                        continue
+                    if max_files is not None and len(files) >= max_files:
+                        raise HTTPException(status_code=413, detail=f'At most {max_files} files per request')
+                    current = StoredFile(
+                        directory,
+                        disposition.get(b'name', b'').decode('utf-8', 'replace'),
+                        disposition[b'filename'].decode('utf-8', 'replace'),
+                        headers.get(b'content-type', b'application/octet-stream').decode('latin-1'),
+                    )
+                    files.append(current)
+                elif event == PART_DATA and current is not None:
+                    current.size += len(data)
+                    if current.size > max_file_size:
+                        raise HTTPException(
+                            status_code=413, detail=f'File {current.filename!r} exceeds {max_file_size} bytes',
+                        )
+                    current.buffer += data
+                    if len(current.buffer) >= chunk_size:
+                        await current.flush()
+                elif event == PART_END and current is not None:
+                    await current.close()
+                    current = None
+            events.clear()
+        parser.finalize()
+        if current is not None:
+            raise HTTPException(status_code=400, detail='Incomplete multipart body')
+    except BaseException:
+        # 请求没有完整接收: 删除这个请求已经写入的所有文件
+        for stored in files:
+            stored.discard()
+        raise
+
+    elapsed = time.perf_counter() - started
+    return {
+        'files': [stored.to_dict() for stored in files],
+        'total_bytes': received,
+        'seconds': round(elapsed, 6),
+        'mb_per_s': round(received / 1e6 / elapsed, 2) if elapsed else None,
+    }
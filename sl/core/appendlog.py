@@ -0,0 +1,158 @@
+# 批量追加写文件
+# 每条记录都 open/append/close 一次，并发时开销大，多个线程同时追加还可能交错；
+# 这里 write() 只把记录放进内存队列，由一个写线程按数量或时间攒成一批，一次写入文件
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+from sl.core.config import get_settings
+
+# fsync 策略: never 只写入操作系统缓存; interval 最多每 fsync_interval 秒同步一次; batch 每批写完都同步
+FSYNC_POLICIES = ('never', 'interval', 'batch')
+
+
+class _FlushRequest:
+    """flush() 放入队列的标记: 写线程写完之前的记录后通知等待的线程"""
+
+    __slots__ = ('event', 'durable')
+
+    def __init__(self, durable: bool):
+        self.event = threading.Event()
+        self.durable = durable
+
+
+class AppendLog:
+    """
+    单个写线程的追加日志
+    :param path: 文件路径
+    :param batch_size: 每批最多写入的记录数，达到后立即写入
+    :param flush_interval: 第一条记录到达后最多等待的秒数，超时即使不满一批也写入
+    :param fsync: fsync 策略，见 FSYNC_POLICIES
+    :param fsync_interval: interval 策略下两次 fsync 的最小间隔(秒)
+    :param encoding: 文件编码
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000, flush_interval: float = 0.05, fsync: str = 'interval',
+                 fsync_interval: float = 1.0, encoding: str = 'utf-8'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Invalid fsync policy: {fsync!r}, expected one of {FSYNC_POLICIES}')
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.encoding = encoding
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._atexit = False
+        # 已经写入的记录数和批数
+        self.records = 0
+        self.batches = 0
+
+    def _ensure_started(self):
+        # 第一次写入时才启动写线程
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='append-log', daemon=True)
+                    self._thread.start()
+                    if not self._atexit:
+                        # 进程退出前写完队列中的记录
+                        atexit.register(self.close)
+                        self._atexit = True
+
+    def write(self, record: str):
+        """放入队列后立即返回，不等待写入文件"""
+        self._ensure_started()
+        self._queue.put(record)
+
+    def flush(self, timeout: float = None, durable: bool = False) -> bool:
+        """
+        等待队列中已有的记录写入文件
+        :param durable: 同时 fsync 到磁盘，不受 fsync 策略的影响
+        :return: 超时返回 False
+        """
+        if self._thread is None:
+            return True
+        request = _FlushRequest(durable)
+        self._queue.put(request)
+        return request.event.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """写完队列中的记录并停止写线程，之后再写入会重新启动写线程"""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join(timeout)
+                self._thread = None
+
+    def _next_batch(self, timeout: float = None):
+        """
+        等待第一条记录(最多 timeout 秒)，然后在 flush_interval 内尽量凑满一批
+        :return: (记录, 需要通知的 flush 请求, 是否停止)
+        """
+        records, events = [], []
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return records, events, False
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                return records, events, True
+            if isinstance(item, _FlushRequest):
+                # flush() 要求立即写入
+                events.append(item)
+                return records, events, False
+            records.append(item)
+            if len(records) >= self.batch_size:
+                return records, events, False
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return records, events, False
+
+    def _run(self):
+        last_fsync = time.monotonic()
+        # 已经写入但还没有 fsync 的数据
+        dirty = False
+        with open(self.path, mode='a', encoding=self.encoding) as f:
+            while True:
+                timeout = None
+                if dirty and self.fsync == 'interval':
+                    # 有未同步的数据时不无限等待，到时间就 fsync
+                    timeout = max(0.0, last_fsync + self.fsync_interval - time.monotonic())
+                records, events, stop = self._next_batch(timeout)
+                if records:
+                    f.write(''.join(records))
+                    f.flush()
+                    self.records += len(records)
+                    self.batches += 1
+                    dirty = True
+                now = time.monotonic()
+                if dirty and (self.fsync == 'batch' or self.fsync == 'interval' and (
+                        stop or now - last_fsync >= self.fsync_interval) or any(e.durable for e in events)):
+                    os.fsync(f.fileno())
+                    last_fsync = now
+                    dirty = False
+                for event in events:
+                    event.event.set()
+                if stop:
+                    return
+
+
+settings = get_settings()
+
+# demo5 后台任务追加写入的 README.md
+readme_log = AppendLog(
+    'README.md',
+    batch_size=settings.append_log_batch_size,
+    flush_interval=settings.append_log_flush_interval,
+    fsync=settings.append_log_fsync,
+    fsync_interval=settings.append_log_fsync_interval,
+)
@@ -0,0 +1,140 @@
+# 进程内缓存
+
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+# 用于区分 "缓存未命中" 和 "缓存的值就是None"
+MISSING = object()
+
+
+class CacheBackend:
+    """
+    缓存后端接口
+    默认使用进程内的 MemoryCache；多进程部署时可以实现同样的接口(例如基于Redis)替换进来，
+    让所有进程共享同一份缓存和失效通知
+    """
+
+    def get(self, key, default=MISSING):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl: float = None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """
+    带过期时间的 LRU 缓存，线程安全
+    :param maxsize: 最多缓存的条数，超出后淘汰最久未使用的数据
+    :param ttl: 默认过期时间(秒)，None 表示不过期
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key --> (过期时间, 值)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at is None or expires_at > time.monotonic():
+                    # 命中后移动到末尾，表示最近使用过
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                # 已过期
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            # 超出容量，淘汰最久未使用的数据
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ExpiringSet:
+    """
+    只在过期后才删除的集合，用于不能提前丢弃的数据(例如已注销的token)，线程安全
+    与 MemoryCache 不同，满了之后不淘汰旧数据，而是拒绝新数据
+    :param maxsize: 清理过期数据后最多保存的条数
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # key --> 过期时间，None 表示不过期
+        self._data = {}
+        # (过期时间, key) 的最小堆，按过期时间清理；同一个 key 重新加入后旧的记录在清理时跳过
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            if self._data.get(key) == expires_at:
+                del self._data[key]
+
+    def add(self, key, ttl: float = None) -> bool:
+        """加入集合，保留 ttl 秒；已经满了返回 False"""
+        now = time.monotonic()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._purge(now)
+            if key not in self._data and len(self._data) >= self.maxsize:
+                return False
+            self._data[key] = expires_at
+            if expires_at is not None:
+                heapq.heappush(self._heap, (expires_at, key))
+            return True
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            if key not in self._data:
+                return False
+            expires_at = self._data[key]
+            return expires_at is None or expires_at > time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._purge(time.monotonic())
+            return {'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
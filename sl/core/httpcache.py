@@ -0,0 +1,72 @@
+# HTTP 条件请求 (ETag / Last-Modified)
+# 接口先执行一个只读元数据的查询(行数、最大id、最大更新时间等)生成版本，
+# 客户端带上 If-None-Match / If-Modified-Since 且数据没有变化时直接返回 304，不再查询和序列化整页数据
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def make_etag(*parts) -> str:
+    """
+    根据数据的版本生成弱 ETag -- 由元数据计算而不是响应的字节，相同的版本对应语义相同的响应
+    :param parts: 行数、最大更新时间等
+    """
+    raw = '|'.join(str(part) for part in parts).encode()
+    return f'W/"{hashlib.sha1(raw).hexdigest()[:32]}"'
+
+
+def to_utc(value: datetime) -> datetime:
+    # 数据库中的时间没有时区，SQLite 的 CURRENT_TIMESTAMP 是 UTC 时间
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    # HTTP 日期只精确到秒
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(to_utc(value), usegmt=True)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match 使用弱比较: 忽略 W/ 前缀"""
+    if header.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in header.split(','))
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    客户端缓存的版本是否仍然有效
+    同时带有两个头时只比较 If-None-Match；Last-Modified 只精确到秒，并且删除数据时可能不变，ETag 更可靠
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return to_utc(last_modified) <= since
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime], cache_control: str) -> dict:
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(headers: dict) -> Response:
+    # 304 没有响应体，但要带上 ETag/Cache-Control 等，客户端据此更新缓存
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,317 @@
+# 后台任务队列 --- 保存在SQLite中，进程重启后不会丢失
+# BackgroundTasks 在响应之后由同一个进程执行，重启就丢失，并且和请求处理抢占资源；
+# 这里的任务先写入队列文件，由单独的工作线程(或单独的进程)取出执行，失败后按指数退避重试
+#
+#   @job_queue.task('send_email')
+#   def send_email(email, message): ...
+#
+#   job_id = await job_queue.enqueue_async('send_email', email, message)
+#
+# 单独的工作进程: python -m sl.core.jobs --workers 4 (此时应用配置 SL_JOB_WORKERS=0)
+
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import random
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from sl.core.config import get_settings
+
+logger = logging.getLogger('sl.jobs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    worker TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at);
+"""
+
+COLUMNS = 'id, name, payload, status, attempts, max_attempts, run_at, created_at, updated_at, worker, last_error'
+# 不需要管理员权限就可以查询的字段
+PUBLIC_COLUMNS = 'id, name, status, attempts, max_attempts, created_at, updated_at'
+
+
+class JobQueue:
+    """
+    SQLite 持久化的任务队列和工作线程池
+    队列中的 run_at 表示任务可以被取出的时间: 排队中的任务是计划执行的时间，执行中的任务是租约到期的时间，
+    所以取任务只需要一个条件 status IN (queued, running) AND run_at <= now，进程崩溃后超过租约的任务会被重新执行
+    :param path: 队列文件
+    :param workers: 工作线程数
+    :param max_attempts: 默认的最多执行次数
+    :param backoff: 第一次重试的间隔(秒)，之后每次翻倍
+    :param backoff_max: 重试间隔的上限(秒)
+    :param poll_interval: 空闲时轮询队列的间隔(秒)
+    :param lease: 任务执行的租约(秒)，应大于任务的最长执行时间
+    """
+
+    def __init__(self, path: str, workers: int = 2, max_attempts: int = 3, backoff: float = 1.0,
+                 backoff_max: float = 300.0, poll_interval: float = 1.0, lease: float = 300.0):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lease = lease
+        # 任务名 --> (函数, 最多执行次数)
+        self.tasks = {}
+        # 每个线程一个连接，第一次使用时才打开队列文件
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def task(self, name: str = None, max_attempts: int = None):
+        """注册任务函数，函数的参数必须可以转换成JSON；也可以是 async def"""
+
+        def decorator(func):
+            self.tasks[name or func.__name__] = (func, max_attempts or self.max_attempts)
+            return func
+
+        return decorator
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: 自动提交，需要事务时显式 BEGIN
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _close_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def enqueue(self, name: str, *args, **kwargs) -> int:
+        """
+        添加任务
+        :return: 任务id，可以通过 get() 查询状态
+        """
+        if name not in self.tasks:
+            raise ValueError(f'Unknown job: {name!r}')
+        _, max_attempts = self.tasks[name]
+        payload = json.dumps({'args': args, 'kwargs': kwargs}, ensure_ascii=False)
+        now = time.time()
+        cursor = self._connection().execute(
+            'INSERT INTO jobs (name, payload, status, max_attempts, run_at, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (name, payload, QUEUED, max_attempts, now, now, now),
+        )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    async def enqueue_async(self, name: str, *args, **kwargs) -> int:
+        """在 async def 中使用，写入队列文件时不阻塞事件循环"""
+        return await asyncio.to_thread(self.enqueue, name, *args, **kwargs)
+
+    def _claim(self, worker: str):
+        """取出一个可以执行的任务，并标记为执行中"""
+        connection = self._connection()
+        now = time.time()
+        # BEGIN IMMEDIATE 先拿到写锁，多个线程或进程不会取到同一个任务
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            while True:
+                row = connection.execute(
+                    f'SELECT {COLUMNS} FROM jobs WHERE status IN (?, ?) AND run_at <= ? ORDER BY run_at, id LIMIT 1',
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is None or row['attempts'] < row['max_attempts']:
+                    break
+                # 租约到期并且已经没有重试次数: 上一次执行时进程崩溃了
+                connection.execute(
+                    'UPDATE jobs SET status = ?, updated_at = ?, last_error = ? WHERE id = ?',
+                    (FAILED, now, 'lease expired', row['id']),
+                )
+            if row is not None:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, run_at = ?, updated_at = ?, worker = ? '
+                    'WHERE id = ?',
+                    (RUNNING, now + self.lease, now, worker, row['id']),
+                )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return row
+
+    def _execute(self, row):
+        func, _ = self.tasks[row['name']]
+        payload = json.loads(row['payload'])
+        result = func(*payload['args'], **payload['kwargs'])
+        if inspect.isawaitable(result):
+            asyncio.run(result)
+
+    def _finish(self, row, error: Exception = None):
+        connection = self._connection()
+        now = time.time()
+        attempts = row['attempts'] + 1
+        if error is None:
+            connection.execute(
+                'UPDATE jobs SET status = ?, updated_at = ?, last_error = NULL WHERE id = ?', (DONE, now, row['id']),
+            )
+        elif attempts < row['max_attempts']:
+            # 指数退避，加上随机抖动，避免大量任务同时重试
+            delay = min(self.backoff_max, self.backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+            connection.execute(
+                'UPDATE jobs SET status = ?, run_at = ?, updated_at = ?, last_error = ? WHERE id = ?',
+                (QUEUED, now + delay, now, repr(error), row['id']),
+            )
+        else:
+            connection.execute(
+                'UPDATE jobs SET status = ?, updated_at = ?, last_error = ? WHERE id = ?',
+                (FAILED, now, repr(error), row['id']),
+            )
+
+    def run_once(self, worker: str = 'main') -> bool:
+        """执行一个任务，队列为空时返回 False"""
+        row = self._claim(worker)
+        if row is None:
+            return False
+        if row['name'] not in self.tasks:
+            self._finish(row, LookupError(f'Unknown job: {row["name"]!r}'))
+            return True
+        try:
+            self._execute(row)
+        except Exception as exc:
+            logger.warning('job %s %s failed (attempt %s/%s): %r',
+                           row['id'], row['name'], row['attempts'] + 1, row['max_attempts'], exc)
+            self._finish(row, exc)
+        else:
+            self._finish(row)
+        return True
+
+    def _worker(self, worker: str):
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if self.run_once(worker):
+                        continue
+                except sqlite3.Error:
+                    logger.exception('job worker %s', worker)
+                # 队列为空: 等待新任务或者轮询间隔
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        finally:
+            self._close_connection()
+
+    def start(self, workers: int = None):
+        """启动工作线程"""
+        workers = self.workers if workers is None else workers
+        self._stopping.clear()
+        prefix = uuid.uuid4().hex[:8]
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._worker, args=(f'{prefix}-{i}',), name=f'job-worker-{i}', daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        """停止工作线程，正在执行的任务执行完才退出；超时未完成的任务在租约到期后重新执行"""
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def get(self, job_id: int):
+        row = self._connection().execute(f'SELECT {COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def status(self, job_id: int):
+        """
+        提交任务的客户端查询自己的任务: 只返回状态和执行次数，不返回参数和错误信息
+        """
+        row = self._connection().execute(
+            f'SELECT {PUBLIC_COLUMNS} FROM jobs WHERE id = ?', (job_id,),
+        ).fetchone()
+        return None if row is None else dict(row)
+
+    def recent(self, status: str = None, limit: int = 50) -> list:
+        if status is None:
+            rows = self._connection().execute(
+                f'SELECT {COLUMNS} FROM jobs ORDER BY id DESC LIMIT ?', (limit,),
+            )
+        else:
+            rows = self._connection().execute(
+                f'SELECT {COLUMNS} FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?', (status, limit),
+            )
+        return [self._to_dict(row) for row in rows]
+
+    def counts(self) -> dict:
+        rows = self._connection().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+        return {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows.fetchall())}
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        job = dict(row)
+        payload = json.loads(job.pop('payload'))
+        job['args'] = payload['args']
+        job['kwargs'] = payload['kwargs']
+        return job
+
+
+settings = get_settings()
+job_queue = JobQueue(
+    settings.job_db_path,
+    workers=settings.job_workers,
+    max_attempts=settings.job_max_attempts,
+    backoff=settings.job_backoff,
+    backoff_max=settings.job_backoff_max,
+    poll_interval=settings.job_poll_interval,
+    lease=settings.job_lease,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sl.core.jobs', description='后台任务的工作进程')
+    parser.add_argument('--workers', type=int, default=max(1, settings.job_workers))
+    args = parser.parse_args(argv)
+
+    # 导入应用，注册所有的任务函数；以 -m 运行时本模块是 __main__，要使用 sl.core.jobs 中的队列
+    import sl.run  # noqa: F401
+    from sl.core.jobs import job_queue
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopped.set())
+    job_queue.start(args.workers)
+    logger.info('job workers started: %s', args.workers)
+    stopped.wait()
+    job_queue.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+# 请求指标 --- Prometheus 文本格式
+# 纯ASGI中间件记录每个路由的请求数、耗时分布、响应大小和正在处理的请求数，通过 /metrics 暴露
+# 路由按模板(例如 /app1/items/{item_id})区分，而不是实际路径，避免标签数量无限增长
+# 多进程部署时每次抓取只会落到其中一个进程，配置了 metrics_dir 时:
+# 各个进程最多每 metrics_flush_interval 秒把自己的指标快照写入 <metrics_dir>/<pid>.json，
+# /metrics 合并目录中所有进程的快照后输出，计数器跨进程累加，已经退出的进程的计数也保留
+
+import asyncio
+import atexit
+import glob
+import json
+import os
+import time
+from bisect import bisect_left
+
+from starlette.responses import PlainTextResponse
+
+from sl.core.config import get_settings
+
+# 耗时的分桶(秒)，与 Prometheus 客户端的默认值相同
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# 响应大小的分桶(字节)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# 没有匹配到路由的请求(404)统一记为一个标签
+UNMATCHED = '<unmatched>'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """
+    分桶计数，每次观测 O(log n)，输出时再累加成 Prometheus 要求的累计值
+    :param buckets: 各个桶的上限，从小到大
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # 最后一个是 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else _format(bound)), total
+
+
+def _format(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+class Metrics:
+    """
+    进程内的请求指标，只在事件循环中更新，不需要加锁
+    :param directory: 多进程共用的快照目录，为空时只输出当前进程的指标
+    :param flush_interval: 指标变化后最多等待多少秒写入快照
+    """
+
+    def __init__(self, latency_buckets=LATENCY_BUCKETS, size_buckets=SIZE_BUCKETS, directory: str = None,
+                 flush_interval: float = 1.0):
+        self.latency_buckets = latency_buckets
+        self.size_buckets = size_buckets
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._flush_handle = None
+        self._atexit = False
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.reset()
+
+    def reset(self):
+        # (method, route, status) --> 请求数
+        self.requests = {}
+        # (method, route) --> Histogram
+        self.latency = {}
+        self.sizes = {}
+        self.in_flight = 0
+
+    def observe(self, method: str, route: str, status: int, duration: float, size: int):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        key = (method, route)
+        latency = self.latency.get(key)
+        if latency is None:
+            latency = self.latency[key] = Histogram(self.latency_buckets)
+            self.sizes[key] = Histogram(self.size_buckets)
+        latency.observe(duration)
+        self.sizes[key].observe(size)
+        self.changed()
+
+    def changed(self):
+        """指标变化后安排一次写入快照，同一个间隔内的多次变化只写一次"""
+        if not self.directory or self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+        if not self._atexit:
+            # 进程正常退出时写入最后的计数
+            atexit.register(self.flush)
+            self._atexit = True
+
+    @property
+    def snapshot_path(self) -> str:
+        # 取当前的 pid: gunicorn 的主进程导入应用后才 fork 出工作进程
+        return os.path.join(self.directory, f'{os.getpid()}.json')
+
+    def flush(self):
+        """把当前进程的指标写入快照，先写临时文件再替换，读取的进程不会读到写了一半的文件"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        snapshot = {
+            'in_flight': self.in_flight,
+            'requests': [[*key, count] for key, count in self.requests.items()],
+            'latency': [[*key, h.counts, h.sum] for key, h in self.latency.items()],
+            'sizes': [[*key, h.counts, h.sum] for key, h in self.sizes.items()],
+        }
+        path = self.snapshot_path
+        with open(path + '.part', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.part', path)
+        # 还有正在处理的请求时继续定期写入，快照一直不更新说明进程已经异常退出
+        if self.in_flight:
+            try:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+            except RuntimeError:
+                pass
+
+    def merge(self, snapshot: dict):
+        for method, route, status, count in snapshot['requests']:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + count
+        for name, buckets in (('latency', self.latency_buckets), ('sizes', self.size_buckets)):
+            histograms = getattr(self, name)
+            for method, route, counts, total in snapshot[name]:
+                histogram = histograms.get((method, route))
+                if histogram is None:
+                    histogram = histograms[(method, route)] = Histogram(buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += sum(counts)
+
+    def collect(self) -> 'Metrics':
+        """合并目录中所有进程的快照"""
+        self.flush()
+        merged = Metrics(self.latency_buckets, self.size_buckets)
+        stale = time.time() - 3 * self.flush_interval
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+                modified = os.path.getmtime(path)
+            except (OSError, ValueError):
+                # 进程正在替换或清理快照
+                continue
+            merged.merge(snapshot)
+            # 异常退出的进程留下的正在处理数不再计入
+            if modified >= stale:
+                merged.in_flight += snapshot['in_flight']
+        return merged
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        if self.directory:
+            return self.collect().render()
+        lines = [
+            '# HELP http_requests_in_flight Requests currently being processed.',
+            '# TYPE http_requests_in_flight gauge',
+            f'http_requests_in_flight {self.in_flight}',
+            '# HELP http_requests_total Total HTTP requests by route template and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}')
+        self._render_histograms(
+            lines, 'http_request_duration_seconds', 'HTTP request latency in seconds.', self.latency,
+        )
+        self._render_histograms(
+            lines, 'http_response_size_bytes', 'HTTP response body size in bytes.', self.sizes,
+        )
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines: list, name: str, help_text: str, histograms: dict):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (method, route), histogram in sorted(histograms.items()):
+            labels = _labels(method=method, route=route)
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{{labels}}} {_format(histogram.sum)}')
+            lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+class MetricsMiddleware:
+    """
+    纯ASGI中间件，不经过 BaseHTTPMiddleware，也不会缓冲流式响应
+    耗时使用单调时钟 perf_counter，从收到请求到响应体发送完毕
+    :param app: 下一层ASGI应用
+    :param metrics: 指标存储
+    :param exclude: 不统计的路径，例如 /metrics 本身
+    """
+
+    def __init__(self, app, metrics: Metrics, exclude=('/metrics',)):
+        self.app = app
+        self.metrics = metrics
+        self.exclude = frozenset(exclude)
+        # 没有 scope['route'] 的路由(例如 /docs 和 mount) --> 路由模板
+        self._templates = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        metrics = self.metrics
+        metrics.in_flight += 1
+        metrics.changed()
+        # 部署时配置的 root_path，路由匹配经过 mount 时会在后面加上挂载的前缀
+        root_path = scope.get('root_path', '')
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.in_flight -= 1
+            metrics.observe(scope['method'], self.route_template(scope, root_path), status, duration, size)
+
+    def route_template(self, scope, root_path: str = '') -> str:
+        # 路由匹配时会把 route/endpoint 写回 scope，FastAPI 的路由会带上 scope['route']
+        # route.path_format 只是所在路由表中的路径，挂载在前缀下(mount、嵌套的路由)时要加上匹配时累加的前缀，
+        # 否则不同前缀下相同路径的路由会记为同一个标签
+        route = scope.get('route')
+        if route is not None:
+            prefix = scope.get('root_path', '')
+            if prefix.startswith(root_path):
+                prefix = prefix[len(root_path):]
+            return prefix + route.path_format
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return UNMATCHED
+        # 挂载的子应用可能不能作为字典的键(例如 Router 定义了 __eq__)，按 id 缓存
+        template = self._templates.get(id(endpoint))
+        if template is None:
+            template = self._templates[id(endpoint)] = self._find_template(scope, endpoint)
+        return template
+
+    @classmethod
+    def _find_template(cls, scope, endpoint) -> str:
+        return cls._search_routes(getattr(scope.get('app'), 'routes', ()), endpoint, '') or UNMATCHED
+
+    @classmethod
+    def _search_routes(cls, routes, endpoint, prefix: str):
+        for route in routes:
+            # 普通路由比较 endpoint，mount 比较挂载的子应用
+            if getattr(route, 'endpoint', None) is endpoint or getattr(route, 'app', None) is endpoint:
+                return prefix + route.path_format
+            # mount 下的子路由表，加上挂载的前缀继续查找
+            routes = getattr(route, 'routes', None) or ()
+            template = cls._search_routes(routes, endpoint, prefix + getattr(route, 'path', ''))
+            if template:
+                return template
+        return None
+
+
+def reset_directory(directory: str):
+    """服务启动前删除上一次运行留下的快照，避免计数累加到新的进程上"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json*')):
+        os.remove(path)
+
+
+settings = get_settings()
+metrics = Metrics(directory=settings.metrics_dir, flush_interval=settings.metrics_flush_interval)
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,233 @@
+# 纯ASGI中间件
+# @app.middleware('http') 基于 BaseHTTPMiddleware，每个请求都要额外创建任务和内存流，并且会缓冲流式响应；
+# 这里的中间件直接包装 send，只在响应头发出时追加头信息，可以任意组合:
+#   app.add_middleware(ErrorMappingMiddleware, errors={...})
+#   app.add_middleware(TimingMiddleware)
+#   app.add_middleware(RequestIdMiddleware)
+#   app.add_middleware(BodySizeLimitMiddleware, limits={'/app5/upload_files': 1 << 30})
+# 后添加的在外层
+
+import logging
+import re
+import time
+import uuid
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+from starlette.responses import PlainTextResponse
+
+logger = logging.getLogger('sl.errors')
+
+# 当前请求的id，日志中可以通过 RequestIdFilter 输出
+request_id_var: ContextVar[str] = ContextVar('request_id', default='-')
+
+# 客户端传入的请求id只接受这些字符，避免日志注入
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def get_request_id() -> str:
+    return request_id_var.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """给日志记录加上 request_id 字段，格式中使用 %(request_id)s"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+def with_headers(send, headers: dict):
+    """包装 send，在响应头中追加 headers，值为函数时在响应开始时才计算"""
+
+    async def send_wrapper(message):
+        if message['type'] == 'http.response.start':
+            response_headers = MutableHeaders(scope=message)
+            for name, value in headers.items():
+                response_headers.append(name, value() if callable(value) else value)
+        await send(message)
+
+    return send_wrapper
+
+
+class RequestIdMiddleware:
+    """
+    给每个请求分配id: 使用客户端传入的 X-Request-ID，没有或不合法时生成新的
+    id 写入 scope['state']、contextvar 和响应头
+    :param app: 下一层ASGI应用
+    :param header: 请求头和响应头的名称
+    """
+
+    def __init__(self, app, header: str = 'X-Request-ID'):
+        self.app = app
+        self.header = header
+        self._raw_header = header.lower().encode('latin-1')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope['headers']:
+            if name == self._raw_header:
+                value = value.decode('latin-1')
+                if REQUEST_ID_PATTERN.match(value):
+                    request_id = value
+                break
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+        scope.setdefault('state', {})['request_id'] = request_id
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, with_headers(send, {self.header: request_id}))
+        finally:
+            request_id_var.reset(token)
+
+
+class TimingMiddleware:
+    """
+    在响应头中返回处理耗时(秒)，替代原来的 add_process_time_header
+    使用单调时钟，计时到响应头发出为止(流式响应不包含后续响应体的时间)
+    :param app: 下一层ASGI应用
+    :param header: 响应头名称
+    """
+
+    def __init__(self, app, header: str = 'X-Process-Time'):
+        self.app = app
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        await self.app(scope, receive, with_headers(send, {
+            self.header: lambda: f'{time.perf_counter() - start:.6f}',
+        }))
+
+
+class ErrorMappingMiddleware:
+    """
+    把路由中没有处理的异常转换成响应，并记录带请求id的日志
+    :param app: 下一层ASGI应用
+    :param errors: 异常类型 --> 状态码，按继承关系匹配；其他异常返回 500
+    """
+
+    def __init__(self, app, errors: dict = None):
+        self.app = app
+        self.errors = dict(errors or {})
+
+    def status_code(self, exc: Exception):
+        """没有配置的异常返回 None"""
+        for cls in type(exc).__mro__:
+            if cls in self.errors:
+                return self.errors[cls]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            # 响应已经开始发送，无法再返回新的响应
+            if started:
+                raise
+            status_code = self.status_code(exc)
+            if status_code is None:
+                logger.exception('unhandled error request_id=%s %s %s',
+                                  get_request_id(), scope['method'], scope['path'])
+                response = PlainTextResponse('Internal Server Error', status_code=500)
+            else:
+                response = PlainTextResponse(type(exc).__name__, status_code=status_code)
+            await response(scope, receive, send)
+
+
+class BodyTooLarge(Exception):
+    """请求体超过限制"""
+
+
+class BodySizeLimitMiddleware:
+    """
+    限制请求体大小: 有 Content-Length 时在读取请求体之前直接返回 413，
+    分块传输时边接收边计数，超过限制立即中断，不再继续读取；
+    下层捕获了 BodyTooLarge 并返回其他响应(例如 FastAPI 解析JSON时的 400)时，替换为 413
+    :param app: 下一层ASGI应用
+    :param max_body_size: 默认的最大字节数，为空则不限制
+    :param limits: 路径前缀 --> 最大字节数，优先于默认值；传入的字典之后仍可以继续添加
+    """
+
+    def __init__(self, app, max_body_size: int = None, limits: dict = None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.limits = {} if limits is None else limits
+
+    def limit(self, path: str):
+        matched = None
+        for prefix in self.limits:
+            if path.startswith(prefix) and (matched is None or len(prefix) > len(matched)):
+                matched = prefix
+        return self.max_body_size if matched is None else self.limits[matched]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        limit = self.limit(scope['path'])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope['headers']:
+            if name == b'content-length':
+                if value.isdigit() and int(value) > limit:
+                    await self._reject(scope, receive, send, limit)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        # 已经发送给客户端的响应: None 还没有发送; app 下层的响应; limit 本中间件的 413
+        sent = None
+
+        async def receive_wrapper():
+            nonlocal received, exceeded
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    exceeded = True
+                    raise BodyTooLarge()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal sent
+            if message['type'] == 'http.response.start' and sent is None:
+                # FastAPI 解析请求体时会捕获 BodyTooLarge 并返回 400，这里替换为 413
+                sent = 'limit' if exceeded else 'app'
+                if sent == 'limit':
+                    await self._reject(scope, receive, send, limit)
+            if sent == 'app':
+                await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except BodyTooLarge:
+            if sent == 'app':
+                raise
+        if exceeded and sent is None:
+            await self._reject(scope, receive, send, limit)
+
+    @staticmethod
+    async def _reject(scope, receive, send, limit: int):
+        response = PlainTextResponse(f'Request body exceeds {limit} bytes', status_code=413,
+                                     headers={'Connection': 'close'})
+        await response(scope, receive, send)
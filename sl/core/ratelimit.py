@@ -0,0 +1,182 @@
+# 限流 --- 令牌桶算法
+# 每个客户端IP一个令牌桶(带有token时每个token再加一个)，桶的容量为单位时间内允许的请求数，令牌按固定速率补充；
+# 请求到来时取走一个令牌，桶空则返回 429 和 Retry-After
+
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.responses import PlainTextResponse
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+
+def parse_rate(rate: str):
+    """
+    解析限流规则
+    :param rate: 例如 '5/minute' 表示每分钟5次
+    :return: (桶的容量, 每秒补充的令牌数)
+    """
+    try:
+        count, period = rate.split('/')
+        count = int(count)
+        seconds = PERIODS[period.strip().lower()]
+    except (ValueError, KeyError):
+        raise ValueError(f'Invalid rate: {rate!r}, expected e.g. "5/minute"')
+    return count, count / seconds
+
+
+class MemoryBucketBackend:
+    """
+    进程内的令牌桶存储，每次更新 O(1)
+    长时间没有请求的桶已经补满，等同于不存在，按最近访问顺序从最旧的一端清理
+    :param max_keys: 最多保存的桶数量
+    """
+
+    # 每次请求最多顺带清理的过期桶数量
+    SWEEP = 8
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key --> [剩余令牌数, 上次更新时间, 补满的时间]
+        self._buckets = OrderedDict()
+
+    def take(self, key: str, capacity: int, refill_rate: float, now: float = None):
+        """
+        取走一个令牌
+        :return: (是否允许, 需要等待的秒数)
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = [tokens, now, now + (capacity - tokens) / refill_rate]
+        self._buckets.move_to_end(key)
+        self._sweep(now)
+        if allowed:
+            return True, 0.0
+        return False, (1 - tokens) / refill_rate
+
+    def _sweep(self, now: float):
+        for _ in range(self.SWEEP):
+            if not self._buckets:
+                break
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[2] > now and len(self._buckets) <= self.max_keys:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimitRule:
+    """
+    :param path: 路径前缀
+    :param rate: 限流规则，例如 '5/minute'
+    :param key: 区分客户端的方式 ip: 按IP; user: 按IP，带有 Bearer token 时同时按token计数
+        token 没有经过校验，只能作为附加的限制: 只按token计数时，每次请求换一个随机token就能绕过限流
+    :param methods: 只限制这些请求方法，为空则限制所有方法
+    """
+
+    def __init__(self, path: str, rate: str, key: str = 'ip', methods=None):
+        if key not in ('ip', 'user'):
+            raise ValueError(f'Invalid rate limit key: {key!r}')
+        self.path = path
+        self.rate = rate
+        self.capacity, self.refill_rate = parse_rate(rate)
+        self.key = key
+        self.methods = {method.upper() for method in methods} if methods else None
+
+    def matches(self, path: str, method: str) -> bool:
+        return path.startswith(self.path) and (self.methods is None or method in self.methods)
+
+
+class RateLimiter:
+    """
+    限流规则的集合
+    :param backend: 令牌桶存储，多进程部署时可替换为共享的实现
+    :param default: 所有请求共用的默认规则，例如 '600/minute'，为空则不限制
+    """
+
+    def __init__(self, backend=None, default: Optional[str] = None, default_key: str = 'user'):
+        self.backend = backend or MemoryBucketBackend()
+        self.rules = []
+        self.default = RateLimitRule('/', default, key=default_key) if default else None
+
+    def limit(self, path: str, rate: str, key: str = 'ip', methods=None):
+        """给某个路径前缀添加限流规则，在 include_router 的位置配置"""
+        self.rules.append(RateLimitRule(path, rate, key=key, methods=methods))
+        # 路径越长越具体，优先匹配
+        self.rules.sort(key=lambda rule: len(rule.path), reverse=True)
+
+    def match(self, path: str, method: str) -> list:
+        """返回需要检查的规则: 最具体的路由规则 + 默认规则"""
+        rules = []
+        for rule in self.rules:
+            if rule.matches(path, method):
+                rules.append(rule)
+                break
+        if self.default is not None:
+            rules.append(self.default)
+        return rules
+
+
+def client_keys(scope, rule: RateLimitRule) -> list:
+    """
+    需要取令牌的桶: 总是先检查IP的桶，IP的桶允许后才检查token的桶，
+    同一个IP每个周期最多只能创建 capacity 个token的桶，不能用随机token挤掉其他客户端的桶
+    """
+    client = scope.get('client')
+    keys = ['ip:' + (client[0] if client else 'unknown')]
+    if rule.key == 'user':
+        for name, value in scope['headers']:
+            if name == b'authorization':
+                scheme, _, token = value.decode('latin-1').partition(' ')
+                if scheme.lower() == 'bearer' and token:
+                    # 只保存token的摘要，避免在内存中保存完整的token
+                    keys.append('token:' + hashlib.sha1(token.encode()).hexdigest())
+                break
+    return keys
+
+
+class RateLimitMiddleware:
+    """
+    纯ASGI中间件，不经过 BaseHTTPMiddleware，超过限制直接返回 429
+    :param app: 下一层ASGI应用
+    :param limiter: 限流规则
+    """
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        for rule in self.limiter.match(scope['path'], scope['method']):
+            for key in client_keys(scope, rule):
+                allowed, retry_after = self.limiter.backend.take(f'{rule.path}|{key}', rule.capacity,
+                                                                 rule.refill_rate)
+                if not allowed:
+                    response = PlainTextResponse(
+                        'Too Many Requests',
+                        status_code=429,
+                        headers={'Retry-After': str(math.ceil(retry_after)), 'X-RateLimit-Limit': rule.rate},
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
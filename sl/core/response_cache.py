@@ -0,0 +1,161 @@
+# 服务端响应缓存
+# 缓存 GET 接口序列化好的响应(状态码、响应头、响应体字节)，命中时不再查询数据库和序列化
+# 1. 缓存键: 路径 + 排序后的查询参数，参数顺序不同的请求共用一份缓存
+# 2. 标签失效: 每条缓存记录写入时各个标签的版本，invalidate(tag) 把版本加一，旧版本的记录随之失效
+# 3. 防击穿(single-flight): 同一个键同时未命中时，只有一个请求执行接口，其余请求等待并共用它的响应；
+#    它的响应不能共用时(不是200、流式响应或者抛出异常)，等待的请求各自并行执行接口
+# 命中时仍然处理 If-None-Match / If-Modified-Since，客户端的缓存有效时返回 304
+
+import asyncio
+import functools
+import inspect
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from sl.core import httpcache
+from sl.core.cache import CacheBackend, MemoryCache, MISSING
+from sl.core.config import get_settings
+
+# 不随缓存记录保存的响应头: 响应体长度在返回时重新计算
+EXCLUDED_HEADERS = {'content-length'}
+
+
+class ResponseCache:
+    """
+    :param backend: 缓存后端，保存 键 --> (标签版本, 状态码, 响应头, 响应体)
+    :param ttl: 缓存记录的过期时间(秒)
+    :param max_entry_size: 响应体超过这个字节数时不缓存，但同时等待的请求仍然共用这次的响应
+    :param enabled: 为 False 时 cached() 直接返回原来的接口函数
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = None, max_entry_size: int = 1024 * 1024,
+                 enabled: bool = True):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entry_size = max_entry_size
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        # 标签 --> 版本，只在当前进程中有效
+        self._versions = {}
+        # 键 --> 正在执行的请求的结果(Future)，完成后删除
+        self._inflight = {}
+
+    @staticmethod
+    def key(request: Request) -> str:
+        query = urlencode(sorted(request.query_params.multi_items()))
+        return f'{request.url.path}?{query}'
+
+    def versions(self, tags) -> tuple:
+        return tuple(self._versions.get(tag, 0) for tag in tags)
+
+    def invalidate(self, *tags):
+        """数据变化后调用，让带有这些标签的缓存记录全部失效"""
+        for tag in tags:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        self.backend.clear()
+
+    def lookup(self, key: str, tags):
+        entry = self.backend.get(key)
+        if entry is MISSING or entry[0] != self.versions(tags):
+            return MISSING
+        return entry
+
+    @staticmethod
+    def make_entry(versions: tuple, response):
+        """可以共用的响应转换为缓存记录，其他的返回 None"""
+        if not isinstance(response, Response) or hasattr(response, 'body_iterator') or response.status_code != 200:
+            return None
+        headers = {name: value for name, value in response.headers.items() if name not in EXCLUDED_HEADERS}
+        return versions, response.status_code, headers, response.body
+
+    def store(self, key: str, entry):
+        if len(entry[3]) <= self.max_entry_size:
+            self.backend.set(key, entry, ttl=self.ttl)
+
+    @staticmethod
+    def replay(request: Request, entry) -> Response:
+        _, status_code, headers, body = entry
+        etag, last_modified = headers.get('etag'), headers.get('last-modified')
+        if etag is not None:
+            last_modified = parsedate_to_datetime(last_modified) if last_modified else None
+            if httpcache.not_modified(request, etag, last_modified):
+                headers = {name: value for name, value in headers.items() if name != 'content-type'}
+                return httpcache.not_modified_response({**headers, 'X-Cache': 'HIT'})
+        return Response(content=body, status_code=status_code, headers={**headers, 'X-Cache': 'HIT'})
+
+    def cached(self, tags=()):
+        """
+        缓存接口返回的 Response，接口需要声明 request: Request 参数，并且直接返回序列化好的 Response
+        返回其他状态码(例如 304)或其他类型的结果时不缓存
+        :param tags: 缓存记录的标签，invalidate(tag) 时失效
+        """
+        tags = tuple(tags)
+
+        def decorator(endpoint):
+            if not self.enabled:
+                return endpoint
+            if 'request' not in inspect.signature(endpoint).parameters:
+                raise TypeError(f'{endpoint.__name__} must declare a request: Request parameter to be cached')
+
+            @functools.wraps(endpoint)
+            async def wrapper(*args, **kwargs):
+                request = kwargs['request']
+                key = self.key(request)
+                entry = self.lookup(key, tags)
+                if entry is not MISSING:
+                    self.hits += 1
+                    return self.replay(request, entry)
+
+                flight = self._inflight.get(key)
+                if flight is not None:
+                    # 已经有请求在执行接口: 等待它的结果，shield 避免当前请求取消时影响其他等待的请求
+                    entry = await asyncio.shield(flight)
+                    if entry is not None:
+                        self.hits += 1
+                        return self.replay(request, entry)
+                    # 它的响应不能共用，各自执行，不再排队
+                    self.misses += 1
+                    return await endpoint(*args, **kwargs)
+
+                self.misses += 1
+                flight = self._inflight[key] = asyncio.get_running_loop().create_future()
+                entry = None
+                try:
+                    # 执行接口之前记下版本，执行期间数据被修改时，写入的记录已经是失效的
+                    versions = self.versions(tags)
+                    response = await endpoint(*args, **kwargs)
+                    entry = self.make_entry(versions, response)
+                    if entry is not None:
+                        self.store(key, entry)
+                        response.headers['X-Cache'] = 'MISS'
+                    return response
+                finally:
+                    del self._inflight[key]
+                    flight.set_result(entry)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> dict:
+        return {
+            **self.backend.stats(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'tags': dict(self._versions),
+        }
+
+
+settings = get_settings()
+response_cache = ResponseCache(
+    MemoryCache(maxsize=settings.response_cache_size),
+    ttl=settings.response_cache_ttl,
+    max_entry_size=settings.response_cache_max_entry_size,
+    enabled=settings.response_cache_enabled,
+)
@@ -0,0 +1,30 @@
+# 默认的JSON响应类
+# JSONResponse 使用标准库 json.dumps，列表接口的大部分时间花在序列化上；
+# 安装了 orjson 时使用 FastAPI 自带的 ORJSONResponse，orjson 直接支持 datetime/date/UUID/dataclass/numpy，速度快数倍
+# 与 JSONResponse 的区别: NaN/Infinity 输出为 null(JSONResponse 会报错)，datetime 输出为 RFC 3339 格式
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+RESPONSE_CLASSES = {
+    'json': JSONResponse,
+    'orjson': ORJSONResponse,
+}
+
+
+def default_response_class(name: str = 'auto'):
+    """
+    :param name: auto: 安装了 orjson 时使用 ORJSONResponse，否则使用 JSONResponse; json; orjson
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in RESPONSE_CLASSES:
+        raise ValueError(f'Invalid response class: {name!r}, expected one of auto, {", ".join(RESPONSE_CLASSES)}')
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('orjson is not installed')
+    return RESPONSE_CLASSES[name]
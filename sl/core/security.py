@@ -1 +1,95 @@
 # 认证和授权相关
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from sl.core.config import get_settings
+
+
+class PasswordHasherBusy(Exception):
+    """等待空闲线程超时，调用方应返回 503"""
+
+
+class PasswordHasher:
+    """
+    在独立的线程池中执行密码的哈希和校验
+    bcrypt 每次校验需要上百毫秒，直接在 async def 中调用会阻塞整个事件循环；
+    bcrypt 计算时会释放GIL，放到线程池中执行不会影响其他请求
+    :param context: passlib 的 CryptContext
+    :param max_workers: 同时进行哈希计算的最大数量
+    :param queue_timeout: 等待空闲线程的最长时间(秒)，超时抛出 PasswordHasherBusy
+    """
+
+    def __init__(self, context: CryptContext, max_workers: int = 2, queue_timeout: float = 5.0):
+        self.context = context
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._semaphore = None
+
+    def _ensure_started(self):
+        # 第一次使用时才创建线程池和信号量
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='password-hasher')
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+    async def _acquire(self):
+        """
+        限制排队: 超过等待时间直接拒绝，而不是让请求无限堆积
+        不使用 asyncio.wait_for(semaphore.acquire())，Python 3.12 之前超时和获取成功同时发生时会丢失一个许可
+        """
+        semaphore = self._semaphore
+        # 有空闲的线程时直接获取，不需要等待
+        if not semaphore.locked():
+            await semaphore.acquire()
+            return
+        acquire = asyncio.ensure_future(semaphore.acquire())
+        try:
+            done, _ = await asyncio.wait({acquire}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # 请求被取消(例如客户端断开)
+            self._abandon(acquire)
+            raise
+        if not done:
+            self._abandon(acquire)
+            raise PasswordHasherBusy()
+
+    def _abandon(self, acquire: asyncio.Future):
+        """放弃等待: 已经拿到的许可还回去，还在等待的取消(Semaphore.acquire 被取消时会自己归还分配给它的许可)"""
+        if not acquire.done():
+            acquire.cancel()
+        elif not acquire.cancelled() and acquire.exception() is None:
+            self._semaphore.release()
+
+    async def _run(self, func, *args):
+        self._ensure_started()
+        await self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._semaphore.release()
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._semaphore = None
+
+
+# 加密密码的方法
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=get_settings().password_hash_workers,
+    queue_timeout=get_settings().password_hash_queue_timeout,
+)
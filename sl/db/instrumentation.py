@@ -0,0 +1,134 @@
+# SQL 查询统计
+# 替代 echo=True: 不再同步打印每一条语句和参数，而是基于引擎事件记录每类语句的耗时分布和影响的行数，
+# 只有慢查询(超过阈值)或按比例抽样的查询才写日志
+
+import logging
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+from sqlalchemy import event
+
+from sl.core.config import get_settings
+
+logger = logging.getLogger('sl.db.queries')
+
+# 耗时直方图的桶边界(毫秒)，最后一个桶记录超过最大边界的查询
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """
+    语句指纹: 去掉字面量和多余空白，参数个数不同的 IN (...) 合并为同一类
+    :param statement: 驱动执行的SQL语句
+    """
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _SPACES.sub(' ', statement).strip()
+    statement = _IN_LIST.sub('(?...)', statement)
+    return statement
+
+
+class QueryStat:
+    """一类语句的统计"""
+
+    __slots__ = ('count', 'total_ms', 'max_ms', 'rows', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        # 驱动报告的行数之和；SELECT 语句在 sqlite3 等驱动中 rowcount 为 -1，从来没有报告过行数时为 None
+        self.rows = None
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, duration_ms: float, rows: int):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        if rows >= 0:
+            self.rows = (self.rows or 0) + rows
+        for index, bound in enumerate(BUCKETS_MS):
+            if duration_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            # 直方图: 耗时上限 --> 次数
+            'histogram': {
+                **{f'<={bound}ms': n for bound, n in zip(BUCKETS_MS, self.buckets)},
+                f'>{BUCKETS_MS[-1]}ms': self.buckets[-1],
+            },
+        }
+
+
+class QueryStats:
+    """
+    :param slow_ms: 超过该耗时(毫秒)的查询写 WARNING 日志
+    :param sample_rate: 其余查询按该比例抽样写 DEBUG 日志，0 表示不抽样
+    """
+
+    def __init__(self, slow_ms: float = 200, sample_rate: float = 0.0):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, duration_ms: float, rows: int, parameters=None):
+        key = fingerprint(statement)
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = QueryStat()
+            stat.add(duration_ms, rows)
+        if duration_ms >= self.slow_ms:
+            logger.warning('slow query %.1fms rows=%s: %s', duration_ms, rows, key)
+        elif self.sample_rate and random.random() < self.sample_rate:
+            logger.debug('query %.1fms rows=%s: %s %r', duration_ms, rows, key, parameters)
+
+    def snapshot(self) -> list:
+        """按总耗时从高到低排列的统计"""
+        with self._lock:
+            items = [{'statement': key, **stat.to_dict()} for key, stat in self._stats.items()]
+        return sorted(items, key=lambda item: item['total_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    # 引擎事件
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - context._query_start) * 1000
+        # rowcount 是驱动报告的影响行数: INSERT/UPDATE/DELETE 准确，SELECT 在取出结果之前大多为 -1，不计入
+        self.record(statement, duration_ms, cursor.rowcount, parameters)
+
+    def install(self, engine):
+        """
+        注册到引擎上
+        :param engine: 同步引擎；异步引擎传入 async_engine.sync_engine
+        """
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+
+# 全局的查询统计，同步引擎和异步引擎共用
+query_stats = QueryStats(slow_ms=get_settings().slow_query_ms, sample_rate=get_settings().query_sample_rate)
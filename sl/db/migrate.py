@@ -0,0 +1,91 @@
+# 数据库建表和升级
+# 应用启动时由 lifespan 调用 init_db()，也可以在部署前通过命令行执行:
+#   python -m sl.db.migrate create              只创建不存在的表
+#   python -m sl.db.migrate upgrade             创建不存在的表，并给已有的表补上新增的索引；
+#                                               汇总表为空而 Data 表已有数据时，根据已有数据生成汇总表
+#   python -m sl.db.migrate rebuild-aggregates  根据 Data 表重建汇总表
+
+import argparse
+import sys
+
+from sqlalchemy import inspect
+
+from sl.db.base import Base, get_engine, get_async_engine, get_sessionmaker, get_async_sessionmaker
+
+
+def _load_models():
+    # 导入模型，注册到 Base.metadata
+    from sl.api.models import city  # noqa: F401
+
+
+def create(connection):
+    """创建不存在的表"""
+    _load_models()
+    Base.metadata.create_all(bind=connection)
+
+
+def upgrade(connection) -> list:
+    """
+    创建不存在的表，并给已经存在的表补上模型中新增的索引
+    create_all 对已经存在的表不做任何修改，新增的索引需要单独创建
+    :return: 新创建的索引名
+    """
+    create(connection)
+    inspector = inspect(connection)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=connection)
+                created.append(index.name)
+    return created
+
+
+async def init_db():
+    """应用启动时执行: 建表和升级，升级前已有的数据补充到汇总表"""
+    from sl.api import aggregates
+
+    async with get_async_engine().begin() as connection:
+        await connection.run_sync(upgrade)
+    async with get_async_sessionmaker()() as db:
+        await db.run_sync(aggregates.backfill)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sl.db.migrate', description='数据库建表和升级')
+    parser.add_argument('command', choices=['create', 'upgrade', 'rebuild-aggregates'])
+    args = parser.parse_args(argv)
+
+    engine = get_engine()
+    try:
+        if args.command == 'create':
+            with engine.begin() as connection:
+                create(connection)
+        elif args.command == 'upgrade':
+            from sl.api import aggregates
+            with engine.begin() as connection:
+                created = upgrade(connection)
+            print('created indexes: {}'.format(', '.join(created) or 'none'))
+            db = get_sessionmaker()()
+            try:
+                if aggregates.backfill(db):
+                    print('aggregates rebuilt from existing data')
+            finally:
+                db.close()
+        else:
+            from sl.api import aggregates
+            with engine.begin() as connection:
+                upgrade(connection)
+            db = get_sessionmaker()()
+            try:
+                aggregates.rebuild(db)
+            finally:
+                db.close()
+    finally:
+        engine.dispose()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,18 @@
 # 数据库会话管理
+
+from sl.db.base import get_sessionmaker, get_async_sessionmaker
+
+
+# 创建子依赖对象 --- 同步会话
+def get_db():
+    db = get_sessionmaker()()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# 创建子依赖对象 --- 异步会话，配合 async def 的视图函数使用，查询时不会阻塞事件循环
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
@@ -1,13 +1,19 @@
-from typing import List
+from datetime import date
+from typing import List, Optional, Union
 
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import crud
 from starlette import status
+from starlette.responses import Response, StreamingResponse
 from starlette.templating import Jinja2Templates
 
-from sl.api import schemas, curd
-from sl.db.base import Base, engine, SessionLocal
+from sl.api import schemas, curd, async_curd, pagination, bulk, export
+from sl.core import httpcache
+from sl.core.config import get_settings
+from sl.core.response_cache import response_cache
+# get_db 保留同步会话依赖，视图函数使用异步会话依赖 get_async_db
+from sl.db.session import get_db, get_async_db
 
 # 创建子路由
 application = APIRouter()
@@ -15,30 +21,20 @@ application = APIRouter()
 # 创建前端页面配置
 templates = Jinja2Templates(directory="./sl/templates")
 
-# 初始化数据库引擎对象
-Base.metadata.create_all(bind=engine)
-
-
-# 创建子依赖对象
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# 数据库表不再在导入时创建，由应用启动时(sl/run.py lifespan) 或命令行 python -m sl.db.migrate 创建
 
 
 # 创建城市
 @application.post("/create_city", response_model=schemas.ReadCity)
-async def create_city(citys: schemas.CreateCity, db: Session = Depends(get_db)):
+async def create_city(citys: schemas.CreateCity, db: AsyncSession = Depends(get_async_db)):
     """
 
     :param citys: 前端传入的符合 CreateCity 格式的城市数据
-    :param db: 数据库操作对象，基于子依赖的数据库操作
+    :param db: 异步数据库会话，基于子依赖的数据库操作
     :return:
     """
     # 判断是否存在当前城市 --- 根据前端传入的城市名字进行过滤
-    db_city = curd.get_city_by_name(db=db, city_name=citys.province)
+    db_city = await async_curd.get_city_by_name_cached(db=db, city_name=citys.province)
     # 存在则主动抛出异常
     if db_city:
         raise HTTPException(
@@ -46,27 +42,51 @@ async def create_city(citys: schemas.CreateCity, db: Session = Depends(get_db)):
             detail='City already exists',
         )
     # 不存在则创建
-    return curd.create_city(db=db, citys=citys)
+    db_city = await async_curd.create_city(db=db, citys=citys)
+    response_cache.invalidate('cities')
+    return db_city
 
 
 # 查询多个城市的数据
 @application.get('/get_cities', response_model=List[schemas.ReadCity])
-async def get_cities(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@response_cache.cached(tags=['cities'])
+async def get_cities(request: Request, cursor: Optional[str] = None, skip: int = Query(0, ge=0),
+                     limit: int = Query(100, ge=1, le=10000), db: AsyncSession = Depends(get_async_db)):
     """
+    支持条件请求: 带上次响应的 ETag(If-None-Match) 或 Last-Modified(If-Modified-Since)，本页数据没有变化时返回 304
 
-    :param skip: 起始位置
-    :param limit: 结束位置
+    :param request: 请求对象，读取条件请求头
+    :param cursor: 游标，上一页响应头 X-Next-Cursor 的值，传入后忽略 skip
+    :param skip: 起始位置 (旧版 offset 分页，翻页越深越慢)
+    :param limit: 每页数量
     :param db: 数据库对象，依赖子依赖
-    :return:
+    :return: 当前页的城市，下一页的游标在响应头 X-Next-Cursor 中
     """
-    cities = curd.get_cities(db=db, skip=skip, limit=limit)
-
-    return cities
+    after_id = None
+    if cursor:
+        try:
+            after_id = pagination.decode_city_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    # 先只查询本页的版本，客户端的缓存仍然有效时不再查询整页数据
+    count, min_id, max_id, last_modified = await async_curd.get_cities_version(
+        db=db, skip=skip, limit=limit, after_id=after_id
+    )
+    etag = httpcache.make_etag('cities', count, min_id, max_id, last_modified)
+    headers = httpcache.cache_headers(etag, last_modified, get_settings().http_cache_control)
+    if httpcache.not_modified(request, etag, last_modified):
+        return httpcache.not_modified_response(headers)
+    cities = await async_curd.get_cities(db=db, skip=skip, limit=limit, after_id=after_id)
+    # 直接返回序列化好的响应，跳过 response_model 的逐行校验；response_model 只用于接口文档
+    next_cursor = pagination.city_cursor(cities, limit)
+    if next_cursor:
+        headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return Response(content=schemas.dump_cities(cities), media_type='application/json', headers=headers)
 
 
 # 创建数据
 @application.post('/create_data', response_model=schemas.ReadData)
-async def create_data_for_city(city: str, data: schemas.CreateData, db: Session = Depends(get_db)):
+async def create_data_for_city(city: str, data: schemas.CreateData, db: AsyncSession = Depends(get_async_db)):
     """
 
     :param city: 给那个城市创建数据
@@ -75,22 +95,174 @@ async def create_data_for_city(city: str, data: schemas.CreateData, db: Session
     :return:
     """
     # 查询当前城市是否存在
-    db_city = curd.get_city_by_name(db=db, city_name=city)
+    db_city = await async_curd.get_city_by_name_cached(db=db, city_name=city)
+    if not db_city:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='City not found')
     # 创建数据
-    data = curd.create_city_data(db=db, data=data, city_id=db_city.id)
+    data = await async_curd.create_city_data(db=db, data=data, city_id=db_city.id)
+    response_cache.invalidate('data')
     return data
 
 
+# 批量导入数据
+@application.post('/bulk_data', response_model=schemas.BulkResult)
+async def bulk_create_data(request: Request, batch_size: int = Query(500, ge=1, le=5000),
+                           db: AsyncSession = Depends(get_async_db)):
+    """
+    请求体为 BulkData 列表(application/json) 或每行一条 BulkData(application/x-ndjson)
+    所有批次在同一个事务中写入，任意一批失败则全部回滚
+
+    :param request: 请求对象，请求体由 bulk 模块按格式解析
+    :param batch_size: 每批写入的数据条数
+    :param db: 数据库对象，依赖子依赖
+    :return: 写入总数和每批写入的数量
+    """
+    city_ids = {}
+    if bulk.is_ndjson(request):
+        # 流式解析，每批只查询本批中新出现的省份
+        batches = bulk.iter_ndjson_batches(request, batch_size)
+    else:
+        records = await bulk.read_json_records(request)
+        # 列表格式一次查询出全部省份对应的城市id
+        city_ids = await async_curd.get_city_ids(db=db, provinces={record.province for record in records})
+        batches = bulk.iter_list_batches(records, batch_size)
+
+    counts = []
+    async for records in batches:
+        unknown = {record.province for record in records} - city_ids.keys()
+        if unknown:
+            city_ids.update(await async_curd.get_city_ids(db=db, provinces=unknown))
+            missing = unknown - city_ids.keys()
+            if missing:
+                await db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail='City not found: {}'.format(', '.join(sorted(missing))),
+                )
+        rows = curd.build_data_rows(records, city_ids)
+        counts.append(await async_curd.create_city_data_batch(db=db, rows=rows))
+    await db.commit()
+    response_cache.invalidate('data')
+    return {'inserted': sum(counts), 'batches': counts}
+
+
 # 获取数据
-@application.get('/get_data')
-async def get_data(city: str = None, skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
+@application.get('/get_data', response_model=List[schemas.ReadData])
+@response_cache.cached(tags=['data'])
+async def get_data(request: Request, city: str = None, date_from: Optional[date] = None,
+                   date_to: Optional[date] = None, cursor: Optional[str] = None, skip: int = Query(0, ge=0),
+                   limit: int = Query(10, ge=1, le=10000), db: AsyncSession = Depends(get_async_db)):
     """
+    支持条件请求，同 get_cities
 
+    :param request: 请求对象，读取条件请求头
     :param city: 城市名字
-    :param skip: 起始位置
-    :param limit: 截止位置
+    :param date_from: 起始日期(包含)
+    :param date_to: 截止日期(包含)
+    :param cursor: 游标，上一页响应头 X-Next-Cursor 的值，传入后忽略 skip
+    :param skip: 起始位置 (旧版 offset 分页)
+    :param limit: 每页数量
+    :param db: 数据库对象，依赖子依赖
+    :return: 当前页的数据，下一页的游标在响应头 X-Next-Cursor 中
+    """
+    after = None
+    if cursor:
+        try:
+            after = pagination.decode_data_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    count, min_id, max_id, last_modified = await async_curd.get_data_version(
+        city_name=city, skip=skip, limit=limit, after=after, date_from=date_from, date_to=date_to, db=db
+    )
+    etag = httpcache.make_etag('data', count, min_id, max_id, last_modified)
+    headers = httpcache.cache_headers(etag, last_modified, get_settings().http_cache_control)
+    if httpcache.not_modified(request, etag, last_modified):
+        return httpcache.not_modified_response(headers)
+    data = await async_curd.get_data(
+        city_name=city, skip=skip, limit=limit, after=after, date_from=date_from, date_to=date_to, db=db
+    )
+    next_cursor = pagination.data_cursor(data, limit)
+    if next_cursor:
+        headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return Response(content=schemas.dump_data(data), media_type='application/json', headers=headers)
+
+
+# 汇总数据
+@application.get('/aggregates', response_model=List[Union[schemas.ReadCountryDaily, schemas.ReadCityRolling]])
+async def get_aggregates(level: str = Query('country', pattern='^(country|city)$'), country: str = None,
+                         city: str = None, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                         limit: int = Query(1000, ge=1, le=10000), db: AsyncSession = Depends(get_async_db)):
+    """
+    只读取汇总表，不扫描 Data 表
+
+    :param level: country 每个国家每天的合计 / city 每个城市最近7天的滚动合计
+    :param country: 国家，level=country 时有效
+    :param city: 城市名字，level=city 时有效
+    :param date_from: 起始日期(包含)
+    :param date_to: 截止日期(包含)
+    :param limit: 返回的最大条数
     :param db: 数据库对象，依赖子依赖
     :return:
     """
-    data = curd.get_data(city_name=city, skip=skip, limit=limit, db=db)
-    return data
+    if level == 'city':
+        return await async_curd.get_city_rolling(
+            db=db, city_name=city, date_from=date_from, date_to=date_to, limit=limit
+        )
+    return await async_curd.get_country_daily(db=db, country=country, date_from=date_from, date_to=date_to, limit=limit)
+
+
+# 数据分析
+@application.get('/analytics')
+async def get_analytics(city: str, window: int = Query(7, ge=1, le=365), date_from: Optional[date] = None,
+                        date_to: Optional[date] = None, series: List[str] = Query(None),
+                        db: AsyncSession = Depends(get_async_db)):
+    """
+    返回某个城市按日期排列的列式数组: 原始值、日增量、日增长率、滑动平均、每十万人的比例
+    同一天的多条数据求和；日期是连续的，没有数据的日期值为 null，滑动平均按日历天数计算
+
+    :param city: 城市名字
+    :param window: 滑动平均的天数
+    :param date_from: 起始日期(包含)
+    :param date_to: 截止日期(包含)
+    :param series: 需要返回的序列 value/delta/growth/rolling_mean/per_100k，默认全部返回
+    :param db: 数据库对象，依赖子依赖
+    :return:
+    """
+    # 第一次请求时才导入 NumPy，不使用这个接口时不增加应用的启动时间和内存
+    from sl.api import analytics
+
+    series = series or analytics.SERIES
+    unknown = set(series) - set(analytics.SERIES)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Unknown series: {}'.format(', '.join(sorted(unknown))),
+        )
+    db_city = await async_curd.get_city_by_name_cached(db=db, city_name=city)
+    if not db_city:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='City not found')
+    result = await analytics.city_analytics(
+        db=db, city_name=city, population=db_city.country_population, window=window,
+        date_from=date_from, date_to=date_to, series=series,
+    )
+    return {'city': city, 'population': db_city.country_population, 'window': window, **result}
+
+
+# 导出数据
+@application.get('/export')
+async def export_data(fmt: str = Query('ndjson', alias='format', pattern='^(ndjson|csv)$'), city: str = None,
+                      date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """
+    以 NDJSON 或 CSV 格式流式导出数据，不会把整张表读入内存
+
+    :param fmt: 导出格式 ndjson / csv
+    :param city: 城市名字
+    :param date_from: 起始日期(包含)
+    :param date_to: 截止日期(包含)
+    :return:
+    """
+    return StreamingResponse(
+        export.stream_data(fmt, city_name=city, date_from=date_from, date_to=date_to),
+        media_type=export.EXPORT_MEDIA_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="data.{fmt}"'},
+    )
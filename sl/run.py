@@ -1,20 +1,50 @@
-import logging
-import time
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Depends
-import uvicorn
+from fastapi import FastAPI, Depends, HTTPException
 from fastapi.exceptions import RequestValidationError
-from starlette.background import BackgroundTasks
 from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import PlainTextResponse
 from starlette.staticfiles import StaticFiles
 
 from sl import application
-from sl.api.endpoints import app1, app2, app3, app4, app5, app6
+from sl.core.appendlog import readme_log
+from sl.core.config import get_settings
+from sl.core.jobs import job_queue
+from sl.core.middleware import BodySizeLimitMiddleware, ErrorMappingMiddleware, RequestIdMiddleware, TimingMiddleware
+from sl.core.metrics import MetricsMiddleware, metrics, metrics_endpoint
+from sl.core.ratelimit import MemoryBucketBackend, RateLimiter, RateLimitMiddleware
+from sl.core.responses import default_response_class
+from sl.core.security import password_hasher, PasswordHasherBusy
+from sl.db.base import dispose_engines
+from sl.db.migrate import init_db
+from sl.api.endpoints import app1, app2, app3, app4, app5, app6, admin
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
+
+
+# 应用的生命周期: yield 之前在启动时执行，yield 之后在关闭时执行
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 建表和升级，不在导入模块时执行
+    if get_settings().db_migrate_on_startup:
+        await init_db()
+    # 启动后台任务的工作线程
+    job_queue.start()
+    yield
+    # 等待正在执行的后台任务结束，再把写队列中的记录写入文件
+    job_queue.stop()
+    readme_log.close()
+    # 释放数据库连接池
+    await dispose_engines()
+    # 关闭密码哈希的线程池
+    password_hasher.shutdown()
+
 
 app = FastAPI(
     # dependencies=[Depends()],
+    lifespan=lifespan,
+    # 所有路由默认的响应类，路由中可以通过 response_class 单独指定
+    default_response_class=default_response_class(get_settings().response_class),
     title='FastAPI Study and API Docs',
     openapi_version='3.0.2',
     description='FastAPI学习',
@@ -22,6 +52,20 @@ app = FastAPI(
     redoc_url='/redoc',
 )
 
+# 限流和请求体大小限制先添加，位于 CORS 之内，返回的 429/413 也带有跨域响应头，浏览器才能读到状态码和 Retry-After
+# 限流: 默认按IP限制每个客户端的请求速率，带有 Bearer token 时每个token再单独计数，各个路由的规则在 include_router 处配置
+settings = get_settings()
+rate_limiter = RateLimiter(
+    backend=MemoryBucketBackend(max_keys=settings.rate_limit_max_keys),
+    default=settings.rate_limit_default,
+)
+if settings.rate_limit_enabled:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
+# 请求体大小限制: 超过时在读取请求体之前(或读取过程中)返回 413，各个路由的限制在 include_router 处配置
+body_limits = {}
+app.add_middleware(BodySizeLimitMiddleware, max_body_size=settings.max_body_size, limits=body_limits)
+
 # 允许所有来源访问，允许所有方法、所有头
 """
 allow_origins: 允许访问的来源，可以是字符串或列表。------------->在生产环境中，避免使用 allow_origins=["*"]，而是明确指定允许的来源
@@ -43,8 +87,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=['*'],
     allow_headers=['*'],
+    # 游标分页的下一页游标在响应头中，需要允许浏览器读取
+    expose_headers=['X-Next-Cursor'],
 )
 
+# 纯ASGI中间件，后添加的在外层: 指标 > 请求id > 计时 > 异常转换 > CORS > 请求体大小 > 限流
+# 路由中没有处理的异常转换成响应: 线程池/连接池排队超时返回 503，其他返回 500
+app.add_middleware(ErrorMappingMiddleware, errors={
+    PasswordHasherBusy: 503,
+    SQLAlchemyTimeoutError: 503,
+})
+# 响应头 X-Process-Time
+app.add_middleware(TimingMiddleware)
+# 请求头/响应头 X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+# 请求指标: 每个路由的请求数、耗时分布和响应大小，Prometheus 从 /metrics 抓取
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+app.add_route('/metrics', metrics_endpoint, include_in_schema=False)
+
 # mount表示将某个目录下一个完全独立的应用挂载过来，这个不会在API交互文档中显示
 # .mount()不要在分路由APIRouter().mount()调用，模板会报错
 # path 访问路由
@@ -53,12 +113,6 @@ app.add_middleware(
 app.mount(path='/static', app=StaticFiles(directory='sl/static'), name='static')
 
 
-@app.middleware('http')
-async def my_middleware(request, call_next):
-    response = await call_next(request)
-    return response
-
-
 # 重写HTTPException异常处理器
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request, exc):
@@ -67,7 +121,8 @@ async def http_exception_handler(request, exc):
     :param exc:
     :return:
     """
-    return PlainTextResponse(str(exc.detail), status_code=exc.status_code)
+    # 保留异常中的响应头，例如 503 的 Retry-After、401 的 WWW-Authenticate
+    return PlainTextResponse(str(exc.detail), status_code=exc.status_code, headers=getattr(exc, 'headers', None))
 
 
 # 重写请求验证异常处理器
@@ -81,40 +136,33 @@ async def validation_exception_handler(request, exc):
     return PlainTextResponse(str(exc.args), status_code=400)
 
 
-# 定义中间件 ： 拦截请求并计算处理请求的时间
-@app.middleware('http')
-async def add_process_time_header(request, call_next):
-    """
-
-    :param request: 拦截到请求对象
-    :param call_next:   call_next将接收request请求做为参数
-    :return:
-    """
-    # 请求开始进入计时
-    start_time = time.time()
-    # 处理请求
-    response = await call_next(request)
-    # 请求结束计时
-    process_time = time.time() - start_time
-    # 将程序耗时 放到 响应头中
-    # 添加自定义的以“X-”开头的响应头
-    response.headers['X-Process-Time'] = str(process_time)
-
-    return response
-
-
 # 假设send_email函数实际发送电子邮件，这里简化为打印信息
+# 注册为后台任务，由任务队列的工作线程执行，失败后自动重试
+@job_queue.task('send_email')
 def send_email(email: str, message: str):
     print(f"Sending email to {email} with message: {message}")
     # 实际发送电子邮件的代码应该在这里
 
 
 @app.post('/send_email/{email}')
-async def send_email_route(email: str, background_tasks: BackgroundTasks):
+async def send_email_route(email: str):
     message = 'Hello'  # 定义要发送的消息内容
-    background_tasks.add_task(send_email, email, message)  # 将任务添加到后台任务队列
-    background_tasks.add_task(send_email, email, '这是第二条短信, 我将按照添加的顺序异步执行发送')
-    return {'message': 'Email sent!'}
+    # 将任务写入后台任务队列，进程重启后也不会丢失，可以通过 /jobs/{job_id} 查询状态
+    job_ids = [
+        await job_queue.enqueue_async('send_email', email, message),
+        await job_queue.enqueue_async('send_email', email, '这是第二条短信, 我将按照添加的顺序异步执行发送'),
+    ]
+    return {'message': 'Email sent!', 'job_ids': job_ids}
+
+
+# 查询后台任务的状态，读取队列文件，使用 def 由线程池执行
+# 只返回状态和执行次数；任务的参数和错误信息只能通过需要管理员token的 /admin/jobs/{job_id} 查看
+@app.get('/jobs/{job_id}')
+def job_status(job_id: int):
+    result = job_queue.status(job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return result
 
 # 将其他app添加到主路由下
 # app03 ： app名字
@@ -125,23 +173,29 @@ app.include_router(app1, prefix='/app1', tags=['demo1'])
 app.include_router(app2, prefix='/app2', tags=['demo2'])
 app.include_router(app3, prefix='/app3', tags=['demo3'])
 app.include_router(app4, prefix='/app4', tags=['demo4'])
+# 登录接口每次都要计算bcrypt，按IP单独限制
+rate_limiter.limit('/app4/token', settings.rate_limit_login, key='ip', methods=['POST'])
+rate_limiter.limit('/app4/jwt/token', settings.rate_limit_login, key='ip', methods=['POST'])
 app.include_router(app5, prefix='/app5', tags=['demo5'])
+# 上传文件的请求体可以很大，单独设置限制
+body_limits['/app5/file'] = settings.upload_max_request_size
+body_limits['/app5/upload_files'] = settings.upload_max_request_size
+body_limits['/app5/uploads'] = settings.upload_max_chunk_size
 app.include_router(app6, prefix='/app6', tags=['demo6'])
 app.include_router(application, prefix='/application', tags=['application'])
+app.include_router(admin, prefix='/admin', tags=['admin'])
 
 
 def main():
     """
-    run:sl : 启动文件：app名字
-    host : IP
-    port : 端口
-    reload : 自动重启
-    debug : debug模式
-    workers : 开启的进程数
+    启动服务，参数见 sl/server.py，例如:
+    python -m sl.run --workers 4 --port 8080
+    python -m sl.run --reload      开发时使用
+    多进程和自动重启需要传入应用的导入路径 sl.run:app，而不是 app 对象
     """
+    from sl import server
 
-    uvicorn.run(app, host='127.0.0.1', port=8000, reload=True, workers=1)
-    # uvicorn.run(app, host='127.0.0.1', port=8000, reload=True, workers=1, log_level=logging.DEBUG)
+    return server.main()
 
 
 if __name__ == '__main__':
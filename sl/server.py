@@ -0,0 +1,189 @@
+# 启动服务
+#   python -m sl.server                          按CPU核数启动多个进程
+#   python -m sl.server sl.run:app --workers 4 --port 8080
+#   python -m sl.server --reload                 开发时使用，单进程，修改代码后自动重启
+#
+# 安装了 gunicorn 时(Linux/macOS)由 gunicorn 管理进程:
+#   主进程先导入应用(preload)再 fork 出工作进程，导入的模块在进程之间共享内存(写时复制)；
+#   kill -HUP <主进程>   先启动新的工作进程，再优雅地停止旧的，不中断服务
+#   kill -USR2 <主进程>  重新执行主进程以加载新代码，新的主进程就绪后向旧的主进程发送 TERM
+# 没有 gunicorn 时使用 uvicorn 的多进程模式: 没有 preload，每个工作进程各自导入应用，模块不在进程之间共享内存；
+#   kill -HUP 逐个替换工作进程
+# 安装了 uvloop/httptools 时使用更快的事件循环和HTTP解析器
+
+import argparse
+import importlib.util
+import inspect
+import os
+import sys
+import tempfile
+
+from sl.core.config import get_settings
+
+
+def cpu_count() -> int:
+    """当前进程可以使用的CPU核数(考虑 taskset/cgroup 的限制)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def is_installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def event_loop() -> str:
+    return 'uvloop' if is_installed('uvloop') else 'asyncio'
+
+
+def http_protocol() -> str:
+    return 'httptools' if is_installed('httptools') else 'h11'
+
+
+def choose_backend(backend: str, reload: bool) -> str:
+    if backend != 'auto':
+        return backend
+    # gunicorn 不支持 Windows，也不支持代码修改后自动重启
+    if not reload and sys.platform != 'win32' and is_installed('gunicorn'):
+        return 'gunicorn'
+    return 'uvicorn'
+
+
+def migrate_once():
+    """
+    多个进程同时启动时各自建表可能冲突，由主进程先执行一次，工作进程启动时不再执行
+    引擎是第一次使用时才创建的，这里用完就释放，fork 之前不会留下数据库连接
+    """
+    from sl.db.migrate import main as migrate
+
+    migrate(['upgrade'])
+    os.environ['SL_DB_MIGRATE_ON_STARTUP'] = 'false'
+    get_settings.cache_clear()
+
+
+def prepare_metrics_dir():
+    """
+    多个进程的请求指标写入同一个目录，/metrics 合并后输出，否则每次抓取只能看到其中一个进程的指标
+    没有配置 metrics_dir 时使用临时目录，通过环境变量传给工作进程
+    """
+    directory = get_settings().metrics_dir
+    if not directory:
+        directory = tempfile.mkdtemp(prefix='sl-metrics-')
+        os.environ['SL_METRICS_DIR'] = directory
+        get_settings.cache_clear()
+    # 模块级的 metrics 在导入时读取配置，必须在设置环境变量之后导入；
+    # gunicorn 预加载时工作进程直接继承主进程的这个对象，已经导入过的也要改成这个目录
+    from sl.core.metrics import metrics, reset_directory
+
+    reset_directory(directory)
+    metrics.directory = directory
+
+
+def run_gunicorn(app: str, options: dict):
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.importer import import_from_string
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for name, value in options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return import_from_string(app)
+
+    Application().run()
+
+
+def worker_class() -> str:
+    # uvicorn.workers 已经移到单独的 uvicorn-worker 包中
+    if is_installed('uvicorn_worker'):
+        return 'uvicorn_worker.UvicornWorker'
+    return 'uvicorn.workers.UvicornWorker'
+
+
+def uvicorn_options(settings) -> dict:
+    """
+    只在配置了 server_max_requests 时传入定期重启的参数；
+    limit_max_requests_jitter 只有较新的 uvicorn 才支持，旧版本不认识的参数不传，避免启动时报 TypeError
+    """
+    import uvicorn
+
+    options = {}
+    if settings.server_max_requests:
+        options['limit_max_requests'] = settings.server_max_requests
+        options['limit_max_requests_jitter'] = settings.server_max_requests_jitter
+    accepted = inspect.signature(uvicorn.Config.__init__).parameters
+    return {name: value for name, value in options.items() if name in accepted}
+
+
+def serve(app: str, host: str, port: int, workers: int, backend: str = 'auto', reload: bool = False):
+    """
+    :param app: 应用的导入路径，例如 sl.run:app，多进程和自动重启都需要导入路径而不是应用对象
+    :param host: 监听地址
+    :param port: 端口
+    :param workers: 工作进程数
+    :param backend: gunicorn/uvicorn/auto
+    :param reload: 修改代码后自动重启，只在开发时使用，此时只有一个进程
+    """
+    settings = get_settings()
+    backend = choose_backend(backend, reload)
+    if reload:
+        workers = 1
+    if workers > 1 and settings.db_migrate_on_startup:
+        migrate_once()
+    if workers > 1:
+        prepare_metrics_dir()
+    print(f'{app} on http://{host}:{port} backend={backend} workers={workers} '
+          f'loop={event_loop()} http={http_protocol()}', file=sys.stderr)
+
+    if backend == 'gunicorn':
+        options = {
+            'bind': f'{host}:{port}',
+            'workers': workers,
+            'worker_class': worker_class(),
+            'preload_app': True,
+            'graceful_timeout': settings.server_graceful_timeout,
+            'keepalive': settings.server_keepalive,
+            'backlog': settings.server_backlog,
+        }
+        if settings.server_max_requests:
+            options['max_requests'] = settings.server_max_requests
+            options['max_requests_jitter'] = settings.server_max_requests_jitter
+        run_gunicorn(app, options)
+        return
+
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=host,
+        port=port,
+        workers=workers,
+        reload=reload,
+        loop=event_loop(),
+        http=http_protocol(),
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keepalive,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        **uvicorn_options(settings),
+    )
+
+
+def main(argv=None):
+    settings = get_settings()
+    parser = argparse.ArgumentParser(prog='python -m sl.server', description='启动服务')
+    parser.add_argument('app', nargs='?', default=settings.server_app, help='应用的导入路径，例如 sl.run:app')
+    parser.add_argument('--host', default=settings.server_host)
+    parser.add_argument('--port', type=int, default=settings.server_port)
+    parser.add_argument('--workers', type=int, default=settings.server_workers, help='默认等于可用的CPU核数')
+    parser.add_argument('--backend', choices=['auto', 'gunicorn', 'uvicorn'], default=settings.server_backend)
+    parser.add_argument('--reload', action='store_true', default=settings.server_reload)
+    args = parser.parse_args(argv)
+
+    serve(args.app, args.host, args.port, args.workers or cpu_count(), backend=args.backend, reload=args.reload)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
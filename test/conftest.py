@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+
+from sl.api.models import city
+
+"""接口测试共用: 使用临时 SQLite 数据库的应用"""
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def app_client(tmp_path, monkeypatch):
+    """
+    应用启动时在临时数据库中建表；进程内的响应缓存、城市缓存和限流计数清空，避免测试之间互相影响
+    client.engine 是同一个数据库的同步引擎，用于直接写入测试数据
+    """
+    from sl.api import curd
+    from sl.core.jobs import job_queue
+    from sl.core.ratelimit import MemoryBucketBackend
+    from sl.core.response_cache import response_cache
+    from sl.db import base
+    from sl.run import app, rate_limiter
+
+    url = f'sqlite:///{tmp_path / "test.db"}'
+    monkeypatch.setattr(base, 'SQLALCHEMY_DATABASE_URL', url)
+    monkeypatch.setattr(job_queue, 'path', str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(rate_limiter, 'backend', MemoryBucketBackend())
+    factories = (base.get_engine, base.get_async_engine, base.get_sessionmaker, base.get_async_sessionmaker)
+    for factory in factories:
+        factory.cache_clear()
+    response_cache.clear()
+    curd.city_cache.clear()
+    engine = create_engine(url)
+    try:
+        with TestClient(app) as client:
+            client.engine = engine
+            yield client
+    finally:
+        engine.dispose()
+        for factory in factories:
+            factory.cache_clear()
+        response_cache.clear()
+        curd.city_cache.clear()
+
+
+def create_city(client: TestClient, province: str, country: str = 'c', population: int = 100_000) -> int:
+    response = client.post('/application/create_city', json={
+        'province': province, 'country': country, 'country_code': country, 'country_population': population,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()['id']
+
+
+def insert_data(client: TestClient, rows: list):
+    """直接写入 Data 表，不经过接口，写入后让列表接口的响应缓存失效"""
+    from sl.core.response_cache import response_cache
+
+    with client.engine.begin() as connection:
+        connection.execute(insert(city.Data), [
+            {'confirmed': 0, 'deaths': 0, 'recovered': 0, 'created_at': NOW, 'updated_at': NOW, **row}
+            for row in rows
+        ])
+    response_cache.invalidate('data')
@@ -0,0 +1,102 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Session
+
+from sl.api import aggregates
+from sl.api.models import city
+from sl.db import migrate
+
+"""汇总表: 增量累加的 upsert、7天滚动合计，以及升级时根据已有数据补充汇总表"""
+
+NOW = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "a.db"}')
+    with engine.begin() as connection:
+        migrate.upgrade(connection)
+        connection.execute(insert(city.City), [
+            {'id': i, 'province': f'p{i}', 'country': 'c', 'country_code': 'cc', 'country_population': 1,
+             'created_at': NOW, 'updated_at': NOW}
+            for i in (1, 2)
+        ])
+    yield engine
+    engine.dispose()
+
+
+def data(city_id: int, day: int, confirmed: int, deaths: int = 0) -> dict:
+    return {'city_id': city_id, 'date': date(2020, 1, day), 'confirmed': confirmed, 'deaths': deaths,
+            'recovered': 0}
+
+
+def insert_data(db: Session, rows: list):
+    db.execute(insert(city.Data), [{**row, 'created_at': NOW, 'updated_at': NOW} for row in rows])
+
+
+def test_rolling_deltas_spread_over_seven_days():
+    deltas = aggregates.rolling_deltas([data(1, 1, 5), data(1, 2, 3)])
+    totals = {row['date']: row['confirmed'] for row in deltas}
+    assert sorted(totals) == [date(2020, 1, 1) + timedelta(days=day) for day in range(8)]
+    # 1月1日的数据计入1日到7日，1月2日的数据计入2日到8日
+    assert totals[date(2020, 1, 1)] == 5
+    assert totals[date(2020, 1, 7)] == 8
+    assert totals[date(2020, 1, 8)] == 3
+
+
+def test_upsert_adds_to_existing_rows(engine):
+    with Session(engine) as db:
+        aggregates.apply(db, [data(1, 1, 5, deaths=1), data(2, 1, 7)])
+        aggregates.apply(db, [data(1, 1, 10, deaths=2)])
+        db.commit()
+        daily = db.execute(select(city.CountryDaily)).scalars().all()
+        assert [(row.country, row.date, row.confirmed, row.deaths) for row in daily] == [
+            ('c', date(2020, 1, 1), 22, 3),
+        ]
+        rolling = db.execute(
+            select(city.CityRolling).where(city.CityRolling.city_id == 1).order_by(city.CityRolling.date)
+        ).scalars().all()
+        assert len(rolling) == aggregates.ROLLING_WINDOW
+        assert {row.confirmed for row in rolling} == {15}
+
+
+def test_mysql_upsert_statement():
+    sql = str(aggregates.upsert('mysql', city.CityRolling).compile(dialect=mysql.dialect()))
+    assert 'ON DUPLICATE KEY UPDATE confirmed = (city_rolling.confirmed + VALUES(confirmed))' in sql
+
+
+def test_unsupported_database_skips_rollups(caplog):
+    assert aggregates._statements('oracle', [data(1, 1, 5)], {1: 'c'}) == []
+    assert 'not maintained on oracle' in caplog.text
+
+
+def test_city_rolling_stops_at_last_data_date(engine):
+    with Session(engine) as db:
+        rows = [data(1, 1, 1), data(1, 2, 2), data(1, 4, 4)]
+        insert_data(db, rows)
+        aggregates.apply(db, rows)
+        db.commit()
+        result = db.execute(aggregates.select_city_rolling('p1')).scalars().all()
+    # 缺失的1月3日仍然有滚动合计，最后一天(1月4日)之后的日期不返回
+    assert [(row.date.day, row.confirmed) for row in result] == [(1, 1), (2, 3), (3, 3), (4, 7)]
+
+
+def test_backfill_existing_data(engine):
+    with Session(engine) as db:
+        # 升级前写入的数据，汇总表是空的
+        insert_data(db, [data(1, 1, 5), data(2, 1, 7), data(1, 2, 1)])
+        db.commit()
+        assert aggregates.backfill(db)
+        daily = db.execute(select(city.CountryDaily).order_by(city.CountryDaily.date)).scalars().all()
+        assert [(row.date.day, row.confirmed) for row in daily] == [(1, 12), (2, 1)]
+        # 汇总表已经有数据时不再重建
+        assert not aggregates.backfill(db)
+        assert db.execute(select(city.CountryDaily)).scalars().all()[0].confirmed == 12
+
+
+def test_backfill_empty_database(engine):
+    with Session(engine) as db:
+        assert not aggregates.backfill(db)
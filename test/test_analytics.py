@@ -0,0 +1,60 @@
+from datetime import date, datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from sl.api import analytics
+from sl.api.models import city
+from sl.db.base import Base
+
+"""时间序列分析: 同一天的多条数据求和，缺失的日期按日历天补齐"""
+
+
+def test_select_series_groups_by_date(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "a.db"}')
+    Base.metadata.create_all(engine)
+    now = datetime(2024, 1, 1)
+    with Session(engine) as db:
+        db.execute(insert(city.City), [{
+            'id': 1, 'province': 'p', 'country': 'c', 'country_code': 'cc', 'country_population': 100_000,
+            'created_at': now, 'updated_at': now,
+        }])
+        db.execute(insert(city.Data), [
+            {'city_id': 1, 'date': day, 'confirmed': confirmed, 'deaths': 0, 'recovered': 0,
+             'created_at': now, 'updated_at': now}
+            for day, confirmed in ((date(2020, 1, 3), 30), (date(2020, 1, 1), 10), (date(2020, 1, 1), 5))
+        ])
+        rows = db.execute(analytics.select_series('p')).all()
+    engine.dispose()
+    assert [tuple(row) for row in rows] == [(date(2020, 1, 1), 15, 0, 0), (date(2020, 1, 3), 30, 0, 0)]
+
+
+def test_duplicate_and_missing_dates():
+    rows = [
+        (date(2020, 1, 1), 10, 1, 0),
+        (date(2020, 1, 1), 5, 0, 0),
+        (date(2020, 1, 3), 30, 2, 0),
+        (date(2020, 1, 4), 60, 2, 0),
+    ]
+    columns = analytics.to_columns(rows)
+    assert columns['date'] == [date(2020, 1, day) for day in (1, 2, 3, 4)]
+    assert columns['confirmed'].tolist() == [15, 0, 30, 60]
+
+    result = analytics.compute(columns, population=100_000, window=2)
+    confirmed = result['confirmed']
+    assert result['date'] == ['2020-01-01', '2020-01-02', '2020-01-03', '2020-01-04']
+    assert confirmed['value'] == [15, None, 30, 60]
+    # 同一天的两条数据不会产生 0 增量，缺失日期前后没有增量
+    assert confirmed['delta'] == [None, None, None, 30.0]
+    assert confirmed['growth'] == [None, None, None, 1.0]
+    # 窗口是2个日历天，缺失的日期按0计入
+    assert confirmed['rolling_mean'] == [None, 7.5, 15.0, 45.0]
+    assert confirmed['per_100k'] == [15.0, None, 30.0, 60.0]
+    assert result['deaths']['delta'] == [None, None, None, 0.0]
+
+
+def test_consecutive_dates_keep_plain_values():
+    rows = [(date(2020, 1, day), day, 0, 0) for day in (1, 2, 3)]
+    result = analytics.compute(analytics.to_columns(rows), population=0, window=7, series=('value', 'delta'))
+    assert result['confirmed'] == {'value': [1, 2, 3], 'delta': [None, 1.0, 1.0]}
+    assert analytics.compute(analytics.to_columns([]), population=1)['confirmed']['value'] == []
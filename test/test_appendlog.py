@@ -0,0 +1,47 @@
+import os
+
+from sl.api.endpoints import demo5
+from sl.core import appendlog
+from sl.core.appendlog import AppendLog
+
+"""批量追加写文件: 批量写入、flush 和后台任务写入磁盘后才完成"""
+
+
+def test_records_are_batched(tmp_path):
+    log = AppendLog(str(tmp_path / 'a.log'), batch_size=100, flush_interval=0.05, fsync='never')
+    for i in range(250):
+        log.write(f'{i}\n')
+    assert log.flush(timeout=5)
+    log.close()
+    with open(tmp_path / 'a.log') as f:
+        assert f.read() == ''.join(f'{i}\n' for i in range(250))
+    assert log.records == 250
+    assert log.batches <= 5
+
+
+def test_durable_flush_fsyncs_regardless_of_policy(tmp_path, monkeypatch):
+    calls = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(appendlog.os, 'fsync', lambda fd: calls.append(fd) or real_fsync(fd))
+    log = AppendLog(str(tmp_path / 'a.log'), fsync='never')
+    log.write('a\n')
+    assert log.flush(timeout=5)
+    assert calls == []
+    log.write('b\n')
+    assert log.flush(timeout=5, durable=True)
+    assert len(calls) == 1
+    log.close()
+
+
+def test_bg_task_waits_for_durable_write(tmp_path, monkeypatch):
+    log = AppendLog(str(tmp_path / 'README.md'), fsync='never')
+    flushes = []
+    flush = log.flush
+    monkeypatch.setattr(log, 'flush', lambda timeout=None, durable=False: flushes.append(durable) or flush(
+        timeout, durable))
+    monkeypatch.setattr(demo5, 'readme_log', log)
+    demo5.bg_task('FastAPI')
+    assert flushes == [True]
+    with open(tmp_path / 'README.md', encoding='utf-8') as f:
+        assert f.read() == '## FastAPI 框架精讲'
+    log.close()
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from sl.api.endpoints import demo4
+
+"""JWT 校验结果的缓存和注销"""
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    demo4.clear_token_cache()
+    yield
+    demo4.clear_token_cache()
+
+
+def test_claims_and_user_are_cached(monkeypatch):
+    token = demo4.create_access_token({'sub': 'jiali'}, expires_delta=timedelta(minutes=5))
+    claims, user = demo4.verify_token(token)
+    assert claims['sub'] == 'jiali' and user.username == 'jiali'
+
+    # 缓存命中时不再校验签名
+    def fail(*args, **kwargs):
+        raise AssertionError('decoded twice')
+
+    monkeypatch.setattr(demo4.jwt, 'decode', fail)
+    assert demo4.verify_token(token) == (claims, user)
+
+
+def test_revoked_token_is_rejected():
+    token = demo4.create_access_token({'sub': 'shilin'}, expires_delta=timedelta(minutes=5))
+    claims, _ = demo4.verify_token(token)
+    demo4.revoke_token(token, expire=claims['exp'])
+    with pytest.raises(HTTPException) as e:
+        demo4.verify_token(token)
+    assert e.value.status_code == 401
+
+
+def test_invalid_token():
+    with pytest.raises(HTTPException) as e:
+        demo4.verify_token('not-a-jwt')
+    assert e.value.status_code == 401
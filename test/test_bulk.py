@@ -0,0 +1,63 @@
+import orjson
+
+from test.conftest import create_city
+
+"""批量导入: JSON 列表和 NDJSON 两种格式，未知省份整体回滚"""
+
+
+def records(provinces, days=3):
+    return [
+        {'province': province, 'date': f'2020-01-{day + 1:02d}', 'confirmed': day}
+        for province in provinces for day in range(days)
+    ]
+
+
+def count(client, **params):
+    return len(client.get('/application/get_data', params={'limit': 10000, **params}).json())
+
+
+def test_json_list(app_client):
+    create_city(app_client, 'a')
+    create_city(app_client, 'b')
+    # 先请求一次，确认导入后列表缓存失效
+    assert count(app_client) == 0
+    response = app_client.post('/application/bulk_data', params={'batch_size': 4}, json=records(['a', 'b']))
+    assert response.status_code == 200, response.text
+    assert response.json() == {'inserted': 6, 'batches': [4, 2]}
+    assert count(app_client) == 6
+    assert count(app_client, city='b') == 3
+
+
+def test_ndjson(app_client):
+    create_city(app_client, 'a')
+    create_city(app_client, 'b')
+    body = b'\n'.join(orjson.dumps(record) for record in records(['a', 'b'], days=5)) + b'\n'
+    response = app_client.post('/application/bulk_data', params={'batch_size': 3}, content=body,
+                               headers={'Content-Type': 'application/x-ndjson'})
+    assert response.status_code == 200, response.text
+    assert response.json() == {'inserted': 10, 'batches': [3, 3, 3, 1]}
+    data = app_client.get('/application/get_data', params={'city': 'a', 'limit': 100}).json()
+    assert [item['confirmed'] for item in data] == list(range(5))
+
+
+def test_unknown_province_rolls_back(app_client):
+    create_city(app_client, 'a')
+    # 未知省份出现在第二批，第一批已经写入的数据也要回滚
+    body = records(['a']) + records(['x', 'y'])
+    for kwargs in (
+        {'json': body},
+        {'content': b'\n'.join(orjson.dumps(record) for record in body),
+         'headers': {'Content-Type': 'application/x-ndjson'}},
+    ):
+        response = app_client.post('/application/bulk_data', params={'batch_size': 3}, **kwargs)
+        assert response.status_code == 400
+        # NDJSON 按批解析，只报告出错批次中的未知省份
+        assert response.text.startswith('City not found: x')
+    assert count(app_client) == 0
+
+
+def test_invalid_record_returns_400(app_client):
+    create_city(app_client, 'a')
+    response = app_client.post('/application/bulk_data', json=[{'province': 'a', 'date': 'nope'}])
+    assert response.status_code == 400
+    assert count(app_client) == 0
@@ -0,0 +1,31 @@
+import time
+
+from sl.core.cache import ExpiringSet, MemoryCache
+
+"""进程内缓存: LRU 淘汰，以及只在过期后删除的集合"""
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get('b', None) is None
+
+
+def test_expiring_set_rejects_instead_of_evicting():
+    revoked = ExpiringSet(maxsize=2)
+    assert revoked.add('a', ttl=0.05)
+    assert revoked.add('b', ttl=60)
+    # 满了之后不淘汰已有的数据
+    assert not revoked.add('c', ttl=60)
+    assert 'a' in revoked and 'b' in revoked and 'c' not in revoked
+    # 已有的 key 可以更新过期时间
+    assert revoked.add('b', ttl=120)
+    time.sleep(0.06)
+    # 过期的数据删除后有了空位
+    assert 'a' not in revoked
+    assert revoked.add('c', ttl=60)
+    assert revoked.stats() == {'size': 2, 'maxsize': 2}
@@ -0,0 +1,65 @@
+import csv
+import io
+from datetime import date, timedelta
+
+import orjson
+
+from sl.api import export
+from test.conftest import create_city, insert_data
+
+"""流式导出: NDJSON 和 CSV 的内容与 get_data 一致，过滤条件生效，跨越多个读取批次不丢行"""
+
+
+def seed(client, days=10):
+    first, second = create_city(client, 'a'), create_city(client, 'b')
+    insert_data(client, [
+        {'city_id': city_id, 'date': date(2020, 1, 1) + timedelta(days=day), 'confirmed': day}
+        for city_id in (first, second) for day in range(days)
+    ])
+
+
+def read_ndjson(response) -> list:
+    return [orjson.loads(line) for line in response.text.splitlines()]
+
+
+def test_ndjson_matches_get_data(app_client):
+    seed(app_client)
+    response = app_client.get('/application/export')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    assert response.headers['content-disposition'] == 'attachment; filename="data.ndjson"'
+    rows = read_ndjson(response)
+    assert all(list(row) == export.EXPORT_FIELDS for row in rows)
+    assert rows == app_client.get('/application/get_data', params={'limit': 10000}).json()
+
+
+def test_csv(app_client):
+    seed(app_client)
+    response = app_client.get('/application/export', params={'format': 'csv', 'city': 'b'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == export.EXPORT_FIELDS
+    assert len(rows) == 11
+    records = [dict(zip(rows[0], row)) for row in rows[1:]]
+    assert [record['confirmed'] for record in records] == [str(day) for day in range(10)]
+    assert records[0]['date'] == '2020-01-01'
+
+
+def test_filters(app_client):
+    seed(app_client)
+    params = {'city': 'a', 'date_from': '2020-01-04', 'date_to': '2020-01-06'}
+    rows = read_ndjson(app_client.get('/application/export', params=params))
+    assert [row['date'] for row in rows] == ['2020-01-04', '2020-01-05', '2020-01-06']
+    # 没有数据时 CSV 只有表头
+    response = app_client.get('/application/export', params={'format': 'csv', 'city': 'x'})
+    assert response.text.splitlines() == [','.join(export.EXPORT_FIELDS)]
+    assert app_client.get('/application/export', params={'format': 'xml'}).status_code == 400
+
+
+def test_multiple_chunks(app_client, monkeypatch):
+    monkeypatch.setattr(export, 'EXPORT_CHUNK_ROWS', 3)
+    seed(app_client, days=5)
+    rows = read_ndjson(app_client.get('/application/export'))
+    assert len(rows) == 10
+    assert len({row['id'] for row in rows}) == 10
@@ -0,0 +1,54 @@
+from datetime import date, timedelta
+
+from test.conftest import create_city, insert_data
+
+"""按城市和日期范围过滤数据，offset 分页与游标分页结果一致"""
+
+
+def seed(client):
+    first, second = create_city(client, 'a'), create_city(client, 'b')
+    start = date(2020, 1, 1)
+    insert_data(client, [
+        {'city_id': city_id, 'date': start + timedelta(days=day), 'confirmed': day}
+        for city_id in (first, second) for day in range(10)
+    ])
+    return first, second
+
+
+def test_city_filter(app_client):
+    first, _ = seed(app_client)
+    data = app_client.get('/application/get_data', params={'city': 'a', 'limit': 100}).json()
+    assert len(data) == 10
+    assert {item['city_id'] for item in data} == {first}
+    # 分页作用在过滤之后
+    page = app_client.get('/application/get_data', params={'city': 'a', 'skip': 8, 'limit': 5}).json()
+    assert [item['date'] for item in page] == ['2020-01-09', '2020-01-10']
+    assert app_client.get('/application/get_data', params={'city': 'x'}).json() == []
+
+
+def test_date_range_is_inclusive(app_client):
+    seed(app_client)
+    params = {'city': 'b', 'date_from': '2020-01-03', 'date_to': '2020-01-05', 'limit': 100}
+    data = app_client.get('/application/get_data', params=params).json()
+    assert [item['date'] for item in data] == ['2020-01-03', '2020-01-04', '2020-01-05']
+    data = app_client.get('/application/get_data', params={'date_from': '2020-01-09', 'limit': 100}).json()
+    assert len(data) == 4
+    data = app_client.get('/application/get_data', params={'date_to': '2020-01-01', 'limit': 100}).json()
+    assert [item['confirmed'] for item in data] == [0, 0]
+
+
+def test_cursor_with_filters(app_client):
+    seed(app_client)
+    params = {'city': 'a', 'date_from': '2020-01-02', 'date_to': '2020-01-08', 'limit': 3}
+    items, cursor = [], None
+    while True:
+        response = app_client.get('/application/get_data', params={**params, **({'cursor': cursor} if cursor else {})})
+        items += response.json()
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+    assert [item['confirmed'] for item in items] == list(range(1, 8))
+
+
+def test_invalid_date_returns_400(app_client):
+    assert app_client.get('/application/get_data', params={'date_from': '2020-13-01'}).status_code == 400
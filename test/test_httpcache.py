@@ -0,0 +1,84 @@
+from datetime import date, datetime, timezone
+
+from starlette.requests import Request
+
+from sl.core import httpcache
+from test.conftest import create_city, insert_data
+
+"""条件请求: If-None-Match / If-Modified-Since 命中时返回空的 304，数据变化后 ETag 随之变化"""
+
+
+def make_request(**headers) -> Request:
+    return Request({'type': 'http', 'headers': [(key.replace('_', '-').encode(), value.encode())
+                                                for key, value in headers.items()]})
+
+
+def test_etag_matching():
+    etag = httpcache.make_etag('data', 3, 1, 3, None)
+    assert etag.startswith('W/"')
+    assert httpcache.etag_matches(etag.removeprefix('W/'), etag)
+    assert httpcache.etag_matches(f'"other", {etag}', etag)
+    assert httpcache.etag_matches('*', etag)
+    assert not httpcache.etag_matches('"other"', etag)
+
+
+def test_not_modified():
+    modified = datetime(2024, 1, 1, 12, 0, 0, 500000)
+    etag = 'W/"abc"'
+    since = httpcache.http_date(modified)
+    assert since == 'Mon, 01 Jan 2024 12:00:00 GMT'
+    assert httpcache.not_modified(make_request(if_modified_since=since), etag, modified)
+    assert not httpcache.not_modified(make_request(if_modified_since='Mon, 01 Jan 2024 11:59:59 GMT'), etag, modified)
+    assert not httpcache.not_modified(make_request(if_modified_since='garbage'), etag, modified)
+    # 同时带有两个头时只比较 If-None-Match
+    assert not httpcache.not_modified(make_request(if_none_match='"x"', if_modified_since=since), etag, modified)
+    assert not httpcache.not_modified(make_request(), etag, modified)
+    assert httpcache.to_utc(modified.replace(tzinfo=timezone.utc)) == datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def test_cities_304(app_client):
+    create_city(app_client, 'a')
+    response = app_client.get('/application/get_cities')
+    assert response.status_code == 200
+    etag, last_modified = response.headers['etag'], response.headers['last-modified']
+    assert 'cache-control' in response.headers
+
+    cached = app_client.get('/application/get_cities', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.content == b''
+    assert cached.headers['etag'] == etag
+    cached = app_client.get('/application/get_cities', headers={'If-Modified-Since': last_modified})
+    assert cached.status_code == 304
+    assert app_client.get('/application/get_cities', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+    # 新增城市后旧的 ETag 不再命中
+    create_city(app_client, 'b')
+    response = app_client.get('/application/get_cities', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers['etag'] != etag
+
+
+def test_data_304(app_client):
+    city_id = create_city(app_client, 'a')
+    insert_data(app_client, [{'city_id': city_id, 'date': date(2020, 1, 1)}])
+    params = {'city': 'a'}
+    response = app_client.get('/application/get_data', params=params)
+    etag = response.headers['etag']
+    assert response.headers['last-modified'] == 'Mon, 01 Jan 2024 12:00:00 GMT'
+
+    cached = app_client.get('/application/get_data', params=params, headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.content == b''
+    # 不同的页、不同的过滤条件有各自的 ETag
+    other = app_client.get('/application/get_data', params={**params, 'date_from': '2021-01-01'})
+    assert other.json() == []
+    assert other.headers['etag'] != etag
+
+    # 通过接口写入数据后，列表缓存失效，ETag 变化
+    response = app_client.post('/application/create_data', params=params, json={'date': '2020-01-02'})
+    assert response.status_code == 200, response.text
+    response = app_client.get('/application/get_data', params=params, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers['etag'] != etag
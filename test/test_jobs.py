@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+from sl.core.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+
+"""后台任务队列: 入队、执行、失败重试和租约到期后重新执行"""
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), max_attempts=3, backoff=0.0, lease=60)
+    yield queue
+    queue._close_connection()
+
+
+def test_enqueue_and_run(queue):
+    calls = []
+    queue.task('add')(lambda a, b=0: calls.append(a + b))
+    job_id = queue.enqueue('add', 1, b=2)
+    assert queue.get(job_id)['status'] == QUEUED
+    assert queue.get(job_id)['args'] == [1] and queue.get(job_id)['kwargs'] == {'b': 2}
+    assert queue.run_once()
+    assert calls == [3]
+    status = queue.status(job_id)
+    assert status['id'] == job_id and status['status'] == DONE and status['attempts'] == 1
+    # 对外的状态不包含参数和错误信息
+    assert set(status) == {'id', 'name', 'status', 'attempts', 'max_attempts', 'created_at', 'updated_at'}
+    assert not queue.run_once()
+    assert queue.status(job_id + 1) is None
+    with pytest.raises(ValueError):
+        queue.enqueue('missing')
+
+
+def test_async_task(queue):
+    calls = []
+
+    @queue.task('hello')
+    async def hello(name):
+        calls.append(name)
+
+    queue.enqueue('hello', 'world')
+    assert queue.run_once()
+    assert calls == ['world']
+
+
+def test_claim_sets_a_lease(queue):
+    queue.task('noop')(lambda: None)
+    job_id = queue.enqueue('noop')
+    row = queue._claim('w1')
+    job = queue.get(job_id)
+    assert row['id'] == job_id
+    assert job['status'] == RUNNING and job['worker'] == 'w1' and job['attempts'] == 1
+    assert job['run_at'] == pytest.approx(time.time() + queue.lease, abs=5)
+    # 租约未到期，其他工作线程取不到这个任务
+    assert queue._claim('w2') is None
+
+
+def test_retry_then_fail(queue):
+    attempts = []
+
+    @queue.task('flaky', max_attempts=2)
+    def flaky():
+        attempts.append(1)
+        raise RuntimeError('boom')
+
+    job_id = queue.enqueue('flaky')
+    assert queue.run_once()
+    job = queue.get(job_id)
+    assert job['status'] == QUEUED and job['attempts'] == 1 and 'boom' in job['last_error']
+    assert queue.run_once()
+    job = queue.get(job_id)
+    assert job['status'] == FAILED and job['attempts'] == 2
+    assert len(attempts) == 2
+    assert not queue.run_once()
+    assert queue.counts() == {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 1}
+
+
+def test_retry_succeeds(queue):
+    attempts = []
+
+    @queue.task('flaky')
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise RuntimeError('boom')
+
+    job_id = queue.enqueue('flaky')
+    assert queue.run_once() and queue.run_once()
+    job = queue.get(job_id)
+    assert job['status'] == DONE and job['attempts'] == 2 and job['last_error'] is None
+
+
+def test_expired_lease_is_recovered(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), max_attempts=2, backoff=0.0, lease=0.05)
+    calls = []
+    queue.task('work')(lambda: calls.append(1))
+    job_id = queue.enqueue('work')
+    # 取出任务后进程崩溃，没有调用 _finish
+    assert queue._claim('crashed') is not None
+    assert not queue.run_once()
+    time.sleep(0.1)
+    # 租约到期后被其他工作线程重新执行
+    assert queue.run_once('w2')
+    job = queue.get(job_id)
+    assert calls == [1]
+    assert job['status'] == DONE and job['attempts'] == 2 and job['worker'] == 'w2'
+    queue._close_connection()
+
+
+def test_expired_lease_without_attempts_left_fails(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), max_attempts=1, lease=0.05)
+    queue.task('work')(lambda: None)
+    job_id = queue.enqueue('work')
+    assert queue._claim('crashed') is not None
+    time.sleep(0.1)
+    assert not queue.run_once()
+    job = queue.get(job_id)
+    assert job['status'] == FAILED and job['last_error'] == 'lease expired'
+    queue._close_connection()
+
+
+def test_worker_threads(queue):
+    calls = []
+    queue.task('work')(lambda i: calls.append(i))
+    queue.start(2)
+    try:
+        for i in range(5):
+            queue.enqueue('work', i)
+        deadline = time.monotonic() + 5
+        while len(calls) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        queue.stop()
+    assert sorted(calls) == [0, 1, 2, 3, 4]
@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+from sl.core.metrics import Metrics
+
+"""请求指标: 多个进程写入同一个目录时合并输出"""
+
+
+def test_render_single_process():
+    metrics = Metrics()
+    metrics.observe('GET', '/items', 200, 0.02, 150)
+    metrics.observe('GET', '/items', 200, 0.2, 50)
+    text = metrics.render()
+    assert 'http_requests_total{method="GET",route="/items",status="200"} 2' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/items",le="0.025"} 1' in text
+    assert 'http_response_size_bytes_sum{method="GET",route="/items"} 200' in text
+
+
+def test_workers_are_merged(tmp_path):
+    # 模拟两个工作进程: 快照文件名取 pid，这里改成各自的文件
+    a = Metrics(directory=str(tmp_path))
+    b = Metrics(directory=str(tmp_path))
+    a.observe('GET', '/items', 200, 0.02, 100)
+    os.rename(tmp_path / f'{os.getpid()}.json', tmp_path / '1.json')
+    b.observe('GET', '/items', 200, 0.02, 100)
+    b.observe('GET', '/items', 404, 0.02, 10)
+    os.rename(tmp_path / f'{os.getpid()}.json', tmp_path / '2.json')
+
+    c = Metrics(directory=str(tmp_path))
+    c.observe('POST', '/items', 201, 1.0, 10)
+    text = c.render()
+    assert 'http_requests_total{method="GET",route="/items",status="200"} 2' in text
+    assert 'http_requests_total{method="GET",route="/items",status="404"} 1' in text
+    assert 'http_requests_total{method="POST",route="/items",status="201"} 1' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/items"} 3' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/items",le="0.025"} 3' in text
+
+
+def test_flush_is_batched_in_event_loop(tmp_path):
+    metrics = Metrics(directory=str(tmp_path), flush_interval=0.05)
+    path = tmp_path / f'{os.getpid()}.json'
+
+    async def run():
+        for _ in range(100):
+            metrics.observe('GET', '/items', 200, 0.01, 10)
+        # 间隔内只安排一次写入
+        assert not path.exists()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert path.exists()
+    os.rename(path, tmp_path / '1.json')
+    assert 'status="200"} 100' in Metrics(directory=str(tmp_path)).render()
+
+
+def test_route_labels_include_router_prefix():
+    from fastapi import APIRouter, FastAPI
+    from starlette.routing import Mount, Route, Router
+    from starlette.responses import PlainTextResponse
+    from starlette.testclient import TestClient
+
+    from sl.core.metrics import MetricsMiddleware
+
+    def make_router():
+        router = APIRouter()
+
+        @router.get('/items/{item_id}')
+        async def read_item(item_id: int):
+            return {'item_id': item_id}
+
+        return router
+
+    app = FastAPI()
+    # 相同路径的路由挂在不同的前缀下
+    app.include_router(make_router(), prefix='/a')
+    app.include_router(make_router(), prefix='/b')
+    # mount 的子应用中 path_format 不包含挂载的前缀
+    app.mount('/c', Router(routes=[Route('/items/{item_id}', lambda request: PlainTextResponse('ok'))]))
+    sub = FastAPI()
+    sub.include_router(make_router())
+    app.mount('/d', sub)
+    metrics = Metrics()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    client = TestClient(app)
+    for path in ('/a/items/1', '/b/items/2', '/b/items/3', '/c/items/4', '/d/items/5'):
+        assert client.get(path).status_code == 200
+    assert metrics.requests == {
+        ('GET', '/a/items/{item_id}', 200): 1,
+        ('GET', '/b/items/{item_id}', 200): 2,
+        ('GET', '/c/items/{item_id}', 200): 1,
+        ('GET', '/d/items/{item_id}', 200): 1,
+    }
+    # 部署时配置的 root_path(代理转发的前缀) 不计入标签
+    client = TestClient(app, root_path='/api')
+    assert client.get('/api/d/items/6').status_code == 200
+    assert metrics.requests[('GET', '/d/items/{item_id}', 200)] == 2
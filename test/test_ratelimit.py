@@ -0,0 +1,100 @@
+import asyncio
+import secrets
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from sl.core.ratelimit import MemoryBucketBackend, RateLimiter, RateLimitMiddleware, parse_rate
+
+"""令牌桶的计算、过期桶的清理和限流中间件"""
+
+
+def test_parse_rate():
+    assert parse_rate('5/minute') == (5, 5 / 60)
+    assert parse_rate('10/Second') == (10, 10)
+    for rate in ('5', 'x/minute', '5/week'):
+        with pytest.raises(ValueError):
+            parse_rate(rate)
+
+
+def test_bucket_refills_at_rate():
+    backend = MemoryBucketBackend()
+    # 容量 3，每秒补充 1 个
+    assert [backend.take('a', 3, 1.0, now=0.0)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = backend.take('a', 3, 1.0, now=0.0)
+    assert not allowed and retry_after == pytest.approx(1.0)
+    # 0.5 秒后只补充了半个令牌
+    allowed, retry_after = backend.take('a', 3, 1.0, now=0.5)
+    assert not allowed and retry_after == pytest.approx(0.5)
+    assert backend.take('a', 3, 1.0, now=1.0) == (True, 0.0)
+    # 很久没有请求，最多补满到容量
+    assert [backend.take('a', 3, 1.0, now=100.0)[0] for _ in range(4)] == [True, True, True, False]
+    # 不同的键互不影响
+    assert backend.take('b', 3, 1.0, now=100.0) == (True, 0.0)
+
+
+def test_sweep_removes_refilled_buckets():
+    backend = MemoryBucketBackend()
+    for i in range(5):
+        backend.take(f'k{i}', 2, 1.0, now=0.0)
+    assert len(backend) == 5
+    # 1 秒后前面的桶都已补满，下一次请求顺带清理
+    backend.take('new', 2, 1.0, now=1.0)
+    assert len(backend) == 1
+
+
+def test_sweep_keeps_at_most_max_keys():
+    backend = MemoryBucketBackend(max_keys=3)
+    for i in range(10):
+        backend.take(f'k{i}', 100, 1.0, now=0.0)
+    assert len(backend) == 3
+
+
+def make_client(default: str = '3/minute') -> TestClient:
+    app = Starlette(routes=[Route('/', lambda request: PlainTextResponse('ok'))])
+    limiter = RateLimiter(backend=MemoryBucketBackend(), default=default)
+    return TestClient(RateLimitMiddleware(app, limiter=limiter))
+
+
+def test_middleware_limits_by_ip():
+    client = make_client()
+    assert [client.get('/').status_code for _ in range(5)] == [200, 200, 200, 429, 429]
+    response = client.get('/')
+    assert response.headers['Retry-After'] == '20'
+    assert response.headers['X-RateLimit-Limit'] == '3/minute'
+
+
+def test_random_tokens_do_not_bypass_the_limit():
+    client = make_client()
+    statuses = [
+        client.get('/', headers={'Authorization': f'Bearer {secrets.token_hex(16)}'}).status_code
+        for _ in range(10)
+    ]
+    assert statuses == [200] * 3 + [429] * 7
+
+
+def test_token_is_limited_across_ips():
+    client = make_client()
+    middleware = client.app
+    headers = [(b'authorization', b'Bearer shared')]
+
+    async def call(ip: str) -> int:
+        messages = []
+        scope = {'type': 'http', 'path': '/', 'method': 'GET', 'headers': headers, 'client': (ip, 1234),
+                 'query_string': b'', 'root_path': ''}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware(scope, receive, send)
+        return messages[0]['status']
+
+    # 每个IP都还有令牌，同一个 token 的第4次请求被拒绝
+    statuses = [asyncio.run(call(f'10.0.0.{i}')) for i in range(4)]
+    assert statuses == [200, 200, 200, 429]
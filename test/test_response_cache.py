@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from sl.core.cache import MemoryCache
+from sl.core.response_cache import ResponseCache
+
+"""响应缓存: 命中、标签失效和同一个键并发未命中时只执行一次接口"""
+
+
+def make_request(query: str = '', headers=()) -> Request:
+    return Request({
+        'type': 'http', 'method': 'GET', 'path': '/items', 'query_string': query.encode(),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+    })
+
+
+def make_endpoint(cache: ResponseCache, calls: list, body: bytes = b'[1]', status_code: int = 200,
+                  delay: float = 0.05):
+    @cache.cached(tags=['items'])
+    async def endpoint(request: Request):
+        calls.append(request)
+        await asyncio.sleep(delay)
+        return Response(body, status_code=status_code, media_type='application/json', headers={'ETag': 'W/"1"'})
+
+    return endpoint
+
+
+def test_hit_and_invalidate():
+    cache = ResponseCache(MemoryCache())
+    calls = []
+    endpoint = make_endpoint(cache, calls, delay=0)
+
+    async def run():
+        first = await endpoint(request=make_request('b=2&a=1'))
+        # 参数顺序不同，共用同一份缓存
+        second = await endpoint(request=make_request('a=1&b=2'))
+        conditional = await endpoint(request=make_request('a=1&b=2', [('If-None-Match', 'W/"1"')]))
+        cache.invalidate('items')
+        third = await endpoint(request=make_request('a=1&b=2'))
+        return first, second, conditional, third
+
+    first, second, conditional, third = asyncio.run(run())
+    assert len(calls) == 2
+    assert [first.headers['X-Cache'], second.headers['X-Cache'], third.headers['X-Cache']] == ['MISS', 'HIT', 'MISS']
+    assert second.body == first.body
+    assert conditional.status_code == 304 and conditional.body == b''
+
+
+def test_concurrent_misses_share_one_call_even_when_not_stored():
+    # 响应超过 max_entry_size 不会写入缓存，同时等待的请求仍然共用这一次的结果
+    cache = ResponseCache(MemoryCache(), max_entry_size=1)
+    calls = []
+    endpoint = make_endpoint(cache, calls, body=b'[1, 2, 3]')
+
+    async def run():
+        return await asyncio.gather(*[endpoint(request=make_request()) for _ in range(10)])
+
+    start = time.perf_counter()
+    responses = asyncio.run(run())
+    assert time.perf_counter() - start < 0.3
+    assert len(calls) == 1
+    assert {response.body for response in responses} == {b'[1, 2, 3]'}
+    assert len(cache.backend) == 0
+
+
+def test_unshareable_responses_run_in_parallel():
+    cache = ResponseCache(MemoryCache())
+    calls = []
+    endpoint = make_endpoint(cache, calls, status_code=404)
+
+    async def run():
+        return await asyncio.gather(*[endpoint(request=make_request()) for _ in range(10)])
+
+    start = time.perf_counter()
+    responses = asyncio.run(run())
+    # 第一个请求之后其余的请求并行执行，而不是逐个排队
+    assert time.perf_counter() - start < 0.3
+    assert len(calls) == 10
+    assert {response.status_code for response in responses} == {404}
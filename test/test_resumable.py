@@ -0,0 +1,112 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from sl.api.resumable import UploadStore
+
+"""分块续传: 区间索引、重叠检查，以及多个进程共用同一个目录"""
+
+
+class ChunkRequest:
+    """只提供 put_chunk 用到的 stream()"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def stream(self):
+        yield self.data
+
+
+def put(store: UploadStore, upload_id: str, offset: int, data: bytes) -> dict:
+    return asyncio.run(store.put_chunk(upload_id, offset, ChunkRequest(data)))
+
+
+def make_store(directory, **kwargs) -> UploadStore:
+    return UploadStore(str(directory), max_file_size=1000, max_chunk_size=100, **kwargs)
+
+
+def test_ranges_and_missing(tmp_path):
+    store = make_store(tmp_path)
+    upload_id = store.create('a.bin', 300)['upload_id']
+    put(store, upload_id, 0, b'a' * 100)
+    status = put(store, upload_id, 200, b'c' * 100)
+    assert status['ranges'] == [[0, 100], [200, 300]]
+    assert status['missing'] == [[100, 200]]
+    assert not status['complete']
+    status = put(store, upload_id, 100, b'b' * 100)
+    assert status['ranges'] == [[0, 300]]
+    assert status['missing'] == []
+    assert status['complete']
+
+
+def test_overlap_is_rejected_and_same_offset_is_replaced(tmp_path):
+    store = make_store(tmp_path)
+    upload_id = store.create('a.bin', 300)['upload_id']
+    put(store, upload_id, 100, b'b' * 100)
+    for offset, length in ((50, 100), (150, 10), (199, 1), (99, 2)):
+        with pytest.raises(HTTPException) as e:
+            put(store, upload_id, offset, b'x' * length)
+        assert e.value.status_code == 409
+    # 相邻的块不算重叠
+    put(store, upload_id, 0, b'a' * 100)
+    # 相同 offset 重传，替换原来的块
+    status = put(store, upload_id, 100, b'B' * 50)
+    assert status['ranges'] == [[0, 150]]
+    assert status['received'] == 150
+    # 失败的块不会留下临时文件
+    assert sorted(os.listdir(store.get(upload_id).chunks_dir)) == [f'{0:020d}', f'{100:020d}']
+
+
+def test_two_stores_share_one_directory(tmp_path):
+    # 模拟两个工作进程: 各自的 UploadStore 接收同一个会话的不同块
+    a, b = make_store(tmp_path), make_store(tmp_path)
+    upload_id = a.create('a.bin', 200)['upload_id']
+    put(a, upload_id, 0, b'a' * 100)
+    put(b, upload_id, 100, b'b' * 100)
+    assert a.get(upload_id).status()['missing'] == []
+    with pytest.raises(HTTPException) as e:
+        put(a, upload_id, 150, b'x' * 10)
+    assert e.value.status_code == 409
+
+    result = asyncio.run(a.complete(upload_id))
+    assert result['path'] == f'{upload_id}-a.bin'
+    with open(tmp_path / result['path'], 'rb') as f:
+        assert f.read() == b'a' * 100 + b'b' * 100
+    with pytest.raises(HTTPException) as e:
+        b.get(upload_id)
+    assert e.value.status_code == 404
+
+
+def test_incomplete_upload_cannot_complete(tmp_path):
+    store = make_store(tmp_path)
+    upload_id = store.create('a.bin', 200)['upload_id']
+    put(store, upload_id, 0, b'a' * 100)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(store.complete(upload_id))
+    assert e.value.status_code == 409
+    # 没有留下 completing 标记，之后还可以继续上传
+    put(store, upload_id, 100, b'b' * 100)
+
+
+def test_expired_sessions_are_removed(tmp_path):
+    store = make_store(tmp_path, session_ttl=60)
+    old = store.create('old.bin', 200)['upload_id']
+    put(store, old, 0, b'a' * 100)
+    fresh = store.create('fresh.bin', 200)['upload_id']
+    # 把创建时间和最后一次收到块的时间改到两分钟之前
+    past = time.time() - 120
+    meta_path = os.path.join(store.sessions_dir, old, 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    with open(meta_path, 'w') as f:
+        json.dump({**meta, 'created_at': past}, f)
+    os.utime(store.get(old).chunks_dir, (past, past))
+    assert store.cleanup_expired(force=True) == 1
+    assert os.listdir(store.sessions_dir) == [fresh]
+    with pytest.raises(HTTPException) as e:
+        store.get(old)
+    assert e.value.status_code == 404
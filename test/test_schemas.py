@@ -0,0 +1,66 @@
+from datetime import date, datetime
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from sl.api import curd, schemas
+from sl.api.models import city
+from sl.db.base import Base
+
+"""列表接口的快速序列化: dump_cities / dump_data 的输出与 List[ReadCity] / List[ReadData] 完全相同"""
+
+
+def make_session(tmp_path) -> Session:
+    engine = create_engine(f'sqlite:///{tmp_path / "schemas.db"}')
+    Base.metadata.create_all(engine)
+    session = Session(engine)
+    created = datetime(2024, 1, 1, 8, 30, 15, 123456)
+    session.add_all([
+        city.City(province='北京', country='中国', country_code='CN', country_population=1_400_000_000,
+                  created_at=created, updated_at=created),
+        city.City(province='a"b\\c', country='x', country_code='X', country_population=0,
+                  created_at=created, updated_at=datetime(2024, 2, 29)),
+    ])
+    session.flush()
+    session.add_all([
+        city.Data(city_id=1, date=date(2020, 1, day), confirmed=day * 1000, deaths=day, recovered=0,
+                  created_at=created, updated_at=created)
+        for day in range(1, 4)
+    ])
+    session.commit()
+    return session
+
+
+def test_dump_cities_matches_read_city(tmp_path):
+    session = make_session(tmp_path)
+    rows = session.execute(select(*curd.CITY_COLUMNS).order_by(city.City.id)).all()
+    orm = session.execute(select(city.City).order_by(city.City.id)).scalars().all()
+    expected = TypeAdapter(List[schemas.ReadCity]).dump_json(
+        [schemas.ReadCity.model_validate(item) for item in orm]
+    )
+    assert schemas.dump_cities(rows) == expected
+
+
+def test_dump_data_matches_read_data(tmp_path):
+    session = make_session(tmp_path)
+    rows = session.execute(select(*curd.DATA_COLUMNS).order_by(city.Data.id)).all()
+    orm = session.execute(select(city.Data).order_by(city.Data.id)).scalars().all()
+    expected = TypeAdapter(List[schemas.ReadData]).dump_json(
+        [schemas.ReadData.model_validate(item) for item in orm]
+    )
+    assert schemas.dump_data(rows) == expected
+
+
+def test_dump_empty():
+    assert schemas.dump_cities([]) == b'[]'
+    assert schemas.dump_data([]) == b'[]'
+
+
+def test_row_fields_match_read_models():
+    # 新增字段时 TypedDict、查询列和 Read 模型需要同时修改
+    assert list(schemas.CityRow.__annotations__) == list(schemas.ReadCity.model_fields)
+    assert list(schemas.DataRow.__annotations__) == list(schemas.ReadData.model_fields)
+    assert [column.key for column in curd.CITY_COLUMNS] == list(schemas.ReadCity.model_fields)
+    assert [column.key for column in curd.DATA_COLUMNS] == list(schemas.ReadData.model_fields)
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from sl.api.endpoints import demo4
+from sl.core.security import PasswordHasher, PasswordHasherBusy
+
+"""密码哈希的线程池: 排队超时返回 503，超时和取消都不会丢失许可"""
+
+
+class SlowContext:
+    """代替 CryptContext，verify 阻塞到 release 被设置"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def verify(self, plain_password, hashed_password):
+        self.release.wait(5)
+        return plain_password == hashed_password
+
+
+def test_busy_and_permits_are_kept():
+    context = SlowContext()
+    hasher = PasswordHasher(context, max_workers=1, queue_timeout=0.05)
+
+    async def run():
+        first = asyncio.ensure_future(hasher.verify('a', 'a'))
+        await asyncio.sleep(0.01)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.verify('b', 'b')
+        # 等待中被取消
+        waiting = asyncio.ensure_future(hasher.verify('c', 'c'))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        context.release.set()
+        assert await first
+        # 超时和取消之后许可数量不变
+        assert not hasher._semaphore.locked()
+        assert await asyncio.gather(hasher.verify('d', 'd'), hasher.verify('e', 'x')) == [True, False]
+
+    try:
+        asyncio.run(run())
+    finally:
+        hasher.shutdown()
+
+
+def test_permit_granted_while_timing_out_is_returned():
+    # 许可在超时的同时被分配: 放弃等待时要还回去，而不是丢失
+    context = SlowContext()
+    context.release.set()
+    hasher = PasswordHasher(context, max_workers=1, queue_timeout=0.05)
+
+    async def run():
+        hasher._ensure_started()
+        semaphore = hasher._semaphore
+        await semaphore.acquire()
+        acquire = asyncio.ensure_future(semaphore.acquire())
+        await asyncio.sleep(0)
+        semaphore.release()
+        await asyncio.sleep(0)
+        assert acquire.done() and acquire.result()
+        hasher._abandon(acquire)
+        assert not semaphore.locked()
+
+    try:
+        asyncio.run(run())
+    finally:
+        hasher.shutdown()
+
+
+def test_login_returns_503_when_busy(monkeypatch):
+    from sl.run import app
+
+    async def busy(*args):
+        raise PasswordHasherBusy()
+
+    monkeypatch.setattr(demo4.password_hasher, 'verify', busy)
+    client = TestClient(app)
+    response = client.post('/app4/jwt/token', data={'username': 'jiali', 'password': 'x'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_unauthorized_keeps_www_authenticate():
+    from sl.run import app
+
+    response = TestClient(app).post('/app4/jwt/users/me', headers={'Authorization': 'Bearer invalid'})
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
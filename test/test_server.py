@@ -0,0 +1,40 @@
+import uvicorn
+
+from sl import server
+from sl.core.config import Settings
+
+"""启动参数: 不同版本的 uvicorn"""
+
+
+def test_uvicorn_options_only_when_max_requests_set():
+    assert server.uvicorn_options(Settings()) == {}
+    options = server.uvicorn_options(Settings(server_max_requests=1000, server_max_requests_jitter=50))
+    assert options['limit_max_requests'] == 1000
+
+
+def test_uvicorn_options_skip_unknown_arguments(monkeypatch):
+    # 模拟没有 limit_max_requests_jitter 的旧版本
+    class Config:
+        def __init__(self, app, limit_max_requests=None):
+            pass
+
+    monkeypatch.setattr(uvicorn, 'Config', Config)
+    options = server.uvicorn_options(Settings(server_max_requests=1000, server_max_requests_jitter=50))
+    assert options == {'limit_max_requests': 1000}
+
+
+def test_prepare_metrics_dir_configures_the_shared_metrics(tmp_path, monkeypatch):
+    from sl.core import metrics as metrics_module
+    from sl.core.config import get_settings
+
+    monkeypatch.setenv('SL_METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics_module.metrics, 'directory', None)
+    (tmp_path / '123.json').write_text('{}')
+    get_settings.cache_clear()
+    try:
+        server.prepare_metrics_dir()
+    finally:
+        get_settings.cache_clear()
+    # gunicorn 预加载时工作进程继承的就是这个对象
+    assert metrics_module.metrics.directory == str(tmp_path)
+    assert list(tmp_path.iterdir()) == []